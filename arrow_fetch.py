@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Arrow Fetch Backend
+Alternative to pd.read_sql for the fact extraction queries: the result set is
+exported with `COPY (query) TO STDOUT (FORMAT csv)` and parsed by pyarrow's
+multithreaded CSV reader straight into columnar Arrow buffers. The DataFrame handed
+to the pipeline is Arrow-backed (pd.ArrowDtype), so no Python tuple or object is
+built per row and cell.
+
+Enabled with FETCH_BACKEND=arrow for queries whose caller provides a column type
+map (see FACT_ORDER_COLUMN_TYPES / FACT_DELIVERY_COLUMN_TYPES); other queries keep
+using pd.read_sql.
+"""
+
+import io
+import os
+import pandas as pd
+from database_utils import logger
+
+FETCH_BACKEND = os.getenv('FETCH_BACKEND', 'read_sql')
+
+COPY_NULL = '\\N'
+
+TIMESTAMPTZ_OID = 1184
+
+def get_arrow_type(type_name, type_oid=None):
+    """Map the type names used by the fact column type maps to Arrow types.
+
+    Timestamps and times are parsed into timestamp[us] / time64[us] (COPY renders them
+    as ISO text), so every upsert strategy gets real datetime and time columns; to_sql
+    would otherwise stage them as TEXT, which PostgreSQL does not assign to TIMESTAMP
+    or TIME columns. timestamptz sources (type_oid 1184) carry an offset and are parsed
+    as UTC; localize_timestamps converts them to the session time zone.
+    """
+    import pyarrow as pa
+    if type_name == 'timestamp':
+        return pa.timestamp('us', tz='UTC') if type_oid == TIMESTAMPTZ_OID else pa.timestamp('us')
+    return {
+        'string': pa.string(),
+        'date': pa.date32(),
+        'numeric': pa.float64(),
+        'integer': pa.int64(),
+        'time': pa.time64('us'),
+    }[type_name]
+
+def get_arrow_column_types(column_types, type_oids=None):
+    """Arrow types for a fact column type map, given {column: type_oid} of the result"""
+    type_oids = type_oids or {}
+    return {column: get_arrow_type(type_name, type_oids.get(column)) for column, type_name in column_types.items()}
+
+def arrow_types_mapper(arrow_type):
+    """Keep Arrow buffers behind every pandas column"""
+    return pd.ArrowDtype(arrow_type)
+
+def localize_timestamps(df, session_zone):
+    """Convert UTC-parsed timestamptz columns to the session time zone, as read_sql returns them"""
+    import pyarrow as pa
+    for column in df.columns:
+        dtype = df[column].dtype
+        if (isinstance(dtype, pd.ArrowDtype) and pa.types.is_timestamp(dtype.pyarrow_dtype)
+                and dtype.pyarrow_dtype.tz is not None):
+            df[column] = df[column].dt.tz_convert(session_zone)
+    return df
+
+def copy_query_to_buffer(engine, query, connection=None):
+    """Run COPY (query) TO STDOUT as CSV with a header.
+
+    Returns (buffer, type_oids, session_zone): the bytes buffer, {column: type_oid} of
+    the result and the session TimeZone. With an open SQLAlchemy connection the COPY
+    runs inside its transaction, which is left open for the caller.
+    """
+    from copy_export import describe_query
+
+    buffer = io.BytesIO()
+    copy_sql = f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true, NULL '{COPY_NULL}')"
+
+    def run(cursor):
+        description, session_zone = describe_query(cursor, query)
+        cursor.copy_expert(copy_sql, buffer)
+        cursor.close()
+        return buffer, {column[0]: column[1] for column in description}, session_zone
+
+    if connection is not None:
+        return run(connection.connection.cursor())
+
+    raw_conn = engine.raw_connection()
+    try:
+        result = run(raw_conn.cursor())
+        raw_conn.commit()
+    finally:
+        raw_conn.close()
+    return result
+
+def read_csv_buffer(buffer, column_types, type_oids=None):
+    """Parse a COPY CSV buffer into an Arrow table using the given column type map"""
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+
+    convert_options = pa_csv.ConvertOptions(
+        column_types=get_arrow_column_types(column_types, type_oids),
+        null_values=[COPY_NULL],
+        strings_can_be_null=True,
+        # COPY quotes empty strings, so "" stays an empty string and \N is NULL
+        quoted_strings_can_be_null=False,
+    )
+    return pa_csv.read_csv(pa.py_buffer(buffer.getbuffer()), convert_options=convert_options)
+
+def fetch_dataframe(engine, query, column_types, categorical_columns=None, dictionaries=None, connection=None):
+    """Fetch a query through COPY CSV + pyarrow and return an Arrow-backed DataFrame"""
+    buffer, type_oids, session_zone = copy_query_to_buffer(engine, query, connection)
+    table = read_csv_buffer(buffer, column_types, type_oids)
+    del buffer
+
+    df = localize_timestamps(table.to_pandas(types_mapper=arrow_types_mapper), session_zone)
+    logger.debug(f"Arrow fetch: {table.num_rows} rows, {table.nbytes / (1024 * 1024):.1f} MB of Arrow buffers")
+    if categorical_columns:
+        from frame_compaction import COMPACT_FRAMES, RunDictionaries
+        if COMPACT_FRAMES:
+            df = (dictionaries or RunDictionaries()).compact(df, categorical_columns)
+    return df
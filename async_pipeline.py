@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Async Pipeline
+asyncio sync engine built on asyncpg. The requested faktur_date range is split into
+partitions of ASYNC_PARTITION_DAYS days; up to ASYNC_MAX_CONCURRENCY partitions are
+in flight at once on a single event loop, each one extracting from a Database A
+pool and loading into a Database B pool while the others wait on the network.
+
+A partition is fetched as asyncpg records (no DataFrame), copied into a temporary
+staging table on Database B with binary COPY and merged into the fact table with
+the same INSERT ... SELECT ... ON CONFLICT statement as the postgres_fdw engine, so
+casts and de-duplication happen in SQL.
+
+Enabled with `--engine async` (or SYNC_ENGINE=async); falls back to the Python
+pipeline when asyncpg is not installed.
+"""
+
+import os
+import time
+import asyncio
+from datetime import timedelta
+from database_utils import DatabaseManager, logger
+from fact_pipeline import resolve_date_range
+
+ASYNC_PARTITION_DAYS = int(os.getenv('ASYNC_PARTITION_DAYS', 1))
+ASYNC_MAX_CONCURRENCY = int(os.getenv('ASYNC_MAX_CONCURRENCY', 8))
+# Connections per pool; loads are shorter than extracts so B needs fewer
+ASYNC_POOL_SIZE_A = int(os.getenv('ASYNC_POOL_SIZE_A', 8))
+ASYNC_POOL_SIZE_B = int(os.getenv('ASYNC_POOL_SIZE_B', 4))
+
+def async_available():
+    """Return True if asyncpg can be imported, logging the fallback otherwise"""
+    try:
+        import asyncpg  # noqa: F401
+        return True
+    except ImportError:
+        logger.warning("asyncpg is not installed, using the Python pipeline")
+        return False
+
+async def create_pool(config, size):
+    import asyncpg
+    return await asyncpg.create_pool(
+        host=config['host'], port=int(config['port'] or 5432), database=config['database'],
+        user=config['user'], password=config['password'], min_size=1, max_size=size,
+    )
+
+def get_partitions(date_from, date_to, days=ASYNC_PARTITION_DAYS):
+    """Split a date range into (from, to) partitions of days days"""
+    partitions = []
+    start = date_from
+    while start <= date_to:
+        end = min(start + timedelta(days=days - 1), date_to)
+        partitions.append((start, end))
+        start = end + timedelta(days=1)
+    return partitions
+
+async def sync_partition(pool_a, pool_b, fact_name, spec, date_from, date_to, semaphore):
+    """Extract one partition from A and merge it into B; returns rows upserted"""
+    from fdw_sync import get_select_upsert_query
+
+    async with semaphore:
+        start = time.perf_counter()
+        query = spec['build_query'](date_from=date_from, date_to=date_to)
+        async with pool_a.acquire() as conn_a:
+            statement = await conn_a.prepare(query)
+            attributes = statement.get_attributes()
+            records = await statement.fetch()
+        if not records:
+            logger.info(f"No {fact_name} rows for {date_from} to {date_to}")
+            return 0
+
+        # The staging table keeps the source types; the merge casts them like the transforms
+        staging = f"tmp_{fact_name}_{date_from:%Y%m%d}"
+        columns = [attribute.name for attribute in attributes]
+        column_definitions = ', '.join(
+            f'"{attribute.name}" {attribute.type.schema}.{attribute.type.name}' for attribute in attributes
+        )
+        async with pool_b.acquire() as conn_b:
+            async with conn_b.transaction():
+                await conn_b.execute(f"CREATE TEMP TABLE {staging} ({column_definitions}) ON COMMIT DROP")
+                await conn_b.copy_records_to_table(staging, records=records, columns=columns)
+                status = await conn_b.execute(get_select_upsert_query(spec, f"SELECT * FROM {staging}"))
+
+        rows = int(status.split()[-1])
+        logger.info(f"Upserted {rows} of {len(records)} {fact_name} rows for {date_from} to {date_to} "
+                    f"in {time.perf_counter() - start:.1f}s")
+        return rows
+
+async def run_async_facts(db_manager, fact_names, date_from, date_to):
+    """Sync fact_names over all partitions concurrently; returns {fact_name: rows}"""
+    from fact_specs import FACT_SPECS
+
+    partitions = get_partitions(date_from, date_to)
+    pool_a = await create_pool(db_manager.db_a_config, ASYNC_POOL_SIZE_A)
+    try:
+        pool_b = await create_pool(db_manager.db_b_config, ASYNC_POOL_SIZE_B)
+        try:
+            semaphore = asyncio.Semaphore(ASYNC_MAX_CONCURRENCY)
+            tasks = {
+                fact_name: [
+                    sync_partition(pool_a, pool_b, fact_name, FACT_SPECS[fact_name], start, end, semaphore)
+                    for start, end in partitions
+                ]
+                for fact_name in fact_names
+            }
+            results = await asyncio.gather(*[task for fact_tasks in tasks.values() for task in fact_tasks])
+        finally:
+            await pool_b.close()
+    finally:
+        await pool_a.close()
+
+    rows = {}
+    index = 0
+    for fact_name in fact_names:
+        rows[fact_name] = sum(results[index:index + len(partitions)])
+        index += len(partitions)
+    return rows
+
+def run_async_sync(sync_type, date_from=None, date_to=None, db_manager=None):
+    """Run a --sync choice on the asyncio engine; returns rows upserted"""
+    from fact_specs import FACT_SPECS, get_fact_names
+
+    db_manager = db_manager or DatabaseManager()
+    fact_names = get_fact_names(sync_type)
+    for fact_name in fact_names:
+        FACT_SPECS[fact_name]['create_table'](db_manager)
+    date_from, date_to = resolve_date_range(date_from, date_to)
+
+    try:
+        rows = asyncio.run(run_async_facts(db_manager, fact_names, date_from, date_to))
+    except Exception as e:
+        logger.error(f"Error running async sync of {sync_type}: {e}")
+        raise
+    for fact_name, fact_rows in rows.items():
+        logger.info(f"{fact_name} async sync completed successfully! ({fact_rows} rows)")
+    return sum(rows.values())
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Backfill Planner
+Splits a historical faktur_date range into ordered work units (fact x date window)
+and loads them with bounded parallelism, a source-side rate limit and a pace that
+backs off when Database A extraction latency rises. Completed units are recorded
+in tms_backfill_units so an interrupted backfill resumes where it stopped.
+"""
+
+import os
+import time
+import signal
+import threading
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from database_utils import DatabaseManager, logger
+from fact_pipeline import resolve_date_range, run_fact_pipeline
+from fact_specs import FACT_SPECS, get_fact_names
+
+BACKFILL_UNIT_DAYS = int(os.getenv('BACKFILL_UNIT_DAYS', 7))
+BACKFILL_MAX_CONCURRENCY = int(os.getenv('BACKFILL_MAX_CONCURRENCY', 2))
+BACKFILL_MAX_ROWS_PER_SECOND = float(os.getenv('BACKFILL_MAX_ROWS_PER_SECOND', 0))
+BACKFILL_LATENCY_FACTOR = float(os.getenv('BACKFILL_LATENCY_FACTOR', 2.0))
+BACKFILL_RETRIES = int(os.getenv('BACKFILL_RETRIES', 2))
+
+def create_backfill_state_table(db_manager):
+    """Create tms_backfill_units in Database B to track completed work units"""
+    create_table_query = """
+    CREATE TABLE IF NOT EXISTS tms_backfill_units (
+        fact_name VARCHAR(50) NOT NULL,
+        date_from DATE NOT NULL,
+        date_to DATE NOT NULL,
+        status VARCHAR(20) NOT NULL,
+        rows_processed INTEGER DEFAULT 0,
+        duration_seconds NUMERIC(12,2),
+        error_message TEXT,
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (fact_name, date_from, date_to)
+    );
+    """
+
+    try:
+        engine = db_manager.get_db_b_engine()
+        with engine.connect() as conn:
+            from sqlalchemy import text
+            conn.execute(text(create_table_query))
+            conn.commit()
+    except Exception as e:
+        logger.error(f"Error creating tms_backfill_units table: {e}")
+        raise
+
+def get_completed_units(db_manager):
+    """Return the set of (fact_name, date_from, date_to) already backfilled"""
+    engine = db_manager.get_db_b_engine()
+    with engine.connect() as conn:
+        from sqlalchemy import text
+        rows = conn.execute(text(
+            "SELECT fact_name, date_from, date_to FROM tms_backfill_units WHERE status = 'SUCCESS'"
+        )).fetchall()
+    return {tuple(row) for row in rows}
+
+def record_unit(db_manager, unit, status, rows=0, seconds=None, error_message=None):
+    """Upsert the outcome of a work unit into tms_backfill_units"""
+    try:
+        engine = db_manager.get_db_b_engine()
+        with engine.connect() as conn:
+            from sqlalchemy import text
+            conn.execute(text("""
+                INSERT INTO tms_backfill_units
+                    (fact_name, date_from, date_to, status, rows_processed, duration_seconds, error_message, updated_at)
+                VALUES (:fact_name, :date_from, :date_to, :status, :rows, :seconds, :error_message, CURRENT_TIMESTAMP)
+                ON CONFLICT (fact_name, date_from, date_to) DO UPDATE SET
+                    status = EXCLUDED.status,
+                    rows_processed = EXCLUDED.rows_processed,
+                    duration_seconds = EXCLUDED.duration_seconds,
+                    error_message = EXCLUDED.error_message,
+                    updated_at = EXCLUDED.updated_at
+            """), {
+                "fact_name": unit['fact'], "date_from": unit['date_from'], "date_to": unit['date_to'],
+                "status": status, "rows": rows, "seconds": seconds, "error_message": error_message,
+            })
+            conn.commit()
+    except Exception as e:
+        logger.error(f"Error recording backfill unit {describe_unit(unit)}: {e}")
+
+def plan_backfill(sync_type, date_from=None, date_to=None, unit_days=BACKFILL_UNIT_DAYS, newest_first=False):
+    """Split a date range into ordered work units of at most unit_days days per fact"""
+    date_from, date_to = resolve_date_range(date_from, date_to)
+    windows = []
+    window_start = date_from
+    while window_start <= date_to:
+        window_end = min(window_start + timedelta(days=unit_days - 1), date_to)
+        windows.append((window_start, window_end))
+        window_start = window_end + timedelta(days=1)
+    if newest_first:
+        windows.reverse()
+
+    return [
+        {'fact': fact_name, 'date_from': start, 'date_to': end, 'days': (end - start).days + 1}
+        for start, end in windows
+        for fact_name in get_fact_names(sync_type)
+    ]
+
+def describe_unit(unit):
+    return f"{unit['fact']} {unit['date_from']}..{unit['date_to']}"
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+class BackfillThrottle:
+    """Bounds concurrent source queries and rows/s, and adapts concurrency to source latency.
+
+    Extraction latency is tracked as seconds per 1000 rows. The best value seen is the
+    baseline; a unit slower than BACKFILL_LATENCY_FACTOR x baseline halves the allowed
+    concurrency (down to 1, then adds a cool-down pause), a unit close to the baseline
+    allows one more worker again, up to max_concurrency.
+    """
+
+    def __init__(self, max_concurrency, max_rows_per_second=0, latency_factor=BACKFILL_LATENCY_FACTOR,
+                 stop_event=None, source_router=None):
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = self.max_concurrency
+        self.max_rows_per_second = max_rows_per_second
+        self.latency_factor = latency_factor
+        self.stop_event = stop_event or threading.Event()
+        self.condition = threading.Condition()
+        self.active = 0
+        self.rows_done = 0
+        self.started = time.monotonic()
+        self.baseline = None
+        self.pause_until = 0.0
+        # Sheds concurrency while Database A is under pressure (source_routing.py)
+        self.source_router = source_router
+
+    def acquire(self):
+        """Block until a unit may start; returns False if the backfill is stopping"""
+        while not self.stop_event.is_set():
+            limit = self.limit
+            if self.source_router is not None:
+                limit = self.source_router.allowed_workers(limit)
+            with self.condition:
+                delay = self._delay()
+                if delay <= 0 and self.active < limit:
+                    self.active += 1
+                    return True
+                self.condition.wait(timeout=min(max(delay, 0.5), 5.0))
+        return False
+
+    def _delay(self):
+        """Seconds to wait for the rows/s limit and any latency cool-down"""
+        now = time.monotonic()
+        delay = self.pause_until - now
+        if self.max_rows_per_second > 0:
+            delay = max(delay, self.rows_done / self.max_rows_per_second - (now - self.started))
+        return delay
+
+    def release(self, rows, extract_seconds):
+        """Record a finished unit and adapt the allowed concurrency"""
+        with self.condition:
+            self.active -= 1
+            self.rows_done += rows
+            if rows > 0 and extract_seconds > 0:
+                self._adapt(extract_seconds * 1000 / rows)
+            self.condition.notify_all()
+
+    def _adapt(self, latency):
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+            return
+        if latency > self.baseline * self.latency_factor:
+            if self.limit > 1:
+                self.limit = max(1, self.limit // 2)
+                logger.warning(
+                    f"Source latency {latency:.3f}s/1k rows is above {self.latency_factor}x baseline "
+                    f"{self.baseline:.3f}s; concurrency reduced to {self.limit}"
+                )
+            else:
+                pause = min(10 * latency / self.baseline, 60.0)
+                self.pause_until = time.monotonic() + pause
+                logger.warning(
+                    f"Source latency {latency:.3f}s/1k rows is above {self.latency_factor}x baseline "
+                    f"{self.baseline:.3f}s at concurrency 1; pausing {pause:.0f}s"
+                )
+        elif latency < self.baseline * 1.2 and self.limit < self.max_concurrency:
+            self.limit += 1
+            logger.info(f"Source latency back near baseline; concurrency raised to {self.limit}")
+
+class BackfillProgress:
+    """Thread-safe progress and ETA reporting for a backfill"""
+
+    def __init__(self, units):
+        self.total_units = len(units)
+        self.total_days = sum(unit['days'] for unit in units) or 1
+        self.done_units = 0
+        self.done_days = 0
+        self.failed_units = 0
+        self.rows = 0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def update(self, unit, rows, failed=False):
+        with self.lock:
+            self.done_units += 1
+            self.done_days += unit['days']
+            self.rows += rows
+            self.failed_units += int(failed)
+            elapsed = time.monotonic() - self.started
+            eta = elapsed / self.done_days * (self.total_days - self.done_days)
+            rate = self.rows / elapsed if elapsed > 0 else 0.0
+            logger.info(
+                f"Backfill {self.done_units}/{self.total_units} units "
+                f"({self.done_days * 100 / self.total_days:.0f}%), {self.rows} rows, "
+                f"{rate:.0f} rows/s, elapsed {format_duration(elapsed)}, ETA {format_duration(eta)}"
+                + (f", {self.failed_units} failed" if self.failed_units else "")
+            )
+
+def run_backfill(sync_type='both', date_from=None, date_to=None, unit_days=BACKFILL_UNIT_DAYS,
+                 max_concurrency=BACKFILL_MAX_CONCURRENCY, max_rows_per_second=BACKFILL_MAX_ROWS_PER_SECOND,
+                 newest_first=False, restart=False):
+    """Plan and run a throttled backfill. Returns (rows_upserted, failed_units)."""
+    db_manager = DatabaseManager()
+    create_backfill_state_table(db_manager)
+    for fact_name in get_fact_names(sync_type):
+        FACT_SPECS[fact_name]['create_table'](db_manager)
+
+    units = plan_backfill(sync_type, date_from, date_to, unit_days, newest_first)
+    if not restart:
+        completed = get_completed_units(db_manager)
+        skipped = len(units)
+        units = [unit for unit in units
+                 if (unit['fact'], unit['date_from'], unit['date_to']) not in completed]
+        skipped -= len(units)
+        if skipped:
+            logger.info(f"Skipping {skipped} units already backfilled (use --restart to redo them)")
+
+    if not units:
+        logger.info("Nothing to backfill")
+        return 0, 0
+
+    logger.info(
+        f"Backfill plan: {len(units)} units of up to {unit_days} days, concurrency {max_concurrency}, "
+        + (f"max {max_rows_per_second:.0f} rows/s" if max_rows_per_second > 0 else "no rows/s limit")
+    )
+
+    stop_event = threading.Event()
+    def request_stop(signum, frame):
+        logger.info(f"Received signal {signum}, finishing running units and stopping backfill...")
+        stop_event.set()
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    throttle = BackfillThrottle(max_concurrency, max_rows_per_second, stop_event=stop_event,
+                                source_router=db_manager.source_router)
+    progress = BackfillProgress(units)
+    # One manager (and pool) per worker thread so stage timings are per unit
+    local = threading.local()
+    worker_managers = []
+
+    def run_unit(unit):
+        if not hasattr(local, 'db_manager'):
+            local.db_manager = DatabaseManager()
+            worker_managers.append(local.db_manager)
+        worker_db = local.db_manager
+        spec = FACT_SPECS[unit['fact']]
+
+        for attempt in range(BACKFILL_RETRIES + 1):
+            extract_before = worker_db.stage_timings.get('extract', 0.0)
+            start = time.perf_counter()
+            try:
+                rows = run_fact_pipeline(
+                    worker_db, unit['fact'], spec['table'], spec['keys'],
+                    spec['build_query'], spec['transform'],
+                    date_from=unit['date_from'], date_to=unit['date_to'],
+                    categorical_columns=spec['categorical_columns'],
+                    column_types=spec['column_types'],
+                    prepared_query=spec['prepared_query'],
+                )
+                seconds = time.perf_counter() - start
+                record_unit(db_manager, unit, 'SUCCESS', rows, round(seconds, 2))
+                throttle.release(rows, worker_db.stage_timings.get('extract', 0.0) - extract_before)
+                progress.update(unit, rows)
+                return rows
+            except Exception as e:
+                if attempt < BACKFILL_RETRIES and not stop_event.is_set():
+                    backoff = 10 * 2 ** attempt
+                    logger.warning(f"Backfill unit {describe_unit(unit)} failed ({e}); retrying in {backoff}s")
+                    stop_event.wait(backoff)
+                    continue
+                logger.error(f"Backfill unit {describe_unit(unit)} failed: {e}")
+                record_unit(db_manager, unit, 'FAILED', 0, round(time.perf_counter() - start, 2), str(e))
+                throttle.release(0, 0)
+                progress.update(unit, 0, failed=True)
+                return None
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=throttle.max_concurrency) as executor:
+        for unit in units:
+            if not throttle.acquire():
+                break
+            futures.append(executor.submit(run_unit, unit))
+
+    results = [future.result() for future in futures]
+    rows = sum(result for result in results if result)
+    failed = sum(1 for result in results if result is None)
+    not_started = len(units) - len(futures)
+
+    logger.info(
+        f"Backfill finished: {rows} rows, {len(futures) - failed}/{len(units)} units done, {failed} failed"
+        + (f", {not_started} not started (stopped)" if not_started else "")
+    )
+    for manager in worker_managers + [db_manager]:
+        manager.dispose_engines()
+    return rows, failed
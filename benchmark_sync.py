@@ -0,0 +1,508 @@
+#!/usr/bin/env python3
+"""
+Sync Pipeline Benchmark Program
+This program seeds a local Database A with synthetic TMS data at several scales,
+runs the fact_order and fact_delivery pipelines into a local Database B and
+records throughput, per-stage latency, peak memory and database-side counters.
+Results are stored as JSON and can be compared against a saved baseline.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from datetime import datetime
+from database_utils import DatabaseManager, get_process_rss_mb, logger
+from fact_order import process_fact_order
+from fact_delivery import process_fact_delivery
+
+BENCHMARK_DIR = os.getenv('BENCHMARK_DIR', 'benchmarks')
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+DEFAULT_SCALES = [1000, 10000, 100000]
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+# Marker table that identifies a Database A seeded by this program. Seeding
+# refuses to drop source tables unless the marker is present or the database is empty.
+BENCH_MARKER_TABLE = 'tms_bench_marker'
+
+# Allowed regression per metric, in percent, before the comparison fails
+DEFAULT_THRESHOLDS = {
+    'rows_per_sec': 10.0,
+    'total_seconds': 15.0,
+    'peak_rss_mb': 20.0,
+    'wal_bytes': 25.0,
+}
+
+# Metrics where a higher value is better; every other metric regresses upwards
+HIGHER_IS_BETTER = {'rows_per_sec'}
+
+PIPELINES = {
+    'fact_order': (process_fact_order, 'tms_fact_order'),
+    'fact_delivery': (process_fact_delivery, 'tms_fact_delivery'),
+}
+
+SOURCE_TABLES = [
+    'driver_task_confirmations', 'driver_tasks', 'order_detail', 'route_detail',
+    'route', '"order"', 'mst_location_child', 'mst_location_parent',
+    'mst_vehicle', 'dma_kenek', 'dma_driver',
+]
+
+def get_source_schema_sql():
+    """Return the DDL for the subset of the TMS source schema used by the fact queries"""
+    return """
+    CREATE TABLE dma_driver (
+        driver_id VARCHAR(50) PRIMARY KEY,
+        driver_name VARCHAR(100),
+        updated_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE dma_kenek (
+        kenek_id VARCHAR(50) PRIMARY KEY,
+        kenek_name VARCHAR(100),
+        updated_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE mst_vehicle (
+        mst_vehicle_id VARCHAR(50) PRIMARY KEY,
+        code VARCHAR(50),
+        plate_number VARCHAR(20),
+        updated_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE mst_location_parent (
+        mst_location_parent_id VARCHAR(50) PRIMARY KEY,
+        code VARCHAR(50),
+        "name" VARCHAR(200),
+        updated_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE mst_location_child (
+        mst_location_child_id VARCHAR(50) PRIMARY KEY,
+        mst_location_parent_id VARCHAR(50),
+        address TEXT,
+        address_text TEXT,
+        updated_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE "order" (
+        order_id VARCHAR(50) PRIMARY KEY,
+        status VARCHAR(50),
+        do_number VARCHAR(100),
+        faktur_date DATE,
+        delivery_date DATE,
+        created_date TIMESTAMP,
+        updated_date TIMESTAMP,
+        client_id VARCHAR(50),
+        warehouse_id VARCHAR(50),
+        origin_name VARCHAR(200),
+        origin_city VARCHAR(100),
+        customer_id VARCHAR(50)
+    );
+    CREATE TABLE order_detail (
+        order_detail_id BIGSERIAL PRIMARY KEY,
+        order_id VARCHAR(50),
+        quantity_faktur NUMERIC(15,2),
+        quantity_delivery NUMERIC(15,2),
+        quantity_unloading NUMERIC(15,2),
+        net_price NUMERIC(15,2)
+    );
+    CREATE TABLE route (
+        route_id VARCHAR(50) PRIMARY KEY,
+        manifest_reference VARCHAR(100),
+        manifest_integration_id VARCHAR(100),
+        external_expedition_type VARCHAR(50),
+        status VARCHAR(50),
+        driver_status VARCHAR(50),
+        driver_id VARCHAR(50),
+        kenek_id VARCHAR(50),
+        vehicle_id VARCHAR(50),
+        created_date TIMESTAMP
+    );
+    CREATE TABLE route_detail (
+        route_detail_id VARCHAR(50) PRIMARY KEY,
+        route_id VARCHAR(50),
+        order_id VARCHAR(50)
+    );
+    CREATE TABLE driver_tasks (
+        driver_task_id VARCHAR(50) PRIMARY KEY,
+        order_id VARCHAR(50),
+        complete_time TIMESTAMP
+    );
+    CREATE TABLE driver_task_confirmations (
+        driver_task_confirmation_id BIGSERIAL PRIMARY KEY,
+        driver_task_id VARCHAR(50),
+        location_confirmation_timestamp TIMESTAMP
+    );
+    CREATE INDEX ON order_detail(order_id);
+    CREATE INDEX ON route_detail(order_id);
+    CREATE INDEX ON route_detail(route_id);
+    CREATE INDEX ON driver_tasks(order_id);
+    CREATE INDEX ON driver_task_confirmations(driver_task_id);
+    CREATE INDEX ON "order"(faktur_date);
+    """
+
+def get_seed_data_sql():
+    """Return the statements that generate :orders synthetic orders and their related rows.
+
+    Orders are spread over :days faktur dates starting at :start_date with roughly
+    10 orders per route and 3 order lines per order.
+    """
+    return [
+        """
+        INSERT INTO dma_driver (driver_id, driver_name)
+        SELECT 'DRV' || g, 'Driver ' || g FROM generate_series(1, 500) g
+        """,
+        """
+        INSERT INTO dma_kenek (kenek_id, kenek_name)
+        SELECT 'KNK' || g, 'Kenek ' || g FROM generate_series(1, 500) g
+        """,
+        """
+        INSERT INTO mst_vehicle (mst_vehicle_id, code, plate_number)
+        SELECT 'VEH' || g, 'V-' || lpad(g::text, 4, '0'), 'B ' || (1000 + g) || ' TMS'
+        FROM generate_series(1, 400) g
+        """,
+        """
+        INSERT INTO mst_location_parent (mst_location_parent_id, code, "name")
+        SELECT 'LP' || g, 'CUST' || g, 'Customer ' || g FROM generate_series(1, 2000) g
+        """,
+        """
+        INSERT INTO mst_location_child (mst_location_child_id, mst_location_parent_id, address, address_text)
+        SELECT 'LC' || g, 'LP' || (1 + g % 2000), 'Jl. Benchmark No. ' || g, 'Kota ' || (g % 50)
+        FROM generate_series(1, 5000) g
+        """,
+        """
+        INSERT INTO route (route_id, manifest_reference, manifest_integration_id,
+                           external_expedition_type, status, driver_status,
+                           driver_id, kenek_id, vehicle_id, created_date)
+        SELECT 'RT' || g, 'MNF' || g, 'INT' || g,
+               (ARRAY['INTERNAL', 'EXTERNAL'])[1 + g % 2],
+               (ARRAY['OPEN', 'ON_ROUTE', 'DONE'])[1 + g % 3],
+               (ARRAY['ASSIGNED', 'STARTED', 'FINISHED'])[1 + g % 3],
+               'DRV' || (1 + g % 500), 'KNK' || (1 + g % 500), 'VEH' || (1 + g % 400),
+               CAST(:start_date AS timestamp) + (g % :days) * interval '1 day' + interval '6 hours'
+        FROM generate_series(1, GREATEST(:orders / 10, 1)) g
+        """,
+        """
+        INSERT INTO "order" (order_id, status, do_number, faktur_date, delivery_date,
+                             created_date, updated_date, client_id, warehouse_id,
+                             origin_name, origin_city, customer_id)
+        SELECT 'ORD' || g,
+               (ARRAY['NEW', 'ASSIGNED', 'DELIVERED', 'RETURNED'])[1 + g % 4],
+               'DO' || g,
+               CAST(:start_date AS date) + (g / 10) % :days,
+               CAST(:start_date AS date) + (g / 10) % :days + 1,
+               CAST(:start_date AS timestamp) + ((g / 10) % :days) * interval '1 day',
+               CAST(:start_date AS timestamp) + ((g / 10) % :days) * interval '1 day' + interval '20 hours',
+               'CL' || (1 + g % 20), 'WH' || (1 + g % 8),
+               'Gudang ' || (1 + g % 8), 'Kota ' || (g % 50), 'LC' || (1 + g % 5000)
+        FROM generate_series(1, :orders) g
+        """,
+        """
+        INSERT INTO order_detail (order_id, quantity_faktur, quantity_delivery, quantity_unloading, net_price)
+        SELECT 'ORD' || g, 10 + l, 9 + l, 8 + l, (g % 997) * 1000 + l * 250
+        FROM generate_series(1, :orders) g, generate_series(1, 3) l
+        """,
+        """
+        INSERT INTO route_detail (route_detail_id, route_id, order_id)
+        SELECT 'RD' || g, 'RT' || (1 + (g - 1) / 10), 'ORD' || g
+        FROM generate_series(1, :orders) g
+        """,
+        """
+        INSERT INTO driver_tasks (driver_task_id, order_id, complete_time)
+        SELECT 'DT' || g, 'ORD' || g,
+               CAST(:start_date AS timestamp) + ((g / 10) % :days) * interval '1 day' + interval '15 hours'
+        FROM generate_series(1, :orders) g
+        """,
+        """
+        INSERT INTO driver_task_confirmations (driver_task_id, location_confirmation_timestamp)
+        SELECT 'DT' || g,
+               CAST(:start_date AS timestamp) + ((g / 10) % :days) * interval '1 day' + interval '14 hours'
+        FROM generate_series(1, :orders) g
+        """,
+    ]
+
+def ensure_local_databases(db_manager, allow_remote=False, databases='AB'):
+    """Refuse to benchmark against anything but local databases unless explicitly allowed"""
+    configs = {'A': db_manager.db_a_config, 'B': db_manager.db_b_config}
+    for label in databases:
+        config = configs[label]
+        if config['host'] not in LOCAL_HOSTS and not allow_remote:
+            raise RuntimeError(
+                f"Database {label} host '{config['host']}' is not local. "
+                f"The benchmark drops and truncates tables; use --allow-remote to override."
+            )
+
+def seed_source_database(db_manager, orders, days=30, start_date='2025-01-01'):
+    """Recreate the synthetic source schema in Database A and fill it with data"""
+    engine = db_manager.get_db_a_engine()
+    from sqlalchemy import text
+
+    with engine.connect() as conn:
+        existing = conn.execute(text("""
+            SELECT table_name FROM information_schema.tables
+            WHERE table_schema = 'public' AND table_name IN ('order', :marker)
+        """), {"marker": BENCH_MARKER_TABLE}).fetchall()
+        existing = {row[0] for row in existing}
+        if 'order' in existing and BENCH_MARKER_TABLE not in existing:
+            raise RuntimeError(
+                "Database A contains an 'order' table that was not created by the benchmark. "
+                "Point DB_A_* at a dedicated local database."
+            )
+
+        for table in SOURCE_TABLES:
+            conn.execute(text(f"DROP TABLE IF EXISTS public.{table} CASCADE"))
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {BENCH_MARKER_TABLE} (seeded_at TIMESTAMP)"))
+
+        for statement in get_source_schema_sql().split(';'):
+            if statement.strip():
+                conn.execute(text(statement))
+
+        params = {"orders": orders, "days": days, "start_date": start_date}
+        for statement in get_seed_data_sql():
+            conn.execute(text(statement), params)
+
+        conn.execute(text(f"INSERT INTO {BENCH_MARKER_TABLE} VALUES (CURRENT_TIMESTAMP)"))
+        conn.execute(text("ANALYZE"))
+        conn.commit()
+
+    logger.info(f"Seeded Database A with {orders} orders over {days} days")
+
+def truncate_target_table(db_manager, table_name):
+    """Empty a fact table in Database B so the next run measures a cold load"""
+    engine = db_manager.get_db_b_engine()
+    from sqlalchemy import text
+
+    with engine.connect() as conn:
+        exists = conn.execute(text("SELECT to_regclass(:table_name)"), {"table_name": table_name}).scalar()
+        if exists:
+            conn.execute(text(f"TRUNCATE TABLE {table_name}"))
+            conn.commit()
+
+def get_db_counters(db_manager, table_name):
+    """Read the WAL position and tuple counters of a target table from Database B"""
+    engine = db_manager.get_db_b_engine()
+    from sqlalchemy import text
+
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_stat_clear_snapshot()"))
+        wal_lsn = conn.execute(text("SELECT pg_current_wal_lsn()::text")).scalar()
+        row = conn.execute(text("""
+            SELECT n_tup_ins, n_tup_upd, n_tup_hot_upd, n_tup_del
+            FROM pg_stat_user_tables
+            WHERE relname = :table_name
+        """), {"table_name": table_name}).fetchone()
+
+    counters = {'wal_lsn': wal_lsn, 'tup_ins': 0, 'tup_upd': 0, 'tup_hot_upd': 0, 'tup_del': 0}
+    if row:
+        counters.update({'tup_ins': row[0], 'tup_upd': row[1], 'tup_hot_upd': row[2], 'tup_del': row[3]})
+    return counters
+
+def get_wal_bytes_between(db_manager, start_lsn, end_lsn):
+    """Return the number of WAL bytes generated between two LSNs on Database B"""
+    engine = db_manager.get_db_b_engine()
+    from sqlalchemy import text
+
+    with engine.connect() as conn:
+        return int(conn.execute(
+            text("SELECT pg_wal_lsn_diff(CAST(:end_lsn AS pg_lsn), CAST(:start_lsn AS pg_lsn))"),
+            {"start_lsn": start_lsn, "end_lsn": end_lsn}
+        ).scalar())
+
+class PeakMemorySampler:
+    """Sample the process RSS in a background thread and keep the peak"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_rss_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_rss_mb = max(self.peak_rss_mb, get_process_rss_mb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak_rss_mb = get_process_rss_mb()
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        self.peak_rss_mb = max(self.peak_rss_mb, get_process_rss_mb())
+
+def run_case(db_manager, pipeline, phase, stats_delay=1.0):
+    """Run one pipeline once and return its measurements"""
+    process, table_name = PIPELINES[pipeline]
+    db_manager.stage_timings = {}
+
+    before = get_db_counters(db_manager, table_name)
+    with PeakMemorySampler() as sampler:
+        start = time.perf_counter()
+        rows = process(db_manager=db_manager)
+        total_seconds = time.perf_counter() - start
+
+    # Table statistics are flushed asynchronously by the backend that produced them
+    time.sleep(stats_delay)
+    after = get_db_counters(db_manager, table_name)
+
+    return {
+        'pipeline': pipeline,
+        'phase': phase,
+        'rows': rows,
+        'total_seconds': round(total_seconds, 4),
+        'rows_per_sec': round(rows / total_seconds, 2) if total_seconds > 0 else 0.0,
+        'stages': {stage: round(seconds, 4) for stage, seconds in db_manager.stage_timings.items()},
+        'peak_rss_mb': round(sampler.peak_rss_mb, 2),
+        'wal_bytes': get_wal_bytes_between(db_manager, before['wal_lsn'], after['wal_lsn']),
+        'tuples_inserted': after['tup_ins'] - before['tup_ins'],
+        'tuples_updated': after['tup_upd'] - before['tup_upd'],
+        'tuples_hot_updated': after['tup_hot_upd'] - before['tup_hot_upd'],
+    }
+
+def run_benchmark(scales, pipelines, days=30, seed=True, allow_remote=False):
+    """Run every pipeline at every scale, cold (empty target) and warm (all conflicts)"""
+    db_manager = DatabaseManager()
+    ensure_local_databases(db_manager, allow_remote)
+
+    results = []
+    for scale in scales:
+        if seed:
+            seed_source_database(db_manager, scale, days=days)
+
+        for pipeline in pipelines:
+            truncate_target_table(db_manager, PIPELINES[pipeline][1])
+            for phase in ('cold', 'warm'):
+                logger.info(f"Benchmarking {pipeline} at scale {scale} ({phase})...")
+                case = run_case(db_manager, pipeline, phase)
+                case['scale'] = scale
+                results.append(case)
+                logger.info(
+                    f"{pipeline} scale={scale} {phase}: {case['rows']} rows in {case['total_seconds']}s "
+                    f"({case['rows_per_sec']} rows/s, peak {case['peak_rss_mb']} MB, {case['wal_bytes']} WAL bytes)"
+                )
+
+    return {
+        'created_at': datetime.now().isoformat(),
+        'batch_size': db_manager.batch_size,
+        'days': days,
+        'results': results,
+    }
+
+def case_key(case):
+    """Identify a benchmark case independently of its measurements"""
+    return f"{case['pipeline']}/{case['scale']}/{case['phase']}"
+
+def compare_with_baseline(report, baseline, thresholds):
+    """Return a list of human readable regressions of report against baseline"""
+    baseline_cases = {case_key(case): case for case in baseline.get('results', [])}
+    regressions = []
+
+    for case in report['results']:
+        reference = baseline_cases.get(case_key(case))
+        if not reference:
+            continue
+
+        for metric, allowed_pct in thresholds.items():
+            old, new = reference.get(metric), case.get(metric)
+            if not old or new is None:
+                continue
+
+            change_pct = (new - old) / old * 100
+            regressed = change_pct < -allowed_pct if metric in HIGHER_IS_BETTER else change_pct > allowed_pct
+            if regressed:
+                regressions.append(
+                    f"{case_key(case)} {metric}: {old} -> {new} ({change_pct:+.1f}%, allowed {allowed_pct}%)"
+                )
+
+    return regressions
+
+def parse_thresholds(values):
+    """Merge METRIC=PCT overrides into the default regression thresholds"""
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    for value in values or []:
+        metric, _, pct = value.partition('=')
+        if not pct:
+            raise ValueError(f"Invalid threshold '{value}', expected METRIC=PCT")
+        thresholds[metric] = float(pct)
+    return thresholds
+
+def save_json(data, path):
+    """Write data as pretty-printed JSON, creating parent directories"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, default=str)
+    logger.info(f"Benchmark results written to {path}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the fact sync pipelines')
+    parser.add_argument('--scales',
+                       type=str,
+                       default=','.join(str(s) for s in DEFAULT_SCALES),
+                       help='Comma separated number of source orders per run (default: 1000,10000,100000)')
+    parser.add_argument('--pipeline',
+                       choices=['fact_order', 'fact_delivery', 'both'],
+                       default='both',
+                       help='Pipeline to benchmark (default: both)')
+    parser.add_argument('--days',
+                       type=int,
+                       default=30,
+                       help='Number of faktur dates the seeded orders are spread over (default: 30)')
+    parser.add_argument('--no-seed',
+                       action='store_true',
+                       help='Reuse the data already present in Database A')
+    parser.add_argument('--output',
+                       type=str,
+                       help='Result file (default: benchmarks/results/bench_<timestamp>.json)')
+    parser.add_argument('--baseline',
+                       type=str,
+                       default=DEFAULT_BASELINE,
+                       help=f'Baseline file to compare against (default: {DEFAULT_BASELINE})')
+    parser.add_argument('--save-baseline',
+                       action='store_true',
+                       help='Store this run as the new baseline')
+    parser.add_argument('--threshold',
+                       action='append',
+                       help='Allowed regression as METRIC=PCT, e.g. rows_per_sec=5 (repeatable)')
+    parser.add_argument('--allow-remote',
+                       action='store_true',
+                       help='Allow non-local database hosts (tables are dropped and truncated!)')
+
+    args = parser.parse_args()
+
+    try:
+        scales = [int(s) for s in args.scales.split(',') if s.strip()]
+        pipelines = list(PIPELINES) if args.pipeline == 'both' else [args.pipeline]
+        thresholds = parse_thresholds(args.threshold)
+
+        report = run_benchmark(scales, pipelines, days=args.days,
+                               seed=not args.no_seed, allow_remote=args.allow_remote)
+
+        output = args.output or os.path.join(
+            BENCHMARK_DIR, 'results', f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        save_json(report, output)
+
+        if args.save_baseline:
+            save_json(report, args.baseline)
+            return
+
+        if not os.path.exists(args.baseline):
+            logger.info(f"No baseline found at {args.baseline}; use --save-baseline to create one")
+            return
+
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = compare_with_baseline(report, baseline, thresholds)
+        if regressions:
+            logger.error(f"✗ {len(regressions)} performance regression(s) against {args.baseline}:")
+            for regression in regressions:
+                logger.error(f"  - {regression}")
+            sys.exit(1)
+
+        logger.info(f"✓ No regressions against {args.baseline}")
+
+    except Exception as e:
+        logger.error(f"Benchmark failed: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
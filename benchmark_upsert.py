@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Upsert Strategy Micro-Benchmark Program
+This program measures every upsert strategy from upsert_strategies against scratch
+copies of tms_fact_order and tms_fact_delivery in a local Database B, over a matrix
+of batch size, conflict ratio and row width, and recommends a strategy per table.
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+from datetime import datetime, date, timedelta
+from decimal import Decimal
+import pandas as pd
+from database_utils import DatabaseManager, logger
+from benchmark_sync import BENCHMARK_DIR, ensure_local_databases, save_json
+from upsert_strategies import UPSERT_STRATEGIES, get_upsert_strategy, get_column_types
+from fact_order import create_fact_order_table_schema_b
+from fact_delivery import create_fact_delivery_table_schema_b
+
+TABLES = {
+    'tms_fact_order': (create_fact_order_table_schema_b, ['order_id']),
+    'tms_fact_delivery': (create_fact_delivery_table_schema_b, ['route_id', 'route_detail_id', 'order_id']),
+}
+
+DEFAULT_BATCH_SIZES = [1000, 10000]
+DEFAULT_CONFLICT_RATIOS = [0.0, 0.5, 1.0]
+DEFAULT_ROW_WIDTHS = ['narrow', 'wide']
+
+def get_scratch_table_name(table_name):
+    """Return the name of the benchmark copy of a fact table"""
+    return f"bench_upsert_{table_name}"
+
+def create_scratch_table(db_manager, table_name):
+    """(Re)create an empty copy of a fact table, including its primary key"""
+    create_table, _ = TABLES[table_name]
+    create_table(db_manager)
+
+    engine = db_manager.get_db_b_engine()
+    from sqlalchemy import text
+    scratch = get_scratch_table_name(table_name)
+    with engine.connect() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {scratch}"))
+        conn.execute(text(f"CREATE TABLE {scratch} (LIKE {table_name} INCLUDING ALL)"))
+        column_types = get_column_types(conn, scratch)
+        conn.commit()
+    return column_types
+
+def drop_scratch_table(db_manager, table_name):
+    """Drop the benchmark copy of a fact table"""
+    engine = db_manager.get_db_b_engine()
+    from sqlalchemy import text
+    with engine.connect() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {get_scratch_table_name(table_name)}"))
+        conn.commit()
+
+def truncate_scratch_table(db_manager, table_name):
+    """Empty the benchmark copy of a fact table"""
+    engine = db_manager.get_db_b_engine()
+    from sqlalchemy import text
+    with engine.connect() as conn:
+        conn.execute(text(f"TRUNCATE TABLE {get_scratch_table_name(table_name)}"))
+        conn.commit()
+
+def generate_column(pg_type, rows, width, offset=0):
+    """Generate synthetic values for one column of the given PostgreSQL type"""
+    pg_type = pg_type.lower()
+    index = range(offset, offset + rows)
+
+    if pg_type.startswith(('character', 'text')):
+        if '(' in pg_type:
+            max_length = int(pg_type.split('(')[1].rstrip(')'))
+        else:
+            max_length = 400
+        length = max_length if width == 'wide' else min(max_length, 12)
+        return [f"v{i % 5000}".ljust(length, 'x')[:length] for i in index]
+    if pg_type == 'date':
+        return [date(2025, 1, 1) + timedelta(days=i % 60) for i in index]
+    if pg_type.startswith('timestamp with time zone'):
+        return [pd.Timestamp('2025-01-01', tz='UTC') + pd.Timedelta(minutes=i % 86400) for i in index]
+    if pg_type.startswith('timestamp'):
+        return [datetime(2025, 1, 1) + timedelta(minutes=i % 86400) for i in index]
+    if pg_type.startswith('time'):
+        return [(datetime(2025, 1, 1) + timedelta(seconds=i % 86400)).time() for i in index]
+    if pg_type.startswith('numeric'):
+        return [Decimal(i % 100000) / 100 for i in index]
+    return [str(i) for i in index]
+
+def generate_frame(column_types, unique_columns, rows, width, key_offset=0):
+    """Build a DataFrame shaped like a fact table with unique keys starting at key_offset"""
+    data = {}
+    for column, pg_type in column_types.items():
+        if column in unique_columns:
+            data[column] = [f"K{i}" for i in range(key_offset, key_offset + rows)]
+        elif width == 'narrow' and pg_type.lower() == 'text':
+            # Narrow rows leave the free-text columns (addresses) empty
+            data[column] = [None] * rows
+        else:
+            data[column] = generate_column(pg_type, rows, width)
+    return pd.DataFrame(data)
+
+def run_upsert_case(db_manager, table_name, strategy_name, df, batch_size, conflict_ratio):
+    """Time one strategy upserting df in batches into the scratch table"""
+    _, unique_columns = TABLES[table_name]
+    scratch = get_scratch_table_name(table_name)
+    schema = db_manager.db_b_config['schema']
+    engine = db_manager.get_db_b_engine()
+
+    # Pre-populate the share of keys that should conflict, outside of the timing
+    truncate_scratch_table(db_manager, table_name)
+    conflicting = int(len(df) * conflict_ratio)
+    if conflicting:
+        with engine.connect() as conn:
+            get_upsert_strategy('copy_text').upsert(conn, df.iloc[:conflicting], schema, scratch, unique_columns)
+            conn.commit()
+
+    strategy = get_upsert_strategy(strategy_name)
+    batch_latencies = []
+    start = time.perf_counter()
+    for batch_start in range(0, len(df), batch_size):
+        batch = df.iloc[batch_start:batch_start + batch_size]
+        batch_begin = time.perf_counter()
+        with engine.connect() as conn:
+            strategy.upsert(conn, batch, schema, scratch, unique_columns)
+            conn.commit()
+        batch_latencies.append(time.perf_counter() - batch_begin)
+    total_seconds = time.perf_counter() - start
+
+    return {
+        'total_seconds': round(total_seconds, 4),
+        'rows_per_sec': round(len(df) / total_seconds, 2) if total_seconds > 0 else 0.0,
+        'batch_p50_seconds': round(statistics.median(batch_latencies), 4),
+        'batch_max_seconds': round(max(batch_latencies), 4),
+    }
+
+def recommend_strategies(results):
+    """Pick, per table, the strategy with the best geometric-mean throughput over all conditions"""
+    recommendations = {}
+    for table_name in {case['table'] for case in results}:
+        scores = {}
+        for strategy_name in {case['strategy'] for case in results if case['table'] == table_name}:
+            throughputs = [case['rows_per_sec'] for case in results
+                           if case['table'] == table_name and case['strategy'] == strategy_name
+                           and not case.get('error')]
+            conditions = [case for case in results if case['table'] == table_name and case['strategy'] == strategy_name]
+            # A strategy that failed in any condition (e.g. MERGE on PostgreSQL < 15) is not eligible
+            if throughputs and len(throughputs) == len(conditions):
+                scores[strategy_name] = statistics.geometric_mean(throughputs)
+        if scores:
+            best = max(scores, key=scores.get)
+            recommendations[table_name] = {
+                'strategy': best,
+                'geomean_rows_per_sec': round(scores[best], 2),
+                'scores': {name: round(score, 2) for name, score in sorted(scores.items(), key=lambda item: -item[1])},
+            }
+    return recommendations
+
+def run_matrix(tables, strategies, rows, batch_sizes, conflict_ratios, row_widths, allow_remote=False):
+    """Run every strategy for every combination of table, batch size, conflict ratio and width"""
+    db_manager = DatabaseManager()
+    ensure_local_databases(db_manager, allow_remote, databases='B')
+
+    results = []
+    for table_name in tables:
+        column_types = create_scratch_table(db_manager, table_name)
+        column_types.pop('last_synced', None)
+        _, unique_columns = TABLES[table_name]
+
+        try:
+            for width in row_widths:
+                df = generate_frame(column_types, unique_columns, rows, width)
+                for batch_size in batch_sizes:
+                    for conflict_ratio in conflict_ratios:
+                        for strategy_name in strategies:
+                            case = {
+                                'table': table_name,
+                                'strategy': strategy_name,
+                                'rows': rows,
+                                'row_width': width,
+                                'batch_size': batch_size,
+                                'conflict_ratio': conflict_ratio,
+                            }
+                            try:
+                                case.update(run_upsert_case(db_manager, table_name, strategy_name,
+                                                            df, batch_size, conflict_ratio))
+                                logger.info(
+                                    f"{table_name} {strategy_name:<15} width={width:<6} batch={batch_size:<6} "
+                                    f"conflicts={conflict_ratio:.0%}: {case['rows_per_sec']} rows/s"
+                                )
+                            except Exception as e:
+                                logger.warning(f"{table_name} {strategy_name} failed: {e}")
+                                case['error'] = str(e)
+                                case['rows_per_sec'] = 0.0
+                            results.append(case)
+        finally:
+            drop_scratch_table(db_manager, table_name)
+
+    return {
+        'created_at': datetime.now().isoformat(),
+        'results': results,
+        'recommendations': recommend_strategies(results),
+    }
+
+def parse_list(value, cast):
+    """Parse a comma separated command line list"""
+    return [cast(item) for item in value.split(',') if item.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the upsert strategies of upsert_dataframe_to_db')
+    parser.add_argument('--table',
+                       choices=list(TABLES) + ['all'],
+                       default='all',
+                       help='Fact table shape to benchmark (default: all)')
+    parser.add_argument('--strategies',
+                       type=str,
+                       default=','.join(UPSERT_STRATEGIES),
+                       help='Comma separated strategies (default: all)')
+    parser.add_argument('--rows',
+                       type=int,
+                       default=20000,
+                       help='Rows upserted per case (default: 20000)')
+    parser.add_argument('--batch-sizes',
+                       type=str,
+                       default=','.join(str(b) for b in DEFAULT_BATCH_SIZES),
+                       help='Comma separated batch sizes (default: 1000,10000)')
+    parser.add_argument('--conflict-ratios',
+                       type=str,
+                       default=','.join(str(c) for c in DEFAULT_CONFLICT_RATIOS),
+                       help='Comma separated share of rows that already exist (default: 0,0.5,1)')
+    parser.add_argument('--row-widths',
+                       type=str,
+                       default=','.join(DEFAULT_ROW_WIDTHS),
+                       help='Comma separated row widths: narrow, wide (default: both)')
+    parser.add_argument('--output',
+                       type=str,
+                       help='Result file (default: benchmarks/results/upsert_<timestamp>.json)')
+    parser.add_argument('--allow-remote',
+                       action='store_true',
+                       help='Allow a non-local Database B host')
+
+    args = parser.parse_args()
+
+    try:
+        tables = list(TABLES) if args.table == 'all' else [args.table]
+        strategies = parse_list(args.strategies, str)
+        for strategy_name in strategies:
+            get_upsert_strategy(strategy_name)
+
+        report = run_matrix(
+            tables, strategies, args.rows,
+            parse_list(args.batch_sizes, int),
+            parse_list(args.conflict_ratios, float),
+            parse_list(args.row_widths, str),
+            allow_remote=args.allow_remote,
+        )
+
+        output = args.output or os.path.join(
+            BENCHMARK_DIR, 'results', f"upsert_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        save_json(report, output)
+
+        print("\nRecommended upsert strategies (add to config.env):")
+        for table_name, recommendation in sorted(report['recommendations'].items()):
+            print(f"UPSERT_STRATEGY_{table_name.upper()}={recommendation['strategy']}"
+                  f"  # {recommendation['geomean_rows_per_sec']} rows/s geomean")
+
+    except Exception as e:
+        logger.error(f"Upsert benchmark failed: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Change Data Capture Ingestion
+Consumes row changes on the TMS source tables from a PostgreSQL logical replication
+slot on Database A (test_decoding or wal2json output), maps them to the affected
+order_ids and recomputes only those fact rows in Database B in micro-batches.
+
+Deletes on order_detail, route_detail, driver_tasks and driver_task_confirmations
+only carry the replica identity, so those tables need REPLICA IDENTITY FULL for
+deletes to be mapped to their order.
+"""
+
+import os
+import re
+import json
+import time
+import select
+import signal
+from datetime import datetime
+import pytz
+from database_utils import DatabaseManager, logger, sql_literal_list
+from fact_pipeline import resolve_date_range
+from fact_specs import FACT_SPECS
+
+CDC_SLOT_NAME = os.getenv('CDC_SLOT_NAME', 'tms_dwh_cdc')
+CDC_PLUGIN = os.getenv('CDC_PLUGIN', 'test_decoding')
+CDC_BATCH_SECONDS = float(os.getenv('CDC_BATCH_SECONDS', 2))
+CDC_BATCH_MAX_ORDERS = int(os.getenv('CDC_BATCH_MAX_ORDERS', 5000))
+
+# Source table -> column carrying the key and how that key maps to order_ids.
+# 'order' keys are order_ids already; 'route' and 'driver_task' keys are resolved on Database A.
+CDC_TABLES = {
+    'order': ('order_id', 'order'),
+    'order_detail': ('order_id', 'order'),
+    'route_detail': ('order_id', 'order'),
+    'driver_tasks': ('order_id', 'order'),
+    'route': ('route_id', 'route'),
+    'driver_task_confirmations': ('driver_task_id', 'driver_task'),
+}
+
+# Orders per recompute query
+REFRESH_BATCH_SIZE = 1000
+
+TEST_DECODING_CHANGE = re.compile(r'^table (?P<table>.+?): (?P<action>INSERT|UPDATE|DELETE|TRUNCATE):(?P<data>.*)$')
+TEST_DECODING_COLUMN = re.compile(r'''(?P<name>"[^"]+"|[\w$]+)\[[^\]]+\]:(?P<value>'(?:[^']|'')*'|\S+)''')
+
+def parse_test_decoding(payload):
+    """Parse one test_decoding message into (table, action, [(column, value), ...]).
+
+    Returns None for BEGIN/COMMIT and other non-row messages. UPDATEs with an
+    old-key section yield both the old and the new key values.
+    """
+    match = TEST_DECODING_CHANGE.match(payload)
+    if not match:
+        return None
+
+    table = match.group('table').split('.')[-1].strip('"')
+    values = []
+    for column in TEST_DECODING_COLUMN.finditer(match.group('data')):
+        value = column.group('value')
+        if value == 'null' or value == 'unchanged-toast-datum':
+            continue
+        if value.startswith("'"):
+            value = value[1:-1].replace("''", "'")
+        values.append((column.group('name').strip('"'), value))
+    return table, match.group('action'), values
+
+def parse_wal2json(payload):
+    """Parse one wal2json (format-version 2) message like parse_test_decoding"""
+    message = json.loads(payload)
+    if message.get('action') not in ('I', 'U', 'D', 'T'):
+        return None
+
+    values = []
+    for section in ('identity', 'columns'):
+        for column in message.get(section) or []:
+            if column.get('value') is not None:
+                values.append((column['name'], str(column['value'])))
+    action = {'I': 'INSERT', 'U': 'UPDATE', 'D': 'DELETE', 'T': 'TRUNCATE'}[message['action']]
+    return message['table'], action, values
+
+PARSERS = {
+    'test_decoding': parse_test_decoding,
+    'wal2json': parse_wal2json,
+}
+
+def get_replication_options(plugin):
+    """Return the output plugin options for the CDC slot"""
+    if plugin == 'wal2json':
+        tables = ','.join([f'public.{table}' for table in CDC_TABLES])
+        return {'format-version': '2', 'add-tables': tables}
+    return {'include-xids': '0', 'skip-empty-xacts': '1'}
+
+class ChangeBatch:
+    """Keys touched since the last flush, grouped by how they map to orders"""
+
+    def __init__(self):
+        self.keys = {'order': set(), 'route': set(), 'driver_task': set()}
+        self.changes = 0
+        self.started = time.monotonic()
+        self.truncated = False
+
+    def add(self, table, action, values):
+        if table not in CDC_TABLES:
+            return
+        if self.changes == 0:
+            # The batch window starts with its first change, not with the last flush
+            self.started = time.monotonic()
+        self.changes += 1
+        if action == 'TRUNCATE':
+            self.truncated = True
+            return
+        key_column, key_kind = CDC_TABLES[table]
+        for column, value in values:
+            if column == key_column:
+                self.keys[key_kind].add(value)
+
+    def size(self):
+        return sum(len(keys) for keys in self.keys.values())
+
+    def is_due(self):
+        return self.changes > 0 and (
+            time.monotonic() - self.started >= CDC_BATCH_SECONDS or self.size() >= CDC_BATCH_MAX_ORDERS
+        )
+
+def resolve_order_ids(db_manager, batch):
+    """Map the route_ids and driver_task_ids of a batch to order_ids on Database A"""
+    order_ids = set(batch.keys['order'])
+    engine = db_manager.get_db_a_engine()
+    from sqlalchemy import text
+
+    with engine.connect() as conn:
+        if batch.keys['route']:
+            rows = conn.execute(text(
+                f"SELECT order_id FROM route_detail WHERE route_id IN ({sql_literal_list(batch.keys['route'])})"
+            )).fetchall()
+            order_ids.update(row[0] for row in rows if row[0] is not None)
+        if batch.keys['driver_task']:
+            rows = conn.execute(text(
+                f"SELECT order_id FROM driver_tasks WHERE driver_task_id IN ({sql_literal_list(batch.keys['driver_task'])})"
+            )).fetchall()
+            order_ids.update(row[0] for row in rows if row[0] is not None)
+
+    return order_ids
+
+def refresh_fact_orders(db_manager, fact_name, order_ids, date_from=None, date_to=None):
+    """Recompute the fact rows of the given orders and drop rows the source no longer produces.
+
+    Rows of the refreshed orders inside the date window that were not rewritten by
+    this refresh (e.g. an order moved to another route, or was deleted) are removed.
+    Returns (rows_upserted, rows_deleted).
+    """
+    spec = FACT_SPECS[fact_name]
+    date_from, date_to = resolve_date_range(date_from, date_to)
+    schema = db_manager.db_b_config['schema']
+    engine = db_manager.get_db_b_engine()
+    from sqlalchemy import text
+
+    order_ids = sorted(order_ids)
+    upserted = 0
+    deleted = 0
+    for start in range(0, len(order_ids), REFRESH_BATCH_SIZE):
+        batch_ids = order_ids[start:start + REFRESH_BATCH_SIZE]
+        refreshed_at = datetime.now(pytz.UTC)
+
+        query = spec['build_query'](date_from=date_from, date_to=date_to, order_ids=batch_ids)
+        df = spec['transform'](db_manager.execute_query_to_dataframe(query, 'A'))
+        if not df.empty:
+            df['last_synced'] = refreshed_at
+            upserted += db_manager.upsert_dataframe_to_db(df, spec['table'], spec['keys'], 'B')
+
+        with engine.connect() as conn:
+            result = conn.execute(text(f"""
+                DELETE FROM {schema}.{spec['table']}
+                WHERE order_id IN ({sql_literal_list(batch_ids)})
+                AND faktur_date >= :date_from AND faktur_date <= :date_to
+                AND (last_synced IS NULL OR last_synced < :refreshed_at)
+            """), {"date_from": date_from, "date_to": date_to, "refreshed_at": refreshed_at})
+            deleted += result.rowcount
+            conn.commit()
+
+    return upserted, deleted
+
+def flush_batch(db_manager, batch, facts):
+    """Recompute the fact rows affected by a batch of changes"""
+    start = time.perf_counter()
+    if batch.truncated:
+        logger.warning("TRUNCATE on a source table received; run a full sync or --reconcile --resync")
+
+    order_ids = resolve_order_ids(db_manager, batch)
+    upserted = deleted = 0
+    if order_ids:
+        for fact_name in facts:
+            fact_upserted, fact_deleted = refresh_fact_orders(db_manager, fact_name, order_ids)
+            upserted += fact_upserted
+            deleted += fact_deleted
+
+    logger.info(
+        f"CDC batch: {batch.changes} changes -> {len(order_ids)} orders, "
+        f"{upserted} rows upserted, {deleted} rows deleted in {time.perf_counter() - start:.2f}s"
+    )
+
+def ensure_replication_slot(cursor, slot_name, plugin):
+    """Create the logical replication slot on Database A if it does not exist"""
+    import psycopg2
+    try:
+        cursor.create_replication_slot(slot_name, output_plugin=plugin)
+        logger.info(f"Created replication slot {slot_name} ({plugin})")
+    except psycopg2.errors.DuplicateObject:
+        logger.info(f"Using existing replication slot {slot_name}")
+
+def drop_replication_slot(slot_name=CDC_SLOT_NAME):
+    """Drop the CDC replication slot so Database A stops retaining WAL for it"""
+    db_manager = DatabaseManager()
+    conn = db_manager.get_db_a_replication_connection()
+    try:
+        conn.cursor().drop_replication_slot(slot_name)
+        logger.info(f"Dropped replication slot {slot_name}")
+    finally:
+        conn.close()
+
+def run_cdc(sync_type='both', slot_name=CDC_SLOT_NAME, plugin=CDC_PLUGIN, stop_event=None):
+    """Stream changes from Database A and keep the fact tables fresh until stopped.
+
+    The slot position is only confirmed after a batch has been applied to Database B,
+    so a crash replays (idempotently) the changes of the unfinished batch.
+    """
+    from fact_specs import get_fact_names
+
+    if plugin not in PARSERS:
+        raise ValueError(f"Unsupported CDC plugin: {plugin}. Choose from {', '.join(PARSERS)}")
+    parse = PARSERS[plugin]
+    facts = get_fact_names(sync_type)
+
+    db_manager = DatabaseManager()
+    for fact_name in facts:
+        FACT_SPECS[fact_name]['create_table'](db_manager)
+
+    stopping = {'requested': False}
+    if stop_event is None:
+        def request_stop(signum, frame):
+            logger.info(f"Received signal {signum}, flushing and stopping CDC...")
+            stopping['requested'] = True
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+    def should_stop():
+        return stopping['requested'] or (stop_event is not None and stop_event.is_set())
+
+    conn = db_manager.get_db_a_replication_connection()
+    cursor = conn.cursor()
+    try:
+        ensure_replication_slot(cursor, slot_name, plugin)
+        cursor.start_replication(slot_name=slot_name, decode=True, options=get_replication_options(plugin))
+        logger.info(f"CDC streaming from slot {slot_name} for {', '.join(facts)}...")
+
+        batch = ChangeBatch()
+        last_lsn = confirmed_lsn = None
+        while not should_stop():
+            message = cursor.read_message()
+            if message is not None:
+                change = parse(message.payload)
+                if change:
+                    batch.add(*change)
+                last_lsn = message.data_start
+            else:
+                select.select([cursor], [], [], min(CDC_BATCH_SECONDS, 1.0))
+
+            if batch.is_due():
+                flush_batch(db_manager, batch, facts)
+                batch = ChangeBatch()
+                cursor.send_feedback(flush_lsn=last_lsn)
+                confirmed_lsn = last_lsn
+            elif batch.changes == 0 and last_lsn != confirmed_lsn:
+                # Nothing pending: confirm skipped messages so the slot does not retain WAL
+                cursor.send_feedback(flush_lsn=last_lsn)
+                confirmed_lsn = last_lsn
+
+        if batch.changes:
+            flush_batch(db_manager, batch, facts)
+            cursor.send_feedback(flush_lsn=last_lsn)
+        logger.info("CDC stopped")
+    finally:
+        conn.close()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Import Time Check
+Imports the CLI and dashboard entry modules in fresh interpreters (python -X importtime)
+and fails when one of them loads a heavy module (pandas, numpy, pyarrow, the fact
+pipelines) or takes longer than its budget. Keeps `sync_manager.py --status`,
+`--health` and dashboard worker boot fast; run it after changing module-level imports.
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+
+# Cumulative import time budget per entry module, in milliseconds
+IMPORT_BUDGET_MS = float(os.getenv('IMPORT_BUDGET_MS', 300))
+
+ENTRY_MODULES = ['sync_manager', 'web_dashboard', 'sync_daemon']
+
+# Modules that only the sync, backfill and reconcile paths may load
+HEAVY_MODULES = ['pandas', 'numpy', 'pyarrow', 'sqlalchemy', 'psycopg2', 'asyncpg',
+                 'fact_order', 'fact_delivery', 'fact_pipeline', 'fact_specs']
+
+def measure_import(module):
+    """Import module in a fresh interpreter; returns (milliseconds, heavy modules loaded)"""
+    code = (f"import sys, {module}; "
+            f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.strip()[-2000:]}")
+
+    # -X importtime lines: "import time: self [us] | cumulative | imported package"
+    cumulative_us = None
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and line.rsplit('|', 1)[-1].strip() == module:
+            cumulative_us = int(line.split('|')[1])
+    loaded = [name for name in result.stdout.strip().split(',') if name]
+    return (cumulative_us or 0) / 1000, loaded
+
+def main():
+    parser = argparse.ArgumentParser(description='Check import time of the CLI and dashboard modules')
+    parser.add_argument('--budget-ms', type=float, default=IMPORT_BUDGET_MS,
+                        help=f'Import time budget per module in ms (default: {IMPORT_BUDGET_MS:.0f})')
+    parser.add_argument('modules', nargs='*', default=ENTRY_MODULES,
+                        help='Modules to check (default: sync_manager, web_dashboard, sync_daemon)')
+    args = parser.parse_args()
+
+    failed = False
+    print(f"\n{'Module':<20} {'Import (ms)':>12}  {'Heavy modules loaded'}")
+    print("-" * 70)
+    for module in args.modules:
+        try:
+            milliseconds, loaded = measure_import(module)
+        except RuntimeError as e:
+            print(f"{module:<20} {'error':>12}  {e}")
+            failed = True
+            continue
+        over_budget = milliseconds > args.budget_ms
+        failed = failed or over_budget or bool(loaded)
+        marker = '  (over budget)' if over_budget else ''
+        print(f"{module:<20} {milliseconds:>12.1f}  {', '.join(loaded) or '-'}{marker}")
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
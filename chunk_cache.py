@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Chunk Cache
+Spills every extracted (and transformed) chunk to an Arrow IPC or Parquet file under
+CHUNK_CACHE_DIR/<run_id>/<fact_name>/ before it is loaded into Database B. When the
+load fails, `sync_manager.py --replay <run_id>` reloads the cached chunks into
+Database B without querying Database A again. Arrow files are memory-mapped on
+replay. Runs older than CHUNK_CACHE_RETENTION_DAYS are purged.
+"""
+
+import os
+import json
+import shutil
+import time
+from datetime import datetime
+from database_utils import DatabaseManager, logger
+
+CHUNK_CACHE = os.getenv('CHUNK_CACHE', 'false').lower() == 'true'
+CHUNK_CACHE_DIR = os.getenv('CHUNK_CACHE_DIR', 'chunk_cache')
+CHUNK_CACHE_FORMAT = os.getenv('CHUNK_CACHE_FORMAT', 'arrow')
+CHUNK_CACHE_RETENTION_DAYS = float(os.getenv('CHUNK_CACHE_RETENTION_DAYS', 3))
+
+MANIFEST_FILE = 'manifest.json'
+
+def write_frame(df, path, file_format):
+    """Write a DataFrame as Arrow IPC (uncompressed, mmap-able) or Parquet"""
+    import pyarrow as pa
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if file_format == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(table, path)
+    else:
+        with pa.OSFile(path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+def read_frame(path):
+    """Read a cached chunk; Arrow IPC files are memory-mapped"""
+    import pyarrow as pa
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        return pq.read_table(path, memory_map=True).to_pandas()
+    with pa.memory_map(path, 'r') as source:
+        return pa.ipc.open_file(source).read_all().to_pandas()
+
+class ChunkCache:
+    """One cache run: a directory of chunk files plus a manifest of what was loaded"""
+
+    def __init__(self, run_id=None, base_dir=CHUNK_CACHE_DIR, file_format=CHUNK_CACHE_FORMAT):
+        self.run_id = run_id or datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        self.base_dir = base_dir
+        self.file_format = file_format
+        self.run_dir = os.path.join(base_dir, self.run_id)
+        self.manifest_path = os.path.join(self.run_dir, MANIFEST_FILE)
+        self.manifest = self._read_manifest()
+
+    def _read_manifest(self):
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        return {'run_id': self.run_id, 'created_at': datetime.now().isoformat(), 'facts': {}}
+
+    def _write_manifest(self):
+        os.makedirs(self.run_dir, exist_ok=True)
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=2, default=str)
+        os.replace(tmp_path, self.manifest_path)
+
+    def spill(self, fact_name, table_name, unique_columns, window_from, window_to, df, part=None):
+        """Write a chunk to disk; returns its chunk id, or None if it could not be cached.
+
+        part numbers the blocks of a window that is loaded in several pieces.
+        """
+        fact_dir = os.path.join(self.run_dir, fact_name)
+        os.makedirs(fact_dir, exist_ok=True)
+        extension = 'parquet' if self.file_format == 'parquet' else 'arrow'
+        chunk_id = f"{window_from}_{window_to}"
+        if part is not None:
+            chunk_id = f"{chunk_id}_{part:05d}"
+        path = os.path.join(fact_dir, f"{chunk_id}.{extension}")
+        try:
+            write_frame(df, path, self.file_format)
+        except Exception as e:
+            # The cache is a recovery aid; an unwritable chunk must not fail the sync
+            logger.warning(f"Could not cache {fact_name} chunk {chunk_id}: {e}")
+            return None
+
+        fact = self.manifest['facts'].setdefault(fact_name, {
+            'table': table_name, 'keys': list(unique_columns), 'chunks': {},
+        })
+        fact['chunks'][chunk_id] = {'file': os.path.basename(path), 'rows': len(df), 'loaded': False}
+        self._write_manifest()
+        return chunk_id
+
+    def mark_loaded(self, fact_name, chunk_id):
+        if chunk_id is None:
+            return
+        self.manifest['facts'][fact_name]['chunks'][chunk_id]['loaded'] = True
+        self._write_manifest()
+
+    def pending_chunks(self, include_loaded=False):
+        """Yield (fact_name, table, keys, chunk_id, path) in fact and window order"""
+        for fact_name, fact in self.manifest['facts'].items():
+            for chunk_id in sorted(fact['chunks']):
+                chunk = fact['chunks'][chunk_id]
+                if include_loaded or not chunk['loaded']:
+                    path = os.path.join(self.run_dir, fact_name, chunk['file'])
+                    yield fact_name, fact['table'], fact['keys'], chunk_id, path
+
+def begin_run(run_id=None):
+    """Return a new ChunkCache if CHUNK_CACHE is enabled (purging expired runs), else None"""
+    if not CHUNK_CACHE:
+        return None
+    purge_expired_runs()
+    cache = ChunkCache(run_id)
+    logger.info(f"Caching extracted chunks under {cache.run_dir}")
+    return cache
+
+def purge_expired_runs(base_dir=CHUNK_CACHE_DIR, retention_days=CHUNK_CACHE_RETENTION_DAYS):
+    """Delete cache runs whose manifest is older than retention_days"""
+    if not os.path.isdir(base_dir):
+        return 0
+    cutoff = time.time() - retention_days * 86400
+    purged = 0
+    for run_id in os.listdir(base_dir):
+        run_dir = os.path.join(base_dir, run_id)
+        manifest = os.path.join(run_dir, MANIFEST_FILE)
+        modified = os.path.getmtime(manifest if os.path.exists(manifest) else run_dir)
+        if os.path.isdir(run_dir) and modified < cutoff:
+            shutil.rmtree(run_dir, ignore_errors=True)
+            purged += 1
+    if purged:
+        logger.info(f"Purged {purged} chunk cache runs older than {retention_days} days")
+    return purged
+
+def list_runs(base_dir=CHUNK_CACHE_DIR):
+    """Print cached runs with their chunk and row counts"""
+    if not os.path.isdir(base_dir):
+        print(f"No chunk cache at {base_dir}")
+        return
+    print(f"\n{'Run':<28} {'Fact':<15} {'Chunks':<8} {'Pending':<8} {'Rows'}")
+    print("-" * 75)
+    for run_id in sorted(os.listdir(base_dir)):
+        if not os.path.exists(os.path.join(base_dir, run_id, MANIFEST_FILE)):
+            continue
+        cache = ChunkCache(run_id, base_dir)
+        for fact_name, fact in cache.manifest['facts'].items():
+            chunks = fact['chunks'].values()
+            pending = sum(1 for chunk in chunks if not chunk['loaded'])
+            rows = sum(chunk['rows'] for chunk in chunks)
+            print(f"{run_id:<28} {fact_name:<15} {len(fact['chunks']):<8} {pending:<8} {rows}")
+
+def replay_run(run_id, include_loaded=False, db_manager=None):
+    """Load the cached chunks of a run into Database B; returns rows upserted"""
+    from fact_specs import FACT_SPECS
+
+    cache = ChunkCache(run_id)
+    if not os.path.exists(cache.manifest_path):
+        raise ValueError(f"No cached run {run_id} under {cache.base_dir}")
+
+    db_manager = db_manager or DatabaseManager()
+    for fact_name in cache.manifest['facts']:
+        if fact_name in FACT_SPECS:
+            FACT_SPECS[fact_name]['create_table'](db_manager)
+
+    rows = 0
+    for fact_name, table_name, keys, chunk_id, path in cache.pending_chunks(include_loaded):
+        df = read_frame(path)
+        logger.info(f"Replaying {fact_name} chunk {chunk_id} ({len(df)} rows) from {path}")
+        rows += db_manager.upsert_dataframe_to_db(df, table_name, keys, 'B')
+        cache.mark_loaded(fact_name, chunk_id)
+        del df
+
+    logger.info(f"Replay of run {run_id} completed: {rows} rows upserted")
+    return rows
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Adaptive Chunk Controller
+Grows or shrinks a chunk size (date span in days, or a row count) from the measured
+duration, throughput and process RSS of the previous chunk, so that every chunk takes
+close to a target duration and the process stays under a memory ceiling.
+"""
+
+import os
+from database_utils import logger
+
+class AdaptiveChunkController:
+    """Feedback controller for chunk sizes.
+
+    Call record() after every chunk with the size that was used and what it cost;
+    the returned value (also available as .size) is the size for the next chunk.
+    """
+
+    # Largest change applied in one step, to damp noisy measurements
+    MAX_GROWTH = 2.0
+    MAX_SHRINK = 0.5
+
+    # Start shrinking once RSS passes this share of the memory limit
+    MEMORY_HEADROOM = 0.8
+
+    def __init__(self, name, initial, minimum, maximum, target_seconds,
+                 memory_limit_mb=None, unit='rows', adaptive=True):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.size = min(max(initial, minimum), maximum)
+        self.target_seconds = target_seconds
+        self.memory_limit_mb = memory_limit_mb
+        self.unit = unit
+        self.adaptive = adaptive
+        self.history = []
+
+    def record(self, size, rows, seconds, rss_mb=None):
+        """Record the cost of a chunk of `size` units and return the next chunk size"""
+        next_size, reason = self._decide(size, seconds, rss_mb)
+        rate = rows / seconds if seconds > 0 else 0.0
+        self.history.append({
+            'size': size,
+            'rows': rows,
+            'seconds': round(seconds, 3),
+            'rows_per_sec': round(rate, 1),
+            'rss_mb': round(rss_mb, 1) if rss_mb is not None else None,
+            'next_size': next_size,
+            'reason': reason,
+        })
+
+        rss_str = f", RSS {rss_mb:.0f} MB" if rss_mb is not None else ""
+        logger.info(
+            f"[{self.name}] chunk {len(self.history)}: {size} {self.unit}, {rows} rows in {seconds:.2f}s "
+            f"({rate:.0f} rows/s{rss_str}) -> next {next_size} {self.unit} ({reason})"
+        )
+        if next_size == self.minimum and size == self.minimum and reason != 'on target':
+            logger.warning(
+                f"[{self.name}] chunk is at the minimum of {self.minimum} {self.unit} and still {reason}"
+            )
+
+        self.size = next_size
+        return next_size
+
+    def _decide(self, size, seconds, rss_mb):
+        """Return (next_size, reason) for a chunk of `size` that took `seconds`"""
+        if not self.adaptive:
+            return self.size, 'fixed'
+
+        if self.memory_limit_mb and rss_mb is not None:
+            if rss_mb >= self.memory_limit_mb:
+                return self._clamp(size * self.MAX_SHRINK), 'over memory limit'
+            if rss_mb >= self.memory_limit_mb * self.MEMORY_HEADROOM:
+                # Do not grow near the ceiling; shrink proportionally if also too slow
+                factor = min(self.target_seconds / seconds, 1.0) if seconds > 0 else 1.0
+                return self._clamp(size * max(factor, self.MAX_SHRINK)), 'near memory limit'
+
+        if seconds <= 0:
+            return self._clamp(size * self.MAX_GROWTH), 'below target'
+
+        factor = min(max(self.target_seconds / seconds, self.MAX_SHRINK), self.MAX_GROWTH)
+        if 0.8 <= factor <= 1.25:
+            return self._clamp(size), 'on target'
+        return self._clamp(size * factor), 'above target' if factor < 1 else 'below target'
+
+    def _clamp(self, size):
+        return int(min(max(round(size), self.minimum), self.maximum))
+
+def get_extraction_controller(name):
+    """Return a date-span controller for fact extraction configured from config.env"""
+    initial = int(os.getenv('CHUNK_INITIAL_DAYS', 7))
+    minimum = int(os.getenv('CHUNK_MIN_DAYS', 1))
+    maximum = int(os.getenv('CHUNK_MAX_DAYS', 31))
+    # A window of zero days never advances the extraction loops
+    if min(initial, minimum, maximum) < 1:
+        raise ValueError(f"CHUNK_INITIAL_DAYS, CHUNK_MIN_DAYS and CHUNK_MAX_DAYS must be at least 1 "
+                         f"(got {initial}, {minimum} and {maximum})")
+    if maximum < minimum:
+        raise ValueError(f"CHUNK_MAX_DAYS ({maximum}) is below CHUNK_MIN_DAYS ({minimum})")
+    return AdaptiveChunkController(
+        name=name,
+        initial=initial,
+        minimum=minimum,
+        maximum=maximum,
+        target_seconds=float(os.getenv('CHUNK_TARGET_SECONDS', 60)),
+        memory_limit_mb=float(os.getenv('CHUNK_MEMORY_LIMIT_MB', 2048)),
+        unit='days',
+        adaptive=os.getenv('CHUNK_ADAPTIVE', 'true').lower() == 'true',
+    )
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+COPY Export
+Streams a source query out of Database A with `COPY (query) TO STDOUT` instead of
+fetching it through a cursor. A reader thread copies the stream into a bounded
+queue of byte blocks while the pipeline parses, transforms and loads the blocks
+already received, so extraction and load overlap and only a few blocks are held in
+memory at once.
+
+Two wire formats are supported:
+- text   : PostgreSQL text format, parsed with pyarrow (tab separated, \\N as NULL)
+- binary : PGCOPY binary format, decoded from the column type OIDs (no text
+           rendering or parsing of numbers, dates and timestamps on either side)
+
+Before the COPY starts, the result columns and their PostgreSQL types are checked
+against the fact column type map (FACT_*_COLUMN_TYPES); a mismatch raises ValueError
+instead of loading wrongly typed data into Database B.
+"""
+
+import os
+import queue
+import struct
+import threading
+from datetime import date, datetime, time as dt_time, timedelta
+from decimal import Decimal
+import pandas as pd
+from database_utils import logger
+
+# COPY wire format for FETCH_BACKEND=copy: text or binary
+COPY_FORMAT = os.getenv('COPY_FORMAT', 'text')
+# Bytes received from COPY before a block is handed to the pipeline
+COPY_CHUNK_BYTES = int(os.getenv('COPY_CHUNK_BYTES', 16 * 1024 * 1024))
+# Blocks buffered between the COPY reader thread and the pipeline
+COPY_QUEUE_BLOCKS = int(os.getenv('COPY_QUEUE_BLOCKS', 4))
+
+COPY_FORMATS = ('text', 'binary')
+
+PG_EPOCH_DATE = date(2000, 1, 1)
+PG_EPOCH_TIMESTAMP = datetime(2000, 1, 1)
+PGCOPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+
+TEXT_OIDS = {25, 1043, 1042, 19}
+INTEGER_OIDS = {20, 21, 23}
+FLOAT_OIDS = {700, 701}
+NUMERIC_OID = 1700
+DATE_OID = 1082
+TIMESTAMP_OIDS = {1114, 1184}
+TIME_OIDS = {1083}
+
+# PostgreSQL types accepted for each fact column type name
+ACCEPTED_OIDS = {
+    'date': {DATE_OID},
+    'numeric': {NUMERIC_OID} | INTEGER_OIDS | FLOAT_OIDS,
+    'integer': INTEGER_OIDS,
+    'timestamp': TIMESTAMP_OIDS,
+    'time': TIME_OIDS,
+}
+
+def validate_copy_columns(description, column_types, copy_format):
+    """Check the query result (cursor.description) against a fact column type map.
+
+    Every result column must be in the map with a compatible PostgreSQL type. Map
+    columns absent from the result are allowed: narrow queries leave the dimension
+    columns to the in-memory lookup (dimension_mirror.py). Returns the list of
+    (column, type_oid) in result order; raises ValueError listing the problems.
+    """
+    columns = [(column[0], column[1]) for column in description]
+    problems = []
+
+    unexpected = [name for name, _ in columns if name not in column_types]
+    if unexpected:
+        problems.append(f"unexpected columns {unexpected}")
+
+    for name, oid in columns:
+        type_name = column_types.get(name)
+        if type_name is None:
+            continue
+        if type_name == 'string':
+            # Any type renders as text; binary strings are rendered by the decoder
+            if copy_format == 'binary' and oid not in BINARY_DECODERS:
+                problems.append(f"{name}: type oid {oid} has no binary decoder")
+        elif oid not in ACCEPTED_OIDS[type_name]:
+            problems.append(f"{name}: expected {type_name}, source type oid is {oid}")
+
+    if problems:
+        raise ValueError(f"COPY result does not match the fact schema: {'; '.join(problems)}")
+    return columns
+
+def _decode_numeric(data):
+    ndigits, weight, sign, dscale = struct.unpack_from('!hhHh', data)
+    if sign == 0xC000:
+        return Decimal('NaN')
+    value = 0
+    for digit in struct.unpack_from(f'!{ndigits}H', data, 8):
+        value = value * 10000 + digit
+    result = Decimal(value).scaleb((weight - ndigits + 1) * 4)
+    if sign == 0x4000:
+        result = -result
+    return result.quantize(Decimal(1).scaleb(-dscale))
+
+def _decode_timestamp(data):
+    return PG_EPOCH_TIMESTAMP + timedelta(microseconds=struct.unpack('!q', data)[0])
+
+def _decode_time(data):
+    micros = struct.unpack('!q', data)[0]
+    seconds, micros = divmod(micros, 1000000)
+    return dt_time(seconds // 3600, seconds // 60 % 60, seconds % 60, micros)
+
+BINARY_DECODERS = {
+    **{oid: lambda data: data.decode('utf-8') for oid in TEXT_OIDS},
+    20: lambda data: struct.unpack('!q', data)[0],
+    21: lambda data: struct.unpack('!h', data)[0],
+    23: lambda data: struct.unpack('!i', data)[0],
+    700: lambda data: struct.unpack('!f', data)[0],
+    701: lambda data: struct.unpack('!d', data)[0],
+    NUMERIC_OID: _decode_numeric,
+    DATE_OID: lambda data: PG_EPOCH_DATE + timedelta(days=struct.unpack('!i', data)[0]),
+    1114: _decode_timestamp,
+    # timestamptz is sent as UTC; it is converted to the session zone in the frame
+    1184: _decode_timestamp,
+    1083: _decode_time,
+}
+
+class BinaryCopyParser:
+    """Incremental PGCOPY decoder: feed() byte blocks, get back complete rows"""
+
+    def __init__(self, columns):
+        self.decoders = [BINARY_DECODERS[oid] for _, oid in columns]
+        self.buffer = b''
+        self.header_read = False
+        self.finished = False
+
+    def _read_header(self):
+        # signature, flags, header extension length, extension
+        if len(self.buffer) < 19:
+            return 0
+        if not self.buffer.startswith(PGCOPY_SIGNATURE):
+            raise ValueError("COPY stream is not in PGCOPY binary format")
+        extension_length = struct.unpack_from('!i', self.buffer, 15)[0]
+        if len(self.buffer) < 19 + extension_length:
+            return 0
+        self.header_read = True
+        return 19 + extension_length
+
+    def feed(self, data):
+        self.buffer += data
+        buffer = self.buffer
+        position = 0
+        if not self.header_read:
+            position = self._read_header()
+            if not self.header_read:
+                return []
+
+        rows = []
+        size = len(buffer)
+        unpack_from = struct.unpack_from
+        decoders = self.decoders
+        while position + 2 <= size:
+            field_count = unpack_from('!h', buffer, position)[0]
+            if field_count == -1:
+                self.finished = True
+                position += 2
+                break
+            offset = position + 2
+            row = []
+            complete = True
+            for decode in decoders[:field_count]:
+                if offset + 4 > size:
+                    complete = False
+                    break
+                length = unpack_from('!i', buffer, offset)[0]
+                offset += 4
+                if length == -1:
+                    row.append(None)
+                    continue
+                if offset + length > size:
+                    complete = False
+                    break
+                row.append(decode(buffer[offset:offset + length]))
+                offset += length
+            if not complete:
+                break
+            rows.append(row)
+            position = offset
+
+        self.buffer = buffer[position:]
+        return rows
+
+class TextCopyParser:
+    """Incremental parser for COPY text format blocks (one row per line)"""
+
+    def __init__(self, columns, column_types):
+        from arrow_fetch import get_arrow_column_types
+        self.names = [name for name, _ in columns]
+        # Typed from the result OIDs, so timestamptz columns parse their offsets (as UTC)
+        self.arrow_types = get_arrow_column_types(
+            {name: type_name for name, type_name in column_types.items() if name in self.names}, dict(columns))
+        self.buffer = b''
+
+    def feed(self, data):
+        self.buffer += data
+        cut = self.buffer.rfind(b'\n')
+        if cut == -1:
+            return None
+        block, self.buffer = self.buffer[:cut + 1], self.buffer[cut + 1:]
+        return self._parse(block)
+
+    def _parse(self, block):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.csv as pa_csv
+        from arrow_fetch import COPY_NULL
+
+        # Text format escapes tabs, newlines and backslashes, so no quoting is needed
+        table = pa_csv.read_csv(
+            pa.py_buffer(block),
+            read_options=pa_csv.ReadOptions(column_names=self.names),
+            parse_options=pa_csv.ParseOptions(delimiter='\t', quote_char=False, escape_char=False),
+            convert_options=pa_csv.ConvertOptions(
+                column_types=self.arrow_types,
+                null_values=[COPY_NULL],
+                strings_can_be_null=True,
+            ),
+        )
+        for index, name in enumerate(table.column_names):
+            column = table.column(index)
+            if pa.types.is_string(column.type) and pc.any(pc.match_substring(column, '\\')).as_py():
+                values = [None if value is None else _unescape_text(value) for value in column.to_pylist()]
+                table = table.set_column(index, name, pa.array(values, type=pa.string()))
+        return table
+
+TEXT_ESCAPES = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v', '\\': '\\'}
+
+def _unescape_text(value):
+    """Undo COPY text format backslash escapes"""
+    parts = value.split('\\')
+    result = [parts[0]]
+    index = 1
+    while index < len(parts):
+        part = parts[index]
+        if part == '' and index + 1 < len(parts):
+            # An escaped backslash splits into an empty part
+            result.append('\\' + parts[index + 1])
+            index += 2
+            continue
+        result.append(TEXT_ESCAPES.get(part[:1], part[:1]) + part[1:])
+        index += 1
+    return ''.join(result)
+
+class _QueueWriter:
+    """File object for copy_expert that hands COPY output to the pipeline in blocks"""
+
+    def __init__(self, blocks, cancelled, chunk_bytes):
+        self.blocks = blocks
+        self.cancelled = cancelled
+        self.chunk_bytes = chunk_bytes
+        self.pending = []
+        self.pending_bytes = 0
+
+    def write(self, data):
+        self.pending.append(bytes(data))
+        self.pending_bytes += len(data)
+        if self.pending_bytes >= self.chunk_bytes:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if not self.pending:
+            return
+        block = b''.join(self.pending)
+        self.pending, self.pending_bytes = [], 0
+        while True:
+            if self.cancelled.is_set():
+                raise RuntimeError("COPY export cancelled by the consumer")
+            try:
+                self.blocks.put(block, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+def describe_query(cursor, query):
+    """Return (cursor.description, session TimeZone) of a query without running it"""
+    cursor.execute(f"SELECT * FROM ({query}) AS copy_source LIMIT 0")
+    description = cursor.description
+    cursor.execute("SHOW TimeZone")
+    session_zone = cursor.fetchone()[0]
+    return description, session_zone
+
+def _rows_to_frame(rows, columns, column_types, session_zone):
+    """Build a DataFrame from decoded binary rows using the fact column types"""
+    names = [name for name, _ in columns]
+    df = pd.DataFrame.from_records(rows, columns=names)
+    for name, oid in columns:
+        type_name = column_types.get(name)
+        if type_name == 'string' and oid not in TEXT_OIDS:
+            df[name] = df[name].map(lambda value: None if value is None else str(value))
+        elif type_name == 'numeric':
+            df[name] = pd.to_numeric(df[name].astype(object), errors='raise').astype('float64')
+        elif oid == 1184:
+            # Match read_sql: timestamptz in the session time zone
+            df[name] = pd.to_datetime(df[name]).dt.tz_localize('UTC').dt.tz_convert(session_zone)
+        elif oid == 1114:
+            # datetime64 even when a block holds only NULLs, so to_sql stages a TIMESTAMP column
+            df[name] = pd.to_datetime(df[name])
+        elif oid in TIME_OIDS:
+            # Likewise a TIME column rather than TEXT for an all-NULL object column
+            import pyarrow as pa
+            df[name] = df[name].astype(pd.ArrowDtype(pa.time64('us')))
+    return df
+
+def stream_query(engine, query, column_types, copy_format=COPY_FORMAT, chunk_bytes=COPY_CHUNK_BYTES):
+    """Yield DataFrames for a query exported with COPY TO STDOUT, block by block.
+
+    copy_format is 'text' (Arrow-backed frames, like FETCH_BACKEND=arrow) or 'binary'
+    (frames of Python values, like read_sql). An empty result yields one empty frame
+    with the result columns. Raises ValueError when the result does not match
+    column_types.
+    """
+    if copy_format not in COPY_FORMATS:
+        raise ValueError(f"Unknown COPY format {copy_format}; expected one of {COPY_FORMATS}")
+    from arrow_fetch import COPY_NULL, arrow_types_mapper, localize_timestamps
+
+    raw_conn = engine.raw_connection()
+    blocks = queue.Queue(maxsize=COPY_QUEUE_BLOCKS)
+    cancelled = threading.Event()
+    reader = None
+    try:
+        cursor = raw_conn.cursor()
+        description, session_zone = describe_query(cursor, query)
+        columns = validate_copy_columns(description, column_types, copy_format)
+
+        if copy_format == 'binary':
+            parser = BinaryCopyParser(columns)
+            copy_sql = f"COPY ({query}) TO STDOUT WITH (FORMAT binary)"
+        else:
+            parser = TextCopyParser(columns, column_types)
+            copy_sql = f"COPY ({query}) TO STDOUT WITH (FORMAT text, NULL '{COPY_NULL}')"
+
+        def read_copy():
+            writer = _QueueWriter(blocks, cancelled, chunk_bytes)
+            try:
+                cursor.copy_expert(copy_sql, writer, size=1024 * 1024)
+                writer.flush()
+                blocks.put(None)
+            except Exception as e:
+                blocks.put(e)
+
+        reader = threading.Thread(target=read_copy, name='copy-export', daemon=True)
+        reader.start()
+
+        total_rows = 0
+        while True:
+            block = blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            if block is None:
+                break
+            parsed = parser.feed(block)
+            if copy_format == 'binary':
+                if parsed:
+                    df = _rows_to_frame(parsed, columns, column_types, session_zone)
+                    total_rows += len(df)
+                    yield df
+            elif parsed is not None and parsed.num_rows:
+                total_rows += parsed.num_rows
+                yield localize_timestamps(parsed.to_pandas(types_mapper=arrow_types_mapper), session_zone)
+
+        if total_rows == 0:
+            # Callers always get at least one frame carrying the result columns
+            yield pd.DataFrame(columns=[name for name, _ in columns])
+        if parser.buffer and not (copy_format == 'binary' and parser.finished):
+            raise ValueError(f"COPY stream ended with {len(parser.buffer)} unparsed bytes")
+        logger.debug(f"COPY {copy_format} export streamed {total_rows} rows")
+        cursor.close()
+        raw_conn.commit()
+    finally:
+        cancelled.set()
+        if reader is not None:
+            # Unblock a reader waiting on a full queue so it can notice the cancel
+            while reader.is_alive():
+                try:
+                    blocks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+        raw_conn.close()
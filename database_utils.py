@@ -1,11 +1,12 @@
 import os
-import psycopg2
-import pandas as pd
-from sqlalchemy import create_engine
 from dotenv import load_dotenv
 import logging
+import time
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
-import pytz
+
+# pandas, psycopg2, SQLAlchemy and pytz are imported by the methods that use them, so
+# light CLI paths (--status, --health) and dashboard workers start without loading them
 
 # Load environment variables
 load_dotenv('config.env')
@@ -17,6 +18,33 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def get_process_rss_mb():
+    """Return the current resident set size of this process in MB"""
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # Non-Linux hosts: fall back to the peak RSS reported by getrusage
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def sql_literal_list(values):
+    """Render values as a comma separated list of quoted SQL string literals"""
+    literals = ["'" + str(value).replace("'", "''") + "'" for value in values]
+    # An empty IN () is a syntax error; NULL matches nothing
+    return ', '.join(literals) if literals else 'NULL'
+
+def get_prepared_statement_name(name, query):
+    """Name of the prepared statement for query; it changes with the SQL text, so an
+    edited query is prepared again"""
+    import hashlib
+    return f"{name}_{hashlib.md5(query.encode()).hexdigest()[:10]}"
+
+def get_execute_sql(statement, params):
+    """EXECUTE of a prepared statement with a pyformat placeholder per param"""
+    return f"EXECUTE {statement}({', '.join(f'%({key})s' for key in params)})"
+
 class DatabaseManager:
     def __init__(self):
         self.db_a_config = {
@@ -37,10 +65,47 @@ class DatabaseManager:
             'schema': os.getenv('DB_B_SCHEMA')
         }
         
-        self.batch_size = int(os.getenv('BATCH_SIZE', 1000))
+        # BATCH_SIZE is a row count, or 'auto' to tune it toward BATCH_TARGET_SECONDS
+        batch_size_setting = os.getenv('BATCH_SIZE', '1000').strip().lower()
+        self.adaptive_batching = batch_size_setting == 'auto'
+        self.batch_size = 1000 if self.adaptive_batching else int(batch_size_setting)
+        self.batch_target_seconds = float(os.getenv('BATCH_TARGET_SECONDS', 2))
+        self.batch_size_min = int(os.getenv('BATCH_SIZE_MIN', 500))
+        self.batch_size_max = int(os.getenv('BATCH_SIZE_MAX', 100000))
+        # A zero or negative batch never advances the upsert loop
+        if self.batch_size < 1 or self.batch_size_min < 1:
+            raise ValueError(f"BATCH_SIZE and BATCH_SIZE_MIN must be at least 1 "
+                             f"(got {batch_size_setting!r} and {self.batch_size_min})")
+        if self.batch_size_max < self.batch_size_min:
+            raise ValueError(f"BATCH_SIZE_MAX ({self.batch_size_max}) is below BATCH_SIZE_MIN ({self.batch_size_min})")
+        self.memory_limit_mb = float(os.getenv('CHUNK_MEMORY_LIMIT_MB', 2048))
+        
+        # Accumulated wall-clock seconds per pipeline stage (extract/transform/load)
+        self.stage_timings = {}
+        
+        # Engines are created once per manager so long-lived processes keep warm pools
+        self._engines = {}
+        self._source_router = None
+        self.pool_size = int(os.getenv('DB_POOL_SIZE', 5))
+        self.pool_recycle_seconds = int(os.getenv('DB_POOL_RECYCLE_SECONDS', 1800))
+        
+        # Fact windows run as server-side prepared statements (read_sql fetch backend only)
+        self.prepared_queries = os.getenv('PREPARED_QUERIES', 'true').lower() == 'true'
+    
+    @contextmanager
+    def timed_stage(self, stage):
+        """Accumulate the duration of a pipeline stage into stage_timings"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stage_timings[stage] = self.stage_timings.get(stage, 0.0) + elapsed
+            logger.debug(f"Stage '{stage}' took {elapsed:.3f}s")
     
     def get_db_a_connection(self):
         """Get connection to Database A (Source)"""
+        import psycopg2
         try:
             conn = psycopg2.connect(
                 host=self.db_a_config['host'],
@@ -56,6 +121,7 @@ class DatabaseManager:
     
     def get_db_b_connection(self):
         """Get connection to Database B (Target)"""
+        import psycopg2
         try:
             conn = psycopg2.connect(
                 host=self.db_b_config['host'],
@@ -69,43 +135,224 @@ class DatabaseManager:
             logger.error(f"Error connecting to Database B: {e}")
             raise
     
+    def get_db_a_replication_connection(self):
+        """Get a logical replication connection to Database A (for CDC)"""
+        import psycopg2
+        from psycopg2.extras import LogicalReplicationConnection
+        try:
+            conn = psycopg2.connect(
+                host=self.db_a_config['host'],
+                port=self.db_a_config['port'],
+                database=self.db_a_config['database'],
+                user=self.db_a_config['user'],
+                password=self.db_a_config['password'],
+                connection_factory=LogicalReplicationConnection
+            )
+            return conn
+        except Exception as e:
+            logger.error(f"Error opening replication connection to Database A: {e}")
+            raise
+    
+    def _create_engine(self, config):
+        """Create a pooled SQLAlchemy engine for a database config"""
+        from sqlalchemy import create_engine
+        connection_string = f"postgresql://{config['user']}:{config['password']}@{config['host']}:{config['port']}/{config['database']}"
+        return create_engine(
+            connection_string,
+            pool_size=self.pool_size,
+            pool_recycle=self.pool_recycle_seconds,
+            pool_pre_ping=True
+        )
+    
     def get_db_a_engine(self):
         """Get SQLAlchemy engine for Database A"""
         try:
-            connection_string = f"postgresql://{self.db_a_config['user']}:{self.db_a_config['password']}@{self.db_a_config['host']}:{self.db_a_config['port']}/{self.db_a_config['database']}"
-            engine = create_engine(connection_string)
-            return engine
+            if 'A' not in self._engines:
+                self._engines['A'] = self._create_engine(self.db_a_config)
+            return self._engines['A']
         except Exception as e:
             logger.error(f"Error creating engine for Database A: {e}")
             raise
     
+    def get_endpoint_engine(self, name, config):
+        """Get a cached SQLAlchemy engine for an additional endpoint (e.g. a Database A replica)"""
+        try:
+            if name not in self._engines:
+                self._engines[name] = self._create_engine(config)
+            return self._engines[name]
+        except Exception as e:
+            logger.error(f"Error creating engine for {name}: {e}")
+            raise
+    
+    @property
+    def source_router(self):
+        """SourceRouter choosing the Database A endpoint for extraction reads"""
+        if self._source_router is None:
+            from source_routing import SourceRouter
+            self._source_router = SourceRouter(self)
+        return self._source_router
+    
+    def get_db_a_read_engine(self):
+        """Get the engine for extraction reads from Database A: a replica within the lag bound, else the primary"""
+        return self.source_router.read_engine()
+    
+    def get_query_engine(self, db_type, read_replica=False):
+        """Engine for a query on db_type; read_replica routes Database A reads through the SourceRouter.
+        
+        Only bulk extraction that tolerates replica lag (fact windows, backfill, dimension
+        mirror) passes read_replica=True; CDC refreshes and reconcile/resync read the primary.
+        """
+        if db_type.upper() != 'A':
+            return self.get_db_b_engine()
+        return self.get_db_a_read_engine() if read_replica else self.get_db_a_engine()
+    
     def get_db_b_engine(self):
         """Get SQLAlchemy engine for Database B"""
         try:
-            connection_string = f"postgresql://{self.db_b_config['user']}:{self.db_b_config['password']}@{self.db_b_config['host']}:{self.db_b_config['port']}/{self.db_b_config['database']}"
-            engine = create_engine(connection_string)
-            return engine
+            if 'B' not in self._engines:
+                self._engines['B'] = self._create_engine(self.db_b_config)
+            return self._engines['B']
         except Exception as e:
             logger.error(f"Error creating engine for Database B: {e}")
             raise
     
-    def execute_query_to_dataframe(self, query, db_type='A'):
-        """Execute query and return results as DataFrame"""
+    def dispose_engines(self):
+        """Close all pooled connections of this manager"""
+        for engine in self._engines.values():
+            engine.dispose()
+        self._engines = {}
+    
+    def execute_query_to_dataframe(self, query, db_type='A', categorical_columns=None, dictionaries=None,
+                                   column_types=None, connection=None, read_replica=False):
+        """Execute query and return results as DataFrame.
+        
+        categorical_columns are dictionary-encoded while the result is streamed in
+        chunks (see frame_compaction.py); dictionaries keeps the codes stable per run.
+        With FETCH_BACKEND=arrow, queries with a column_types map are fetched through
+        COPY + pyarrow into an Arrow-backed DataFrame (see arrow_fetch.py); with
+        FETCH_BACKEND=copy they are streamed with stream_query_via_copy and concatenated.
+        connection runs the query on an open SQLAlchemy connection (e.g. one inside an
+        exported snapshot, see snapshot_extract.py) instead of a pooled one; the copy
+        backend then falls back to the read_sql paths. read_replica=True allows a Database A
+        read replica within DB_A_REPLICA_MAX_LAG_SECONDS (see source_routing.py).
+        """
+        import pandas as pd
+        
         try:
-            if db_type.upper() == 'A':
-                engine = self.get_db_a_engine()
-            else:
-                engine = self.get_db_b_engine()
+            engine = self.get_query_engine(db_type, read_replica)
             
-            df = pd.read_sql(query, engine)
+            from frame_compaction import COMPACT_FRAMES
+            from arrow_fetch import FETCH_BACKEND
+            if column_types and FETCH_BACKEND == 'arrow':
+                from arrow_fetch import fetch_dataframe
+                df = fetch_dataframe(engine, query, column_types, categorical_columns, dictionaries,
+                                     connection=connection)
+            elif column_types and FETCH_BACKEND == 'copy' and connection is None:
+                from frame_compaction import RunDictionaries
+                dictionaries = dictionaries or RunDictionaries()
+                chunks = list(self.stream_query_via_copy(query, column_types, db_type, None,
+                                                         categorical_columns, dictionaries,
+                                                         read_replica=read_replica))
+                if categorical_columns and COMPACT_FRAMES:
+                    chunks = [dictionaries.align(chunk, categorical_columns) for chunk in chunks]
+                df = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+            elif categorical_columns and COMPACT_FRAMES:
+                from frame_compaction import read_sql_compacted
+                with (nullcontext(connection) if connection is not None else engine.connect()) as conn:
+                    conn = conn.execution_options(stream_results=True)
+                    df = read_sql_compacted(query, conn, categorical_columns, dictionaries)
+            else:
+                df = pd.read_sql(query, connection if connection is not None else engine)
             logger.info(f"Query executed successfully. Retrieved {len(df)} rows")
             return df
         except Exception as e:
             logger.error(f"Error executing query: {e}")
             raise
     
-    def upsert_dataframe_to_db(self, df, table_name, unique_columns, db_type='B'):
-        """Upsert DataFrame to database table"""
+    def execute_prepared_to_dataframe(self, name, query, param_types, params, db_type='A',
+                                      categorical_columns=None, dictionaries=None, connection=None,
+                                      read_replica=False):
+        """Execute a prepared statement and return results as DataFrame.
+        
+        query uses $1..$n placeholders of the given param_types (e.g. ['date', 'date']);
+        params is a dict {name: value} bound to them in order. The statement is prepared
+        once per database connection (tracked in the connection's info dict) and then
+        only EXECUTEd, so every partition reuses the parsed statement and
+        pg_stat_statements groups the executions together. read_replica as for
+        execute_query_to_dataframe.
+        """
+        import pandas as pd
+        
+        statement = get_prepared_statement_name(name, query)
+        try:
+            engine = self.get_query_engine(db_type, read_replica)
+            with (nullcontext(connection) if connection is not None else engine.connect()) as conn:
+                prepared = conn.info.setdefault('prepared_statements', set())
+                if statement not in prepared:
+                    conn.exec_driver_sql(f"PREPARE {statement}({', '.join(param_types)}) AS {query}")
+                    prepared.add(statement)
+                    logger.debug(f"Prepared statement {statement}")
+                
+                execute_sql = get_execute_sql(statement, params)
+                from frame_compaction import COMPACT_FRAMES
+                if categorical_columns and COMPACT_FRAMES:
+                    # EXECUTE cannot run behind a server-side cursor, so the result arrives
+                    # in one round trip and is compacted chunk by chunk afterwards
+                    from frame_compaction import read_sql_compacted
+                    df = read_sql_compacted(execute_sql, conn, categorical_columns, dictionaries, params=params)
+                else:
+                    df = pd.read_sql(execute_sql, conn, params=params)
+            logger.info(f"Prepared statement {statement} executed successfully. Retrieved {len(df)} rows")
+            return df
+        except Exception as e:
+            logger.error(f"Error executing prepared statement {statement}: {e}")
+            raise
+    
+    def stream_query_via_copy(self, query, column_types, db_type='A', copy_format=None,
+                              categorical_columns=None, dictionaries=None, read_replica=False):
+        """Yield the result of query as DataFrame chunks streamed with COPY TO STDOUT.
+        
+        The result columns are validated against column_types (a fact column type map)
+        before the COPY starts; copy_format is 'text' or 'binary' (default COPY_FORMAT).
+        read_replica as for execute_query_to_dataframe. See copy_export.py.
+        """
+        from copy_export import COPY_FORMAT, stream_query
+        from frame_compaction import COMPACT_FRAMES, RunDictionaries
+        
+        copy_format = copy_format or COPY_FORMAT
+        engine = self.get_query_engine(db_type, read_replica)
+        if categorical_columns and COMPACT_FRAMES:
+            dictionaries = dictionaries or RunDictionaries()
+        else:
+            dictionaries = None
+        
+        rows = 0
+        try:
+            for df in stream_query(engine, query, column_types, copy_format):
+                if dictionaries is not None:
+                    df = dictionaries.compact(df, categorical_columns)
+                rows += len(df)
+                yield df
+            logger.info(f"COPY {copy_format} export completed. Streamed {rows} rows")
+        except Exception as e:
+            logger.error(f"Error streaming query via COPY: {e}")
+            raise
+    
+    def upsert_dataframe_to_db(self, df, table_name, unique_columns, db_type='B', strategy=None,
+                               progress_callback=None, stamp_last_synced=True):
+        """Upsert DataFrame to database table in batches of BATCH_SIZE rows.
+        
+        Every batch is staged and merged in its own transaction, so row locks and
+        WAL per commit stay bounded. strategy is an upsert strategy name from
+        upsert_strategies; by default it is read from UPSERT_STRATEGY_<TABLE_NAME> /
+        UPSERT_STRATEGY in config.env. progress_callback(rows_done, rows_total) is
+        called after every committed batch. stamp_last_synced=False skips adding the
+        last_synced column, for tables without one. Returns the number of rows upserted.
+        """
+        from upsert_strategies import get_upsert_strategy, get_configured_upsert_strategy
+        from chunk_controller import AdaptiveChunkController
+        import pytz
+        rows_done = 0
         try:
             if db_type.upper() == 'A':
                 engine = self.get_db_a_engine()
@@ -115,49 +362,58 @@ class DatabaseManager:
                 schema = self.db_b_config['schema']
             
             # Add last_synced column if not exists
-            if 'last_synced' not in df.columns:
+            if stamp_last_synced and 'last_synced' not in df.columns:
                 df['last_synced'] = datetime.now(pytz.UTC)
             
             # Remove duplicates based on unique columns before upsert
             df = df.drop_duplicates(subset=unique_columns, keep='first')
+            rows_total = len(df)
             
-            # Create temporary table for upsert
-            temp_table_name = f"temp_{table_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-            
-            # Insert data to temporary table
-            df.to_sql(temp_table_name, engine, schema=schema, if_exists='replace', index=False)
-            
-            # Build upsert query
-            columns = df.columns.tolist()
-            columns_str = ', '.join(columns)
-            placeholders = ', '.join([f'%s' for _ in columns])
+            upsert_strategy = get_upsert_strategy(strategy or get_configured_upsert_strategy(table_name))
+            logger.debug(f"Using upsert strategy '{upsert_strategy.name}' for {schema}.{table_name}")
             
-            # Build ON CONFLICT clause
-            conflict_columns = ', '.join(unique_columns)
-            update_columns = ', '.join([f'{col} = EXCLUDED.{col}' for col in columns if col not in unique_columns])
+            controller = None
+            if self.adaptive_batching:
+                controller = AdaptiveChunkController(
+                    name=f"{table_name} load",
+                    initial=self.batch_size,
+                    minimum=self.batch_size_min,
+                    maximum=self.batch_size_max,
+                    target_seconds=self.batch_target_seconds,
+                    memory_limit_mb=self.memory_limit_mb,
+                    unit='rows',
+                )
+            # The controller clamps the starting size to [BATCH_SIZE_MIN, BATCH_SIZE_MAX]
+            batch_size = controller.size if controller else self.batch_size
+            batch_number = 0
+            start = time.perf_counter()
             
-            upsert_query = f"""
-                INSERT INTO {schema}.{table_name} ({columns_str})
-                SELECT {columns_str} FROM {schema}.{temp_table_name}
-                ON CONFLICT ({conflict_columns})
-                DO UPDATE SET {update_columns}
-            """
+            while rows_done < rows_total:
+                batch = df.iloc[rows_done:rows_done + batch_size]
+                batch_number += 1
+                batch_start = time.perf_counter()
+                
+                # Stage and merge each batch in its own transaction
+                with engine.connect() as conn:
+                    upsert_strategy.upsert(conn, batch, schema, table_name, unique_columns)
+                    conn.commit()
+                
+                batch_seconds = time.perf_counter() - batch_start
+                rows_done += len(batch)
+                elapsed = time.perf_counter() - start
+                logger.info(
+                    f"{schema}.{table_name}: batch {batch_number} committed "
+                    f"({rows_done}/{rows_total} rows, {batch_seconds:.2f}s, "
+                    f"{rows_done / elapsed if elapsed > 0 else 0:.0f} rows/s)"
+                )
+                if progress_callback:
+                    progress_callback(rows_done, rows_total)
+                if controller:
+                    batch_size = controller.record(len(batch), len(batch), batch_seconds, get_process_rss_mb())
             
-            # Execute upsert
-            with engine.connect() as conn:
-                from sqlalchemy import text
-                conn.execute(text(upsert_query))
-                conn.commit()
-            
-            # Drop temporary table
-            drop_query = f"DROP TABLE IF EXISTS {schema}.{temp_table_name}"
-            with engine.connect() as conn:
-                from sqlalchemy import text
-                conn.execute(text(drop_query))
-                conn.commit()
-            
-            logger.info(f"Successfully upserted {len(df)} rows to {schema}.{table_name}")
+            logger.info(f"Successfully upserted {rows_total} rows to {schema}.{table_name}")
+            return rows_total
             
         except Exception as e:
-            logger.error(f"Error upserting data: {e}")
-            raise 
\ No newline at end of file
+            logger.error(f"Error upserting data after {rows_done} committed rows: {e}")
+            raise
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Dimension Mirror
+Keeps copies of the small source dimension tables (drivers, keneks, vehicles and
+customer locations) in Database B as tms_dim_* tables. Refreshes are incremental on
+the table's update column (DIM_UPDATED_COLUMN) with a periodic full refresh that
+also removes rows deleted on Database A. With DIMENSION_MIRROR=true the shared
+extraction and fact_delivery pull only narrow order/route rows from Database A and
+enrich them in memory from a DimensionCache built on the mirror.
+"""
+
+import os
+import time
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import pytz
+from database_utils import DatabaseManager, logger
+
+DIMENSION_MIRROR = os.getenv('DIMENSION_MIRROR', 'false').lower() == 'true'
+DIM_UPDATED_COLUMN = os.getenv('DIM_UPDATED_COLUMN', 'updated_date')
+DIM_FULL_REFRESH_HOURS = float(os.getenv('DIM_FULL_REFRESH_HOURS', 24))
+DIM_CACHE_TTL_SECONDS = float(os.getenv('DIM_CACHE_TTL_SECONDS', 900))
+
+# Source table -> key column and the columns the fact queries read from it
+DIMENSION_TABLES = {
+    'dma_driver': {'key': 'driver_id', 'columns': ['driver_name']},
+    'dma_kenek': {'key': 'kenek_id', 'columns': ['kenek_name']},
+    'mst_vehicle': {'key': 'mst_vehicle_id', 'columns': ['code', 'plate_number']},
+    'mst_location_child': {'key': 'mst_location_child_id',
+                           'columns': ['mst_location_parent_id', 'address', 'address_text']},
+    'mst_location_parent': {'key': 'mst_location_parent_id', 'columns': ['code', 'name']},
+}
+
+def get_mirror_table(table):
+    return f"tms_dim_{table}"
+
+def create_dimension_tables(db_manager):
+    """Create the tms_dim_* mirror tables and their watermark table in Database B"""
+    statements = ["""
+    CREATE TABLE IF NOT EXISTS tms_dim_watermarks (
+        table_name VARCHAR(100) PRIMARY KEY,
+        watermark TIMESTAMP,
+        row_count INTEGER DEFAULT 0,
+        last_full_refresh TIMESTAMP WITH TIME ZONE,
+        refreshed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    );
+    """]
+    for table, dimension in DIMENSION_TABLES.items():
+        columns = ',\n        '.join([f'"{col}" TEXT' for col in dimension['columns']])
+        statements.append(f"""
+    CREATE TABLE IF NOT EXISTS {get_mirror_table(table)} (
+        {dimension['key']} VARCHAR(50) PRIMARY KEY,
+        {columns},
+        source_updated TIMESTAMP,
+        mirrored_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+
+    try:
+        engine = db_manager.get_db_b_engine()
+        with engine.connect() as conn:
+            from sqlalchemy import text
+            for statement in statements:
+                conn.execute(text(statement))
+            conn.commit()
+    except Exception as e:
+        logger.error(f"Error creating dimension mirror tables: {e}")
+        raise
+
+def get_update_column(db_manager, table):
+    """Return DIM_UPDATED_COLUMN if the source table has it, else None (full refresh only)"""
+    engine = db_manager.get_db_a_read_engine()
+    with engine.connect() as conn:
+        from sqlalchemy import text
+        row = conn.execute(text("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = 'public' AND table_name = :table AND column_name = :column
+        """), {"table": table, "column": DIM_UPDATED_COLUMN}).fetchone()
+    return DIM_UPDATED_COLUMN if row else None
+
+def get_watermark(db_manager, table):
+    """Return (watermark, last_full_refresh) for a mirrored table"""
+    engine = db_manager.get_db_b_engine()
+    with engine.connect() as conn:
+        from sqlalchemy import text
+        row = conn.execute(text(
+            "SELECT watermark, last_full_refresh FROM tms_dim_watermarks WHERE table_name = :table"
+        ), {"table": table}).fetchone()
+    return (row[0], row[1]) if row else (None, None)
+
+def save_watermark(db_manager, table, watermark, full_refresh_at=None):
+    engine = db_manager.get_db_b_engine()
+    schema = db_manager.db_b_config['schema']
+    with engine.connect() as conn:
+        from sqlalchemy import text
+        conn.execute(text(f"""
+            INSERT INTO tms_dim_watermarks (table_name, watermark, row_count, last_full_refresh, refreshed_at)
+            VALUES (:table, :watermark, (SELECT COUNT(*) FROM {schema}.{get_mirror_table(table)}),
+                    :full_refresh_at, CURRENT_TIMESTAMP)
+            ON CONFLICT (table_name) DO UPDATE SET
+                watermark = EXCLUDED.watermark,
+                row_count = EXCLUDED.row_count,
+                last_full_refresh = COALESCE(EXCLUDED.last_full_refresh, tms_dim_watermarks.last_full_refresh),
+                refreshed_at = EXCLUDED.refreshed_at
+        """), {"table": table, "watermark": watermark, "full_refresh_at": full_refresh_at})
+        conn.commit()
+
+def refresh_dimension(db_manager, table, full=False):
+    """Refresh one mirror table; returns the number of rows copied from Database A.
+
+    Incremental refreshes re-read rows with update column >= the stored watermark
+    (rows committed with the watermark timestamp are not missed). Full refreshes
+    reload every row and delete mirror rows that no longer exist on Database A.
+    """
+    dimension = DIMENSION_TABLES[table]
+    key = dimension['key']
+    update_column = get_update_column(db_manager, table)
+    watermark, last_full_refresh = get_watermark(db_manager, table)
+    refresh_started = datetime.now(pytz.UTC)
+
+    if not full:
+        full = (update_column is None or watermark is None or last_full_refresh is None
+                or refresh_started - last_full_refresh > timedelta(hours=DIM_FULL_REFRESH_HOURS))
+
+    columns = ', '.join([f'"{col}"' for col in dimension['columns']])
+    source_updated = update_column if update_column else 'NULL::timestamp'
+    query = (f'SELECT CAST({key} AS text) AS {key}, {columns}, {source_updated} AS source_updated '
+             f'FROM "public"."{table}"')
+    if not full:
+        query += f" WHERE {update_column} >= '{watermark}'"
+
+    df = db_manager.execute_query_to_dataframe(query, 'A', read_replica=True)
+    df['mirrored_at'] = refresh_started
+    rows = 0
+    if not df.empty:
+        # Mirror tables track mirrored_at instead of last_synced
+        rows = db_manager.upsert_dataframe_to_db(df, get_mirror_table(table), [key], 'B',
+                                                 stamp_last_synced=False)
+
+    if full:
+        schema = db_manager.db_b_config['schema']
+        engine = db_manager.get_db_b_engine()
+        from sqlalchemy import text
+        with engine.connect() as conn:
+            result = conn.execute(text(
+                f"DELETE FROM {schema}.{get_mirror_table(table)} WHERE mirrored_at < :refresh_started"
+            ), {"refresh_started": refresh_started})
+            deleted = result.rowcount
+            conn.commit()
+        if deleted:
+            logger.info(f"Removed {deleted} rows deleted on Database A from {get_mirror_table(table)}")
+
+    if update_column and not df.empty and df['source_updated'].notna().any():
+        new_watermark = df['source_updated'].max()
+        watermark = max(watermark, new_watermark) if watermark is not None else new_watermark
+    save_watermark(db_manager, table, watermark, refresh_started if full else None)
+
+    logger.info(f"Mirrored {table}: {rows} rows ({'full' if full else 'incremental'} refresh)")
+    return rows
+
+def refresh_dimensions(db_manager=None, full=False):
+    """Refresh every mirrored dimension table; returns {table: rows copied}"""
+    db_manager = db_manager or DatabaseManager()
+    create_dimension_tables(db_manager)
+    return {table: refresh_dimension(db_manager, table, full=full) for table in DIMENSION_TABLES}
+
+def load_dimension_frames(db_manager):
+    """Read the mirrored dimension tables from Database B into DataFrames"""
+    schema = db_manager.db_b_config['schema']
+    frames = {}
+    for table, dimension in DIMENSION_TABLES.items():
+        columns = ', '.join([dimension['key']] + [f'"{col}"' for col in dimension['columns']])
+        frames[table] = db_manager.execute_query_to_dataframe(
+            f"SELECT {columns} FROM {schema}.{get_mirror_table(table)}", 'B')
+    return frames
+
+class DimensionCache:
+    """Process-wide cache of the mirrored dimension tables as compact lookup arrays.
+
+    Each table is held as a key Index plus one Categorical per value column, so
+    enriching a fact frame is an Index.get_indexer followed by a take on the
+    category codes; every distinct name or address is stored once. The cache is
+    reused until DIM_CACHE_TTL_SECONDS have passed and then only reloaded if
+    tms_dim_watermarks reports a different version.
+    """
+
+    def __init__(self, ttl_seconds=DIM_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.tables = {}
+        self.version = None
+        self.checked_at = None
+        self.lock = threading.Lock()
+
+    def get_version(self, db_manager):
+        engine = db_manager.get_db_b_engine()
+        with engine.connect() as conn:
+            from sqlalchemy import text
+            row = conn.execute(text(
+                "SELECT MAX(watermark), MAX(last_full_refresh), SUM(row_count) FROM tms_dim_watermarks"
+            )).fetchone()
+        return tuple(row) if row else None
+
+    def is_fresh(self):
+        return self.checked_at is not None and time.monotonic() - self.checked_at < self.ttl_seconds
+
+    def ensure_loaded(self, db_manager, refresh=True):
+        """Load (or keep) the cached tables; refreshes the mirror first when expired"""
+        with self.lock:
+            if self.is_fresh():
+                return self
+            if refresh:
+                refresh_dimensions(db_manager)
+
+            version = self.get_version(db_manager)
+            if self.tables and version == self.version:
+                self.checked_at = time.monotonic()
+                return self
+
+            self.tables = {
+                table: self._compact(frame, DIMENSION_TABLES[table])
+                for table, frame in load_dimension_frames(db_manager).items()
+            }
+            self.version = version
+            self.checked_at = time.monotonic()
+            logger.info(
+                "Dimension cache loaded: "
+                + ', '.join(f"{table} {len(entry['index'])}" for table, entry in self.tables.items())
+            )
+            return self
+
+    @staticmethod
+    def _compact(frame, dimension):
+        frame = frame.drop_duplicates(dimension['key'])
+        return {
+            'index': pd.Index(frame[dimension['key']].astype(str)),
+            'columns': {col: pd.Categorical(frame[col]) for col in dimension['columns']},
+        }
+
+    def lookup(self, table, keys, column):
+        """Return `column` of `table` for text keys as a Categorical (NaN where not found)"""
+        entry = self.tables[table]
+        values = entry['columns'][column]
+        positions = entry['index'].get_indexer(pd.Index(np.asarray(keys, dtype=object)))
+        if len(values) == 0:
+            codes = np.full(len(positions), -1, dtype=values.codes.dtype)
+        else:
+            codes = np.where(positions >= 0, values.codes.take(positions), -1)
+        return pd.Categorical.from_codes(codes, categories=values.categories)
+
+_dimension_cache = DimensionCache()
+
+def get_dimension_cache(db_manager, refresh=True):
+    """Return the process-wide DimensionCache, loading or refreshing it when expired"""
+    return _dimension_cache.ensure_loaded(db_manager, refresh=refresh)
+
+def add_route_dimensions(df, cache, vehicle_code_column='vehicle_code'):
+    """Add driver_name, vehicle code, plate_number and kenek_name from text driver/vehicle/kenek ids.
+    
+    vehicle_code_column=None skips the vehicle code (fact_delivery does not use it).
+    """
+    if vehicle_code_column:
+        df[vehicle_code_column] = cache.lookup('mst_vehicle', df['vehicle_id'], 'code')
+    df['plate_number'] = cache.lookup('mst_vehicle', df['vehicle_id'], 'plate_number')
+    df['driver_name'] = cache.lookup('dma_driver', df['driver_id'], 'driver_name')
+    df['kenek_name'] = cache.lookup('dma_kenek', df['kenek_id'], 'kenek_name')
+    return df
+
+def add_customer_dimensions(df, cache, code_column='code', name_column='name'):
+    """Add the customer location columns from a text customer_id column"""
+    parent_ids = cache.lookup('mst_location_child', df['customer_id'], 'mst_location_parent_id')
+    df['address'] = cache.lookup('mst_location_child', df['customer_id'], 'address')
+    df['address_text'] = cache.lookup('mst_location_child', df['customer_id'], 'address_text')
+    df[code_column] = cache.lookup('mst_location_parent', parent_ids, 'code')
+    df[name_column] = cache.lookup('mst_location_parent', parent_ids, 'name')
+    return df
+
+def enrich_with_dimensions(frames, cache):
+    """Add the dimension columns to narrow shared extracts (see shared_extract.py)"""
+    frames['routes'] = add_route_dimensions(frames['routes'], cache)
+    customer_ids = frames['orders']['customer_id'].dropna().unique()
+    customers = pd.DataFrame({'customer_id': customer_ids})
+    frames['customers'] = add_customer_dimensions(customers, cache, 'location_code', 'location_name')
+    return frames
+
+def print_dimension_status(db_manager):
+    """Print the watermark table for the command line"""
+    engine = db_manager.get_db_b_engine()
+    with engine.connect() as conn:
+        from sqlalchemy import text
+        rows = conn.execute(text(
+            "SELECT table_name, row_count, watermark, last_full_refresh, refreshed_at "
+            "FROM tms_dim_watermarks ORDER BY table_name"
+        )).fetchall()
+
+    print(f"\n{'Table':<22} {'Rows':<8} {'Watermark':<20} {'Last full':<20} {'Refreshed'}")
+    print("-" * 90)
+    for table, row_count, watermark, last_full, refreshed in rows:
+        fmt = lambda value: value.strftime('%Y-%m-%d %H:%M:%S') if value else 'N/A'
+        print(f"{table:<22} {row_count or 0:<8} {fmt(watermark):<20} {fmt(last_full):<20} {fmt(refreshed)}")
@@ -7,10 +7,69 @@ This program executes the fact_delivery query from Database A and upserts the re
 import sys
 import logging
 import pandas as pd
-from database_utils import DatabaseManager, logger
+from database_utils import DatabaseManager, logger, sql_literal_list
+from fact_pipeline import run_fact_pipeline
 
-def get_fact_delivery_query(date_from=None, date_to=None):
-    """Return the fact_delivery query with optional date filtering"""
+# Output columns of the fact_delivery query, in order
+FACT_DELIVERY_COLUMNS = [
+    'route_id', 'manifest_reference', 'route_detail_id', 'order_id', 'do_number', 'faktur_date',
+    'created_date_only', 'waktu', 'delivery_date', 'status', 'client_id', 'warehouse_id', 'origin_name',
+    'origin_city', 'customer_id', 'code', 'name', 'address', 'address_text', 'external_expedition_type',
+    'vehicle_id', 'driver_id', 'plate_number', 'driver_name', 'kenek_id', 'kenek_name', 'driver_status',
+    'manifest_integration_id', 'complete_time', 'net_price', 'quantity_delivery', 'quantity_faktur',
+]
+
+# Low-cardinality columns dictionary-encoded on fetch
+FACT_DELIVERY_CATEGORICAL_COLUMNS = [
+    'status', 'client_id', 'warehouse_id', 'origin_name', 'origin_city', 'code', 'name',
+    'external_expedition_type', 'vehicle_id', 'driver_id', 'plate_number', 'driver_name',
+    'kenek_id', 'kenek_name', 'driver_status',
+]
+
+# Column types of the fact_delivery queries for the Arrow fetch backend (arrow_fetch.py)
+FACT_DELIVERY_COLUMN_TYPES = {
+    'route_id': 'string',
+    'manifest_reference': 'string',
+    'route_detail_id': 'string',
+    'order_id': 'string',
+    'do_number': 'string',
+    'faktur_date': 'date',
+    'created_date_only': 'date',
+    'waktu': 'time',
+    'delivery_date': 'date',
+    'status': 'string',
+    'client_id': 'string',
+    'warehouse_id': 'string',
+    'origin_name': 'string',
+    'origin_city': 'string',
+    'customer_id': 'string',
+    'code': 'string',
+    'name': 'string',
+    'address': 'string',
+    'address_text': 'string',
+    'external_expedition_type': 'string',
+    'vehicle_id': 'string',
+    'driver_id': 'string',
+    'plate_number': 'string',
+    'driver_name': 'string',
+    'kenek_id': 'string',
+    'kenek_name': 'string',
+    'driver_status': 'string',
+    'manifest_integration_id': 'string',
+    'complete_time': 'timestamp',
+    'net_price': 'numeric',
+    'quantity_delivery': 'numeric',
+    'quantity_faktur': 'numeric',
+}
+
+def get_fact_delivery_where_clause(date_from=None, date_to=None, order_ids=None, parameterized=False):
+    """Return the WHERE clause shared by the fact_delivery queries.
+    
+    parameterized returns the date window as $1/$2 parameters of a prepared statement.
+    """
+    if parameterized:
+        return "WHERE c.faktur_date >= $1::date AND c.faktur_date <= $2::date"
+    
     # Build WHERE clause based on date parameters
     where_clause = "WHERE 1=1"
     
@@ -34,6 +93,22 @@ def get_fact_delivery_query(date_from=None, date_to=None):
     else:
         where_clause += " AND c.faktur_date <= CURRENT_DATE"
     
+    if order_ids is not None:
+        where_clause += f" AND c.order_id IN ({sql_literal_list(order_ids)})"
+    
+    return where_clause
+
+def get_fact_delivery_query(date_from=None, date_to=None, order_ids=None, source_schema='public',
+                            parameterized=False):
+    """Return the fact_delivery query with optional date filtering.
+    
+    order_ids restricts the query to the given orders (used for targeted resyncs).
+    source_schema is the schema holding the source tables (the foreign tables schema
+    when the query runs on Database B through postgres_fdw, see fdw_sync.py).
+    parameterized leaves the date window as $1/$2 for a prepared statement.
+    """
+    where_clause = get_fact_delivery_where_clause(date_from, date_to, order_ids, parameterized)
+    
     return f"""
     SELECT
         a.route_id,
@@ -75,25 +150,25 @@ def get_fact_delivery_query(date_from=None, date_to=None):
         SUM(j.quantity_delivery)::NUMERIC(15,2) as quantity_delivery,
         SUM(j.quantity_faktur)::NUMERIC(15,2) as quantity_faktur
     FROM
-        PUBLIC.route AS a
+        {source_schema}.route AS a
     LEFT JOIN
-        PUBLIC.route_detail AS b ON b.route_id = a.route_id
+        {source_schema}.route_detail AS b ON b.route_id = a.route_id
     LEFT JOIN
-        PUBLIC."order" AS c ON c.order_id = b.order_id
+        {source_schema}."order" AS c ON c.order_id = b.order_id
     LEFT JOIN 
-        PUBLIC.mst_location_child as d ON d.mst_location_child_id = c.customer_id
+        {source_schema}.mst_location_child as d ON d.mst_location_child_id = c.customer_id
     LEFT JOIN
-        PUBLIC.mst_location_parent as e ON e.mst_location_parent_id = d.mst_location_parent_id
+        {source_schema}.mst_location_parent as e ON e.mst_location_parent_id = d.mst_location_parent_id
     LEFT JOIN 
-        PUBLIC.mst_vehicle as f ON f.mst_vehicle_id = a.vehicle_id
+        {source_schema}.mst_vehicle as f ON f.mst_vehicle_id = a.vehicle_id
     LEFT JOIN 
-        PUBLIC.dma_driver as g ON g.driver_id = a.driver_id
+        {source_schema}.dma_driver as g ON g.driver_id = a.driver_id
     LEFT JOIN 
-        PUBLIC.dma_kenek as h ON h.kenek_id = a.kenek_id
+        {source_schema}.dma_kenek as h ON h.kenek_id = a.kenek_id
     LEFT JOIN 
-        PUBLIC.driver_tasks as i on i.order_id = b.order_id
+        {source_schema}.driver_tasks as i on i.order_id = b.order_id
     LEFT JOIN 
-        PUBLIC.order_detail as j on j.order_id = b.order_id
+        {source_schema}.order_detail as j on j.order_id = b.order_id
     {where_clause}
     GROUP BY
         a.route_id,
@@ -126,6 +201,85 @@ def get_fact_delivery_query(date_from=None, date_to=None):
         c.delivery_date
     """
 
+def get_fact_delivery_narrow_query(date_from=None, date_to=None, order_ids=None, source_schema='public',
+                                   parameterized=False):
+    """Return the fact_delivery query without the dimension joins.
+    
+    Customer location, vehicle, driver and kenek columns are added afterwards from
+    the DimensionCache (enrich_fact_delivery_dataframe), so only ids cross the
+    network. Ids are cast to text to match the tms_dim_* mirror keys. source_schema
+    and parameterized as for get_fact_delivery_query.
+    """
+    where_clause = get_fact_delivery_where_clause(date_from, date_to, order_ids, parameterized)
+    
+    return f"""
+    SELECT
+        a.route_id,
+        a.manifest_reference,
+        b.route_detail_id,
+        b.order_id,
+        c.do_number,
+        c.faktur_date,
+        DATE(a.created_date) AS created_date_only,
+        a.created_date::TIMESTAMP::TIME as waktu,
+        CASE 
+          WHEN c.delivery_date IS NOT NULL 
+          AND c.delivery_date >= '1900-01-01'::date
+          AND c.delivery_date <= '2100-12-31'::date
+          THEN c.delivery_date 
+          ELSE NULL 
+        END AS delivery_date,
+        a.status,
+        c.client_id,
+        c.warehouse_id,
+        c.origin_name,
+        c.origin_city,
+        CAST(c.customer_id AS text) AS customer_id,
+        a.external_expedition_type,
+        CAST(a.vehicle_id AS text) AS vehicle_id,
+        CAST(a.driver_id AS text) AS driver_id,
+        CAST(a.kenek_id AS text) AS kenek_id,
+        a.driver_status,
+        a.manifest_integration_id,
+        i.complete_time,
+        SUM(j.net_price)::NUMERIC(15,2) as net_price,
+        SUM(j.quantity_delivery)::NUMERIC(15,2) as quantity_delivery,
+        SUM(j.quantity_faktur)::NUMERIC(15,2) as quantity_faktur
+    FROM
+        {source_schema}.route AS a
+    LEFT JOIN
+        {source_schema}.route_detail AS b ON b.route_id = a.route_id
+    LEFT JOIN
+        {source_schema}."order" AS c ON c.order_id = b.order_id
+    LEFT JOIN 
+        {source_schema}.driver_tasks as i on i.order_id = b.order_id
+    LEFT JOIN 
+        {source_schema}.order_detail as j on j.order_id = b.order_id
+    {where_clause}
+    GROUP BY
+        a.route_id,
+        a.manifest_reference,
+        b.route_detail_id,
+        b.order_id,
+        c.do_number,
+        c.faktur_date,
+        a.created_date,
+        a.status,
+        c.client_id,
+        c.warehouse_id,
+        c.origin_name,
+        c.origin_city,
+        c.customer_id,
+        a.external_expedition_type,
+        a.vehicle_id,
+        a.driver_id,
+        a.kenek_id,
+        a.driver_status,
+        a.manifest_integration_id,
+        i.complete_time,
+        c.delivery_date
+    """
+
 def create_fact_delivery_table_schema_b(db_manager):
     """Create fact_delivery table in Database B if it doesn't exist"""
     create_table_query = """
@@ -178,8 +332,37 @@ def create_fact_delivery_table_schema_b(db_manager):
         logger.error(f"Error creating fact_delivery table: {e}")
         raise
 
-def process_fact_delivery(date_from=None, date_to=None):
-    """Main function to process fact_delivery data with optional date filtering"""
+def transform_fact_delivery_dataframe(df):
+    """Convert the fact_delivery date columns to datetime.date values"""
+    # Convert faktur_date to datetime.date if it's not null
+    if 'faktur_date' in df.columns:
+        df['faktur_date'] = pd.to_datetime(df['faktur_date'], errors='coerce').dt.date
+    
+    # Convert created_date_only to datetime.date if it's not null
+    if 'created_date_only' in df.columns:
+        df['created_date_only'] = pd.to_datetime(df['created_date_only'], errors='coerce').dt.date
+    
+    # Convert delivery_date to datetime.date if it's not null
+    if 'delivery_date' in df.columns:
+        df['delivery_date'] = pd.to_datetime(df['delivery_date'], errors='coerce').dt.date
+    
+    return df
+
+def enrich_fact_delivery_dataframe(df, cache):
+    """Add the dimension columns to rows of the narrow fact_delivery query"""
+    from dimension_mirror import add_route_dimensions, add_customer_dimensions
+    
+    df = add_route_dimensions(df, cache, vehicle_code_column=None)
+    df = add_customer_dimensions(df, cache)
+    return df[FACT_DELIVERY_COLUMNS]
+
+def process_fact_delivery(date_from=None, date_to=None, db_manager=None, chunk_cache=None, plan_capture=None):
+    """Main function to process fact_delivery data with optional date filtering.
+    
+    chunk_cache (a chunk_cache.ChunkCache) spills extracted windows for --replay and
+    plan_capture (a query_plans.PlanCapture) records the plans of slow windows.
+    Returns the number of rows upserted into Database B.
+    """
     try:
         logger.info("Starting fact_delivery data processing...")
         
@@ -187,44 +370,42 @@ def process_fact_delivery(date_from=None, date_to=None):
             logger.info(f"Date filter: {date_from} to {date_to}")
         
         # Initialize database manager
-        db_manager = DatabaseManager()
+        if db_manager is None:
+            db_manager = DatabaseManager()
         
         # Create table in Database B if not exists
         create_fact_delivery_table_schema_b(db_manager)
         
-        # Execute query on Database A
-        logger.info("Executing fact_delivery query on Database A...")
-        query = get_fact_delivery_query(date_from=date_from, date_to=date_to)
-        df = db_manager.execute_query_to_dataframe(query, 'A')
+        # Execute query on Database A window by window and upsert into Database B
+        # (composite primary key)
+        build_query = get_fact_delivery_query
+        transform = transform_fact_delivery_dataframe
+        from dimension_mirror import DIMENSION_MIRROR
+        if DIMENSION_MIRROR:
+            # Extract ids only and look the dimension columns up in memory
+            from dimension_mirror import get_dimension_cache
+            cache = get_dimension_cache(db_manager)
+            build_query = get_fact_delivery_narrow_query
+            transform = lambda df: transform_fact_delivery_dataframe(enrich_fact_delivery_dataframe(df, cache))
         
-        # Convert date columns to proper format for pandas
-        if not df.empty:
-            # Convert faktur_date to datetime.date if it's not null
-            if 'faktur_date' in df.columns:
-                df['faktur_date'] = pd.to_datetime(df['faktur_date'], errors='coerce').dt.date
-            
-            # Convert created_date_only to datetime.date if it's not null
-            if 'created_date_only' in df.columns:
-                df['created_date_only'] = pd.to_datetime(df['created_date_only'], errors='coerce').dt.date
-            
-            # Convert delivery_date to datetime.date if it's not null
-            if 'delivery_date' in df.columns:
-                df['delivery_date'] = pd.to_datetime(df['delivery_date'], errors='coerce').dt.date
+        logger.info("Executing fact_delivery query on Database A...")
+        rows = run_fact_pipeline(
+            db_manager, 'fact_delivery', 'tms_fact_delivery', ['route_id', 'route_detail_id', 'order_id'],
+            build_query=lambda window_from, window_to: build_query(date_from=window_from, date_to=window_to),
+            transform=transform,
+            date_from=date_from, date_to=date_to,
+            categorical_columns=FACT_DELIVERY_CATEGORICAL_COLUMNS,
+            chunk_cache=chunk_cache,
+            plan_capture=plan_capture,
+            prepared_query=build_query(parameterized=True),
+            column_types=FACT_DELIVERY_COLUMN_TYPES,
+        )
         
-        if df.empty:
+        if rows == 0:
             logger.warning("No data retrieved from fact_delivery query")
-            return
-        
-        logger.info(f"Retrieved {len(df)} rows from fact_delivery query")
-        
-        # Define unique columns for upsert (composite primary key)
-        unique_columns = ['route_id', 'route_detail_id', 'order_id']
-        
-        # Upsert data to Database B
-        logger.info("Upserting fact_delivery data to Database B...")
-        db_manager.upsert_dataframe_to_db(df, 'tms_fact_delivery', unique_columns, 'B')
         
-        logger.info("fact_delivery data processing completed successfully!")
+        logger.info(f"fact_delivery data processing completed successfully! ({rows} rows)")
+        return rows
         
     except Exception as e:
         logger.error(f"Error in fact_delivery processing: {e}")
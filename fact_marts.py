@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Fact Marts
+Daily aggregate tables on top of tms_fact_order and tms_fact_delivery in Database B,
+for BI queries that group by day and driver, vehicle, warehouse or client without
+scanning the fact tables.
+
+Marts are refreshed incrementally: the faktur_date days of fact rows whose
+last_synced is newer than the mart's watermark (minus MART_WATERMARK_OVERLAP_MINUTES,
+for loads committed after their last_synced was stamped) are deleted from the mart
+and re-aggregated from the fact table, one transaction per MART_REFRESH_BATCH_DAYS
+days. Every writer (sync, backfill, CDC, replay, fdw/async engines) stamps
+last_synced on the rows it writes. Days a row leaves (deleted by CDC or a resync, or
+moved to another faktur_date by an upsert) keep no stamped row, so triggers on the
+fact tables record them in tms_mart_dirty_days and the refresh adds them too.
+run_sync refreshes the marts of its facts after a successful sync when
+FACT_MARTS=true; `--refresh-marts` runs it by hand (`--full-refresh` rebuilds all days).
+"""
+
+import os
+from datetime import timedelta
+from database_utils import DatabaseManager, logger
+
+FACT_MARTS = os.getenv('FACT_MARTS', 'true').lower() == 'true'
+MART_WATERMARK_OVERLAP_MINUTES = float(os.getenv('MART_WATERMARK_OVERLAP_MINUTES', 60))
+MART_REFRESH_BATCH_DAYS = int(os.getenv('MART_REFRESH_BATCH_DAYS', 31))
+
+ORDER_MEASURES = [
+    ('order_count', 'INTEGER', 'COUNT(*)'),
+    ('total_net_value', 'NUMERIC(18,2)', 'SUM(total_net_value)'),
+    ('total_return', 'NUMERIC(18,2)', 'SUM(total_return)'),
+    ('faktur_total_quantity', 'NUMERIC(18,2)', 'SUM(faktur_total_quantity)'),
+    ('tms_total_quantity', 'NUMERIC(18,2)', 'SUM(tms_total_quantity)'),
+]
+
+DELIVERY_MEASURES = [
+    ('order_count', 'INTEGER', 'COUNT(DISTINCT order_id)'),
+    ('line_count', 'INTEGER', 'COUNT(*)'),
+    ('total_net_price', 'NUMERIC(18,2)', 'SUM(net_price)'),
+    ('quantity_faktur', 'NUMERIC(18,2)', 'SUM(quantity_faktur)'),
+    ('quantity_delivery', 'NUMERIC(18,2)', 'SUM(quantity_delivery)'),
+]
+
+# One entry per mart: source fact, grouping columns (besides faktur_date) and measures
+MART_SPECS = {
+    'tms_mart_order_driver_daily': {
+        'fact': 'fact_order',
+        'source': 'tms_fact_order',
+        'dimensions': [('driver_name', 'VARCHAR(100)'), ('status', 'VARCHAR(50)')],
+        'measures': ORDER_MEASURES,
+    },
+    'tms_mart_delivery_vehicle_daily': {
+        'fact': 'fact_delivery',
+        'source': 'tms_fact_delivery',
+        'dimensions': [('vehicle_id', 'VARCHAR(50)'), ('plate_number', 'VARCHAR(20)'), ('status', 'VARCHAR(50)')],
+        'measures': DELIVERY_MEASURES,
+    },
+    'tms_mart_delivery_warehouse_daily': {
+        'fact': 'fact_delivery',
+        'source': 'tms_fact_delivery',
+        'dimensions': [('warehouse_id', 'VARCHAR(50)'), ('origin_name', 'VARCHAR(200)'), ('status', 'VARCHAR(50)')],
+        'measures': DELIVERY_MEASURES,
+    },
+    'tms_mart_delivery_client_daily': {
+        'fact': 'fact_delivery',
+        'source': 'tms_fact_delivery',
+        'dimensions': [('client_id', 'VARCHAR(50)'), ('status', 'VARCHAR(50)')],
+        'measures': DELIVERY_MEASURES,
+    },
+}
+
+# Records the old faktur_date of deleted rows and of rows whose faktur_date changed.
+# Statement-level with transition tables, so a bulk delete or upsert costs one INSERT.
+DIRTY_DAYS_FUNCTION = """
+CREATE OR REPLACE FUNCTION tms_mart_record_dirty_days() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO tms_mart_dirty_days (source, faktur_date, recorded_at)
+        SELECT DISTINCT TG_TABLE_NAME, faktur_date, CURRENT_TIMESTAMP
+        FROM old_rows WHERE faktur_date IS NOT NULL
+        ON CONFLICT (source, faktur_date) DO UPDATE SET recorded_at = EXCLUDED.recorded_at;
+    ELSE
+        INSERT INTO tms_mart_dirty_days (source, faktur_date, recorded_at)
+        SELECT TG_TABLE_NAME, faktur_date, CURRENT_TIMESTAMP
+        FROM (
+            SELECT faktur_date FROM old_rows WHERE faktur_date IS NOT NULL
+            EXCEPT
+            SELECT faktur_date FROM new_rows
+        ) moved
+        ON CONFLICT (source, faktur_date) DO UPDATE SET recorded_at = EXCLUDED.recorded_at;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+def get_dirty_days_trigger_statement(source, operation):
+    """Create the dirty-days trigger for operation (DELETE or UPDATE) on source unless it exists"""
+    trigger_name = f"{source}_mart_dirty_{operation.lower()}"
+    transition_tables = 'OLD TABLE AS old_rows' + (' NEW TABLE AS new_rows' if operation == 'UPDATE' else '')
+    # Checked instead of DROP/CREATE, which would lock the fact table on every refresh
+    return f"""
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_trigger
+            WHERE tgname = '{trigger_name}' AND tgrelid = '{source}'::regclass
+        ) THEN
+            CREATE TRIGGER {trigger_name}
+            AFTER {operation} ON {source}
+            REFERENCING {transition_tables}
+            FOR EACH STATEMENT EXECUTE FUNCTION tms_mart_record_dirty_days();
+        END IF;
+    END
+    $$
+    """
+
+def create_mart_tables(db_manager, mart_names=None):
+    """Create the mart tables, their indexes, tms_mart_watermarks and the dirty-days triggers in Database B"""
+    statements = ["""
+    CREATE TABLE IF NOT EXISTS tms_mart_watermarks (
+        mart_name VARCHAR(100) PRIMARY KEY,
+        refreshed_through TIMESTAMP WITH TIME ZONE NOT NULL,
+        refreshed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    )
+    """, """
+    CREATE TABLE IF NOT EXISTS tms_mart_dirty_days (
+        source VARCHAR(100) NOT NULL,
+        faktur_date DATE NOT NULL,
+        recorded_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (source, faktur_date)
+    )
+    """, DIRTY_DAYS_FUNCTION]
+    sources = []
+    for mart_name in mart_names or MART_SPECS:
+        spec = MART_SPECS[mart_name]
+        columns = ',\n        '.join(
+            [f"{column} {column_type}" for column, column_type in spec['dimensions']]
+            + [f"{column} {column_type}" for column, column_type, _ in spec['measures']]
+        )
+        first_dimension = spec['dimensions'][0][0]
+        statements += [
+            f"""
+            CREATE TABLE IF NOT EXISTS {mart_name} (
+                faktur_date DATE NOT NULL,
+                {columns},
+                refreshed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            f"CREATE INDEX IF NOT EXISTS idx_{mart_name}_date ON {mart_name} (faktur_date)",
+            f"CREATE INDEX IF NOT EXISTS idx_{mart_name}_{first_dimension} "
+            f"ON {mart_name} ({first_dimension}, faktur_date)",
+            # Touched days are found through last_synced (same index as create_tables.py)
+            f"CREATE INDEX IF NOT EXISTS idx_{spec['source']}_last_synced ON {spec['source']} (last_synced)",
+        ]
+        if spec['source'] not in sources:
+            sources.append(spec['source'])
+    for source in sources:
+        statements += [get_dirty_days_trigger_statement(source, 'DELETE'),
+                       get_dirty_days_trigger_statement(source, 'UPDATE')]
+
+    try:
+        engine = db_manager.get_db_b_engine()
+        with engine.connect() as conn:
+            from sqlalchemy import text
+            for statement in statements:
+                conn.execute(text(statement))
+            conn.commit()
+    except Exception as e:
+        logger.error(f"Error creating mart tables: {e}")
+        raise
+
+def get_mart_refresh_query(mart_name):
+    """INSERT ... SELECT re-aggregating the faktur_date days in :days into a mart"""
+    spec = MART_SPECS[mart_name]
+    dimensions = [column for column, _ in spec['dimensions']]
+    measures = [column for column, _, _ in spec['measures']]
+    aggregates = [expression for _, _, expression in spec['measures']]
+    return f"""
+    INSERT INTO {mart_name} (faktur_date, {', '.join(dimensions + measures)}, refreshed_at)
+    SELECT faktur_date, {', '.join(dimensions + aggregates)}, CURRENT_TIMESTAMP
+    FROM {spec['source']}
+    WHERE faktur_date = ANY(:days)
+    GROUP BY faktur_date, {', '.join(dimensions)}
+    """
+
+def get_touched_days(conn, source, since):
+    """faktur_date days of source rows synced, and of rows deleted or moved away, after since
+    (every day present when since is None)"""
+    from sqlalchemy import text
+    if since is None:
+        query = f"SELECT DISTINCT faktur_date FROM {source} WHERE faktur_date IS NOT NULL ORDER BY 1"
+        return [row[0] for row in conn.execute(text(query))]
+    query = f"""
+    SELECT faktur_date FROM {source}
+    WHERE last_synced > :since AND faktur_date IS NOT NULL
+    UNION
+    SELECT faktur_date FROM tms_mart_dirty_days
+    WHERE source = :source AND recorded_at > :since
+    ORDER BY 1
+    """
+    return [row[0] for row in conn.execute(text(query), {'since': since, 'source': source})]
+
+def prune_dirty_days(conn, source):
+    """Delete dirty days of source already behind the watermark of every mart built from it"""
+    from sqlalchemy import text
+    mart_names = [name for name, spec in MART_SPECS.items() if spec['source'] == source]
+    # A mart without a watermark yet does a full refresh, which does not need dirty days
+    conn.execute(text("""
+        DELETE FROM tms_mart_dirty_days
+        WHERE source = :source
+        AND recorded_at < (
+            SELECT MIN(refreshed_through) FROM tms_mart_watermarks WHERE mart_name = ANY(:mart_names)
+        ) - make_interval(secs => :overlap_seconds)
+    """), {'source': source, 'mart_names': mart_names, 'overlap_seconds': MART_WATERMARK_OVERLAP_MINUTES * 60})
+
+def refresh_mart(db_manager, mart_name, full=False):
+    """Re-aggregate the days touched since the mart's watermark; returns days refreshed"""
+    from sqlalchemy import text
+
+    spec = MART_SPECS[mart_name]
+    engine = db_manager.get_db_b_engine()
+    try:
+        with engine.connect() as conn:
+            # Taken before reading touched days, so rows stamped during the refresh are seen next time
+            refreshed_through = conn.execute(text("SELECT CURRENT_TIMESTAMP")).scalar()
+            since = None
+            if not full:
+                watermark = conn.execute(text(
+                    "SELECT refreshed_through FROM tms_mart_watermarks WHERE mart_name = :mart_name"
+                ), {'mart_name': mart_name}).scalar()
+                if watermark is not None:
+                    since = watermark - timedelta(minutes=MART_WATERMARK_OVERLAP_MINUTES)
+            days = get_touched_days(conn, spec['source'], since)
+            conn.rollback()
+
+            if full:
+                # Days no longer present in the fact table
+                conn.execute(text(f"DELETE FROM {mart_name} WHERE faktur_date <> ALL(:days)"), {'days': days})
+                conn.commit()
+            refresh_query = text(get_mart_refresh_query(mart_name))
+            for index in range(0, len(days), MART_REFRESH_BATCH_DAYS):
+                batch = days[index:index + MART_REFRESH_BATCH_DAYS]
+                conn.execute(text(f"DELETE FROM {mart_name} WHERE faktur_date = ANY(:days)"), {'days': batch})
+                conn.execute(refresh_query, {'days': batch})
+                conn.commit()
+
+            conn.execute(text("""
+                INSERT INTO tms_mart_watermarks (mart_name, refreshed_through, refreshed_at)
+                VALUES (:mart_name, :refreshed_through, CURRENT_TIMESTAMP)
+                ON CONFLICT (mart_name) DO UPDATE SET
+                    refreshed_through = EXCLUDED.refreshed_through,
+                    refreshed_at = EXCLUDED.refreshed_at
+            """), {'mart_name': mart_name, 'refreshed_through': refreshed_through})
+            prune_dirty_days(conn, spec['source'])
+            conn.commit()
+    except Exception as e:
+        logger.error(f"Error refreshing {mart_name}: {e}")
+        raise
+
+    if days:
+        logger.info(f"Refreshed {mart_name} for {len(days)} days ({days[0]} to {days[-1]})")
+    else:
+        logger.info(f"{mart_name} is up to date")
+    return len(days)
+
+def get_mart_names(fact_names=None):
+    """Names of the marts built from fact_names (default: every mart)"""
+    return [name for name, spec in MART_SPECS.items() if fact_names is None or spec['fact'] in fact_names]
+
+def refresh_marts(db_manager=None, fact_names=None, full=False):
+    """Refresh the marts of fact_names (default: all); returns {mart_name: days refreshed}"""
+    db_manager = db_manager or DatabaseManager()
+    mart_names = get_mart_names(fact_names)
+    create_mart_tables(db_manager, mart_names)
+    return {mart_name: refresh_mart(db_manager, mart_name, full=full) for mart_name in mart_names}
+
+def print_mart_status(db_manager, fact_names=None):
+    """Print the watermark and size of the marts of fact_names"""
+    from sqlalchemy import text
+
+    print(f"\n{'Mart':<36} {'Rows':>10} {'Days':>6} {'Refreshed through':<20}")
+    print("-" * 76)
+    with db_manager.get_db_b_engine().connect() as conn:
+        for mart_name in get_mart_names(fact_names):
+            rows, days = conn.execute(text(
+                f"SELECT COUNT(*), COUNT(DISTINCT faktur_date) FROM {mart_name}"
+            )).fetchone()
+            refreshed_through = conn.execute(text(
+                "SELECT refreshed_through FROM tms_mart_watermarks WHERE mart_name = :mart_name"
+            ), {'mart_name': mart_name}).scalar()
+            refreshed_str = refreshed_through.strftime('%Y-%m-%d %H:%M:%S') if refreshed_through else 'never'
+            print(f"{mart_name:<36} {rows:>10} {days:>6} {refreshed_str:<20}")
@@ -7,10 +7,52 @@ This program executes the fact_order query from Database A and upserts the resul
 import sys
 import logging
 import pandas as pd
-from database_utils import DatabaseManager, logger
+from database_utils import DatabaseManager, logger, sql_literal_list
+from fact_pipeline import run_fact_pipeline
 
-def get_fact_order_query(date_from=None, date_to=None):
-    """Return the fact_order query with optional date filtering"""
+# Output columns of the fact_order query, in order
+FACT_ORDER_COLUMNS = [
+    'status', 'manifest_reference', 'order_id', 'manifest_integration_id', 'external_expedition_type',
+    'driver_name', 'code', 'faktur_date', 'tms_created', 'route_created', 'delivery_date', 'route_id',
+    'tms_complete', 'location_confirmation', 'faktur_total_quantity', 'tms_total_quantity',
+    'total_return', 'total_net_value',
+]
+
+# Low-cardinality columns dictionary-encoded on fetch
+FACT_ORDER_CATEGORICAL_COLUMNS = [
+    'status', 'external_expedition_type', 'driver_name', 'code',
+]
+
+# Column types of the fact_order query for the Arrow fetch backend (arrow_fetch.py)
+FACT_ORDER_COLUMN_TYPES = {
+    'status': 'string',
+    'manifest_reference': 'string',
+    'order_id': 'string',
+    'manifest_integration_id': 'string',
+    'external_expedition_type': 'string',
+    'driver_name': 'string',
+    'code': 'string',
+    'faktur_date': 'date',
+    'tms_created': 'timestamp',
+    'route_created': 'date',
+    'delivery_date': 'date',
+    'route_id': 'string',
+    'tms_complete': 'timestamp',
+    'location_confirmation': 'date',
+    'faktur_total_quantity': 'numeric',
+    'tms_total_quantity': 'numeric',
+    'total_return': 'numeric',
+    'total_net_value': 'numeric',
+}
+
+def get_fact_order_where_clause(date_from=None, date_to=None, order_ids=None, parameterized=False):
+    """Return the WHERE clause of the fact_order query.
+    
+    parameterized returns the date window as $1/$2 parameters of a prepared statement.
+    """
+    if parameterized:
+        return "WHERE a.faktur_date >= $1::date AND a.faktur_date <= $2::date"
+    
     # Build WHERE clause based on date parameters
     where_clause = "WHERE 1=1"
     
@@ -34,6 +76,21 @@ def get_fact_order_query(date_from=None, date_to=None):
     else:
         where_clause += " AND a.faktur_date <= CURRENT_DATE"
     
+    if order_ids is not None:
+        where_clause += f" AND a.order_id IN ({sql_literal_list(order_ids)})"
+    
+    return where_clause
+
+def get_fact_order_query(date_from=None, date_to=None, order_ids=None, source_schema='public', parameterized=False):
+    """Return the fact_order query with optional date filtering.
+    
+    order_ids restricts the query to the given orders (used for targeted resyncs).
+    source_schema is the schema holding the source tables (the foreign tables schema
+    when the query runs on Database B through postgres_fdw, see fdw_sync.py).
+    parameterized leaves the date window as $1/$2 for a prepared statement.
+    """
+    where_clause = get_fact_order_where_clause(date_from, date_to, order_ids, parameterized)
+    
     return f"""
     SELECT DISTINCT ON (a.order_id)
       a.status,
@@ -71,33 +128,33 @@ def get_fact_order_query(date_from=None, date_to=None):
       (SUM(od.quantity_delivery) - SUM(od.quantity_unloading))::NUMERIC(15,2) AS total_return,
       SUM(od.net_price)::NUMERIC(15,2) AS total_net_value
     FROM
-      "public"."order" AS a
+      "{source_schema}"."order" AS a
     LEFT JOIN
-      "public"."route_detail" AS b
+      "{source_schema}"."route_detail" AS b
     ON
       b.order_id = a.order_id
     LEFT JOIN
-      "public"."route" AS c
+      "{source_schema}"."route" AS c
     ON
       c.route_id = b.route_id
     LEFT JOIN
-      "public"."dma_driver" AS d
+      "{source_schema}"."dma_driver" AS d
     ON
       d.driver_id = c.driver_id
     LEFT JOIN
-      "public"."mst_vehicle" AS e
+      "{source_schema}"."mst_vehicle" AS e
     ON
       e.mst_vehicle_id = c.vehicle_id
     LEFT JOIN
-      "public"."driver_tasks" AS f
+      "{source_schema}"."driver_tasks" AS f
     ON
       f.order_id = a.order_id
     LEFT JOIN
-      "public"."driver_task_confirmations" AS g
+      "{source_schema}"."driver_task_confirmations" AS g
     ON
       g.driver_task_id = f.driver_task_id
     LEFT JOIN
-      "public"."order_detail" AS od
+      "{source_schema}"."order_detail" AS od
     ON
       od.order_id = a.order_id
     {where_clause}
@@ -157,8 +214,33 @@ def create_fact_order_table_schema_b(db_manager):
         logger.error(f"Error creating fact_order table: {e}")
         raise
 
-def process_fact_order(date_from=None, date_to=None):
-    """Main function to process fact_order data with optional date filtering"""
+def transform_fact_order_dataframe(df):
+    """Convert the fact_order date columns to datetime.date values"""
+    # Convert route_created to datetime.date if it's not null
+    if 'route_created' in df.columns:
+        df['route_created'] = pd.to_datetime(df['route_created'], errors='coerce').dt.date
+    
+    # Convert location_confirmation to datetime.date if it's not null
+    if 'location_confirmation' in df.columns:
+        df['location_confirmation'] = pd.to_datetime(df['location_confirmation'], errors='coerce').dt.date
+    
+    # Convert faktur_date to datetime.date if it's not null
+    if 'faktur_date' in df.columns:
+        df['faktur_date'] = pd.to_datetime(df['faktur_date'], errors='coerce').dt.date
+    
+    # Convert delivery_date to datetime.date if it's not null
+    if 'delivery_date' in df.columns:
+        df['delivery_date'] = pd.to_datetime(df['delivery_date'], errors='coerce').dt.date
+    
+    return df
+
+def process_fact_order(date_from=None, date_to=None, db_manager=None, chunk_cache=None, plan_capture=None):
+    """Main function to process fact_order data with optional date filtering.
+    
+    chunk_cache (a chunk_cache.ChunkCache) spills extracted windows for --replay and
+    plan_capture (a query_plans.PlanCapture) records the plans of slow windows.
+    Returns the number of rows upserted into Database B.
+    """
     try:
         logger.info("Starting fact_order data processing...")
         
@@ -166,52 +248,32 @@ def process_fact_order(date_from=None, date_to=None):
             logger.info(f"Date filter: {date_from} to {date_to}")
         
         # Initialize database manager
-        db_manager = DatabaseManager()
+        if db_manager is None:
+            db_manager = DatabaseManager()
         
         # Create table in Database B if not exists
         create_fact_order_table_schema_b(db_manager)
         
-        # Execute query on Database A
+        # Execute query on Database A window by window and upsert into Database B
         logger.info("Executing fact_order query on Database A...")
-        query = get_fact_order_query(date_from=date_from, date_to=date_to)
+        rows = run_fact_pipeline(
+            db_manager, 'fact_order', 'tms_fact_order', ['order_id'],
+            build_query=lambda window_from, window_to: get_fact_order_query(date_from=window_from, date_to=window_to),
+            transform=transform_fact_order_dataframe,
+            date_from=date_from, date_to=date_to,
+            log_queries=True,
+            categorical_columns=FACT_ORDER_CATEGORICAL_COLUMNS,
+            chunk_cache=chunk_cache,
+            plan_capture=plan_capture,
+            prepared_query=get_fact_order_query(parameterized=True),
+            column_types=FACT_ORDER_COLUMN_TYPES,
+        )
         
-        # Debug: Log the generated query
-        logger.info(f"Generated query: {query}")
-        
-        df = db_manager.execute_query_to_dataframe(query, 'A')
-        
-        # Convert date columns to proper format for pandas
-        if not df.empty:
-            # Convert route_created to datetime.date if it's not null
-            if 'route_created' in df.columns:
-                df['route_created'] = pd.to_datetime(df['route_created'], errors='coerce').dt.date
-            
-            # Convert location_confirmation to datetime.date if it's not null
-            if 'location_confirmation' in df.columns:
-                df['location_confirmation'] = pd.to_datetime(df['location_confirmation'], errors='coerce').dt.date
-            
-            # Convert faktur_date to datetime.date if it's not null
-            if 'faktur_date' in df.columns:
-                df['faktur_date'] = pd.to_datetime(df['faktur_date'], errors='coerce').dt.date
-            
-            # Convert delivery_date to datetime.date if it's not null
-            if 'delivery_date' in df.columns:
-                df['delivery_date'] = pd.to_datetime(df['delivery_date'], errors='coerce').dt.date
-        
-        if df.empty:
+        if rows == 0:
             logger.warning("No data retrieved from fact_order query")
-            return
-        
-        logger.info(f"Retrieved {len(df)} rows from fact_order query")
-        
-        # Define unique columns for upsert
-        unique_columns = ['order_id']
-        
-        # Upsert data to Database B
-        logger.info("Upserting fact_order data to Database B...")
-        db_manager.upsert_dataframe_to_db(df, 'tms_fact_order', unique_columns, 'B')
         
-        logger.info("fact_order data processing completed successfully!")
+        logger.info(f"fact_order data processing completed successfully! ({rows} rows)")
+        return rows
         
     except Exception as e:
         logger.error(f"Error in fact_order processing: {e}")
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Fact Pipeline
+Shared extract -> transform -> load loop used by fact_order and fact_delivery.
+The requested faktur_date range is processed in date windows whose span is tuned
+by an AdaptiveChunkController, so skewed days do not dominate runtime or memory.
+"""
+
+import time
+from contextlib import nullcontext
+from datetime import date, timedelta
+from database_utils import get_process_rss_mb, get_prepared_statement_name, get_execute_sql, logger
+from chunk_controller import get_extraction_controller
+
+# Lower bound used by the fact queries when no --date-from is given
+DEFAULT_DATE_FROM = date(2024, 12, 1)
+
+def resolve_date_range(date_from=None, date_to=None):
+    """Return concrete (date_from, date_to) dates, applying the fact query defaults"""
+    date_from = date_from or DEFAULT_DATE_FROM
+    date_to = date_to or date.today()
+    if isinstance(date_from, str):
+        date_from = date.fromisoformat(date_from)
+    if isinstance(date_to, str):
+        date_to = date.fromisoformat(date_to)
+    return date_from, date_to
+
+def timed_frames(db_manager, frames):
+    """Yield frames from an iterator, timing the wait for each as the extract stage"""
+    iterator = iter(frames)
+    while True:
+        with db_manager.timed_stage('extract'):
+            df = next(iterator, None)
+        if df is None:
+            return
+        yield df
+
+def run_fact_pipeline(db_manager, fact_name, table_name, unique_columns, build_query, transform,
+                      date_from=None, date_to=None, log_queries=False, categorical_columns=None,
+                      chunk_cache=None, column_types=None, plan_capture=None, prepared_query=None):
+    """Extract, transform and upsert a fact table window by window.
+
+    build_query(date_from, date_to) returns the source SQL for one window and
+    transform(df) returns the frame to load. categorical_columns are dictionary-
+    encoded on fetch with dictionaries shared by all windows of the run.
+    column_types (column -> type name) enables the FETCH_BACKEND=arrow and
+    FETCH_BACKEND=copy paths; with copy each window is transformed and loaded block
+    by block as it is streamed out of Database A. With EXTRACT_WORKERS > 1 windows
+    are extracted ahead in parallel inside one exported snapshot (snapshot_extract.py).
+    With a ChunkCache every transformed window is spilled to disk before it is loaded.
+    With a PlanCapture (query_plans.py) the plans of slow windows are recorded.
+    prepared_query is the same query with the window as $1/$2 date parameters; with
+    the read_sql backend and PREPARED_QUERIES it is prepared once per connection and
+    executed for every window.
+    Returns the number of rows upserted.
+    """
+    from frame_compaction import RunDictionaries
+    from arrow_fetch import FETCH_BACKEND
+    from snapshot_extract import EXTRACT_WORKERS, extract_windows_in_snapshot
+
+    date_from, date_to = resolve_date_range(date_from, date_to)
+    controller = get_extraction_controller(f"{fact_name} extract")
+    dictionaries = RunDictionaries()
+    total_rows = 0
+    copy_backend = bool(column_types) and FETCH_BACKEND == 'copy'
+    # COPY cannot run a prepared statement, so only the read_sql backend uses it
+    use_prepared = (prepared_query is not None and db_manager.prepared_queries
+                    and not (column_types and FETCH_BACKEND in ('arrow', 'copy')))
+
+    def log_query(message):
+        if log_queries:
+            logger.info(message)
+        else:
+            logger.debug(message)
+
+    def get_query(window_start, window_end):
+        query = build_query(window_start, window_end)
+        log_query(f"Generated query: {query}")
+        return query
+
+    def extract_prepared(window_start, window_end, connection=None):
+        statement = get_prepared_statement_name(fact_name, prepared_query)
+        params = {'date_from': window_start, 'date_to': window_end}
+        log_query(f"Executing prepared statement {statement}({window_start}, {window_end})")
+        engine = db_manager.get_query_engine('A', read_replica=True)
+        with (nullcontext(connection) if connection is not None else engine.connect()) as conn:
+            start = time.perf_counter()
+            df = db_manager.execute_prepared_to_dataframe(
+                fact_name, prepared_query, ['date', 'date'], params,
+                'A', categorical_columns, dictionaries, connection=conn, read_replica=True)
+            extract_seconds = time.perf_counter() - start
+            if plan_capture is not None and plan_capture.should_capture(extract_seconds):
+                # EXPLAIN EXECUTE on the connection the window ran on records the plan it
+                # actually used, which may be the statement's generic plan
+                plan_capture.capture(fact_name, get_execute_sql(statement, params), window_start, window_end,
+                                     extract_seconds, connection=conn, params=params)
+        return df
+
+    def extract(window_start, window_end, connection=None):
+        if use_prepared:
+            return extract_prepared(window_start, window_end, connection)
+        query = get_query(window_start, window_end)
+        start = time.perf_counter()
+        df = db_manager.execute_query_to_dataframe(query, 'A', categorical_columns, dictionaries,
+                                                   column_types=column_types, connection=connection,
+                                                   read_replica=True)
+        extract_seconds = time.perf_counter() - start
+        if plan_capture is not None and plan_capture.should_capture(extract_seconds):
+            plan_capture.capture(fact_name, query, window_start, window_end, extract_seconds)
+        return df
+
+    def windows():
+        """Yield (window_start, window_end, frames, streamed, chunk_start) per window"""
+        if EXTRACT_WORKERS > 1 and not copy_backend:
+            # Windows are extracted ahead in parallel, all inside one snapshot of Database A
+            snapshot_windows = extract_windows_in_snapshot(db_manager, date_from, date_to, controller, extract)
+            while True:
+                with db_manager.timed_stage('extract'):
+                    window = next(snapshot_windows, None)
+                if window is None:
+                    return
+                window_start, window_end, df, extract_seconds = window
+                yield window_start, window_end, [df], False, time.perf_counter() - extract_seconds
+
+        window_start = date_from
+        while window_start <= date_to:
+            # Shed load: wait while Database A is over SOURCE_MAX_ACTIVE_QUERIES
+            db_manager.source_router.wait_for_capacity()
+            window_end = min(window_start + timedelta(days=controller.size - 1), date_to)
+            chunk_start = time.perf_counter()
+            if copy_backend:
+                query = get_query(window_start, window_end)
+                # Extraction overlaps the load, so only --explain captures plans here
+                if plan_capture is not None and plan_capture.explain_all:
+                    plan_capture.capture(fact_name, query, window_start, window_end)
+                # The window arrives in blocks; each block is transformed and loaded while
+                # the COPY reader thread keeps receiving the next ones
+                frames = timed_frames(db_manager, db_manager.stream_query_via_copy(
+                    query, column_types, 'A',
+                    categorical_columns=categorical_columns, dictionaries=dictionaries, read_replica=True))
+                yield window_start, window_end, frames, True, chunk_start
+            else:
+                with db_manager.timed_stage('extract'):
+                    df = extract(window_start, window_end)
+                yield window_start, window_end, [df], False, chunk_start
+                del df
+            window_start = window_end + timedelta(days=1)
+
+    for window_start, window_end, frames, streamed, chunk_start in windows():
+        peak_rss_mb = get_process_rss_mb()
+
+        rows = 0
+        for part, df in enumerate(frames):
+            with db_manager.timed_stage('transform'):
+                df = transform(df)
+            if not len(df):
+                continue
+
+            rows += len(df)
+            chunk_id = None
+            if chunk_cache is not None:
+                with db_manager.timed_stage('spill'):
+                    chunk_id = chunk_cache.spill(fact_name, table_name, unique_columns, window_start, window_end, df,
+                                                 part=part if streamed else None)
+            with db_manager.timed_stage('load'):
+                total_rows += db_manager.upsert_dataframe_to_db(df, table_name, unique_columns, 'B')
+            if chunk_cache is not None:
+                chunk_cache.mark_loaded(fact_name, chunk_id)
+            peak_rss_mb = max(peak_rss_mb, get_process_rss_mb())
+            # Release the chunk before the next extraction
+            del df
+
+        if rows:
+            logger.info(f"Retrieved {rows} rows from {fact_name} query for {window_start} to {window_end}")
+        else:
+            logger.info(f"No {fact_name} rows for {window_start} to {window_end}")
+
+        del frames
+        controller.record((window_end - window_start).days + 1, rows,
+                          time.perf_counter() - chunk_start, peak_rss_mb)
+
+    return total_rows
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Fact Specifications
+One entry per fact table describing its source query builder, transform, target
+table, primary key and the columns compared by reconciliation. Used by the tools
+that operate on "every fact" (reconcile, CDC, backfill) instead of per-fact code.
+"""
+
+from fact_order import (
+    FACT_ORDER_CATEGORICAL_COLUMNS, FACT_ORDER_COLUMN_TYPES,
+    get_fact_order_query, transform_fact_order_dataframe,
+    create_fact_order_table_schema_b, process_fact_order,
+)
+from fact_delivery import (
+    FACT_DELIVERY_CATEGORICAL_COLUMNS, FACT_DELIVERY_COLUMN_TYPES,
+    get_fact_delivery_query, transform_fact_delivery_dataframe,
+    create_fact_delivery_table_schema_b, process_fact_delivery,
+)
+
+# checksum_columns lists the columns compared by reconciliation, with the type both
+# sides are cast to before hashing, so e.g. NUMERIC stored as TEXT by older table
+# definitions still compares equal
+FACT_SPECS = {
+    'fact_order': {
+        'table': 'tms_fact_order',
+        'keys': ['order_id'],
+        'checksum_columns': [
+            ('order_id', 'text'),
+            ('status', 'text'),
+            ('route_id', 'text'),
+            ('faktur_date', 'date'),
+            ('faktur_total_quantity', 'numeric(15,2)'),
+            ('tms_total_quantity', 'numeric(15,2)'),
+            ('total_return', 'numeric(15,2)'),
+            ('total_net_value', 'numeric(15,2)'),
+        ],
+        'build_query': get_fact_order_query,
+        # Date window as $1/$2 for a prepared statement (see run_fact_pipeline)
+        'prepared_query': get_fact_order_query(parameterized=True),
+        'transform': transform_fact_order_dataframe,
+        'categorical_columns': FACT_ORDER_CATEGORICAL_COLUMNS,
+        'column_types': FACT_ORDER_COLUMN_TYPES,
+        'create_table': create_fact_order_table_schema_b,
+        'process': process_fact_order,
+    },
+    'fact_delivery': {
+        'table': 'tms_fact_delivery',
+        'keys': ['route_id', 'route_detail_id', 'order_id'],
+        'checksum_columns': [
+            ('route_id', 'text'),
+            ('route_detail_id', 'text'),
+            ('order_id', 'text'),
+            ('status', 'text'),
+            ('faktur_date', 'date'),
+            ('net_price', 'numeric(15,2)'),
+            ('quantity_delivery', 'numeric(15,2)'),
+            ('quantity_faktur', 'numeric(15,2)'),
+        ],
+        'build_query': get_fact_delivery_query,
+        'prepared_query': get_fact_delivery_query(parameterized=True),
+        'transform': transform_fact_delivery_dataframe,
+        'categorical_columns': FACT_DELIVERY_CATEGORICAL_COLUMNS,
+        'column_types': FACT_DELIVERY_COLUMN_TYPES,
+        'create_table': create_fact_delivery_table_schema_b,
+        'process': process_fact_delivery,
+    },
+}
+
+def get_fact_names(sync_type):
+    """Expand a --sync style choice ('fact_order', 'fact_delivery' or 'both') to fact names"""
+    return list(FACT_SPECS) if sync_type == 'both' else [sync_type]
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+FDW Sync Engine
+In-database alternative to the Python pipeline: Database B reaches Database A
+through a postgres_fdw foreign server and runs each fact query as
+
+    INSERT INTO tms_fact_* (...) SELECT ... FROM <fact query on foreign tables>
+    ON CONFLICT (...) DO UPDATE
+
+so fact rows never pass through this process. The joins and aggregates of the fact
+queries only reference tables of the same foreign server, so postgres_fdw pushes
+them down and Database A returns aggregated rows. The date conversions of the
+Python transforms are done with casts in the SELECT.
+
+Enabled with `--engine fdw` (or SYNC_ENGINE=fdw). When postgres_fdw cannot be set up
+on Database B (extension not installed, missing privileges, ...) the sync falls back
+to the Python pipeline.
+"""
+
+import os
+from datetime import timedelta
+from database_utils import logger
+from fact_pipeline import resolve_date_range
+
+SYNC_ENGINE = os.getenv('SYNC_ENGINE', 'python')
+FDW_SERVER_NAME = os.getenv('FDW_SERVER_NAME', 'tms_source')
+# Schema on Database B holding the foreign tables
+FDW_SCHEMA = os.getenv('FDW_SCHEMA', 'tms_source')
+FDW_FETCH_SIZE = int(os.getenv('FDW_FETCH_SIZE', 50000))
+# Days of faktur_date per INSERT ... SELECT transaction
+FDW_WINDOW_DAYS = int(os.getenv('FDW_WINDOW_DAYS', 7))
+
+# Source tables referenced by the fact queries
+SOURCE_TABLES = [
+    'order', 'order_detail', 'route', 'route_detail', 'driver_tasks', 'driver_task_confirmations',
+    'dma_driver', 'dma_kenek', 'mst_vehicle', 'mst_location_child', 'mst_location_parent',
+]
+
+# SQL casts matching the Python transforms for each column type name
+COLUMN_CASTS = {
+    'string': 'text',
+    'date': 'date',
+    'timestamp': 'timestamp',
+    'time': 'time',
+    'numeric': 'numeric(15,2)',
+    'integer': 'bigint',
+}
+
+def quote_literal(value):
+    """Quote a value as an SQL string literal for DDL options"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+def setup_foreign_server(db_manager):
+    """Create postgres_fdw, the foreign server, the user mapping and the foreign tables on Database B.
+
+    Existing objects are left untouched, so a server or mapping managed by a DBA is kept;
+    only source tables missing from FDW_SCHEMA are imported.
+    """
+    from sqlalchemy import text
+
+    config = db_manager.db_a_config
+    source_schema = config.get('schema') or 'public'
+    server_options = ', '.join([
+        f"host {quote_literal(config['host'])}",
+        f"port {quote_literal(config['port'] or 5432)}",
+        f"dbname {quote_literal(config['database'])}",
+        f"fetch_size {quote_literal(FDW_FETCH_SIZE)}",
+        "use_remote_estimate 'true'",
+    ])
+
+    engine = db_manager.get_db_b_engine()
+    with engine.connect() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS postgres_fdw"))
+        conn.execute(text(
+            f"CREATE SERVER IF NOT EXISTS {FDW_SERVER_NAME} FOREIGN DATA WRAPPER postgres_fdw "
+            f"OPTIONS ({server_options})"
+        ))
+        conn.execute(text(
+            f"CREATE USER MAPPING IF NOT EXISTS FOR CURRENT_USER SERVER {FDW_SERVER_NAME} "
+            f"OPTIONS (user {quote_literal(config['user'])}, password {quote_literal(config['password'])})"
+        ))
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {FDW_SCHEMA}"))
+
+        existing = {
+            row[0] for row in conn.execute(text("""
+                SELECT foreign_table_name FROM information_schema.foreign_tables
+                WHERE foreign_table_schema = :schema
+            """), {'schema': FDW_SCHEMA})
+        }
+        missing = [table for table in SOURCE_TABLES if table not in existing]
+        if missing:
+            tables = ', '.join(f'"{table}"' for table in missing)
+            conn.execute(text(
+                f'IMPORT FOREIGN SCHEMA "{source_schema}" LIMIT TO ({tables}) '
+                f"FROM SERVER {FDW_SERVER_NAME} INTO {FDW_SCHEMA}"
+            ))
+            logger.info(f"Imported {len(missing)} foreign tables into {FDW_SCHEMA}: {', '.join(missing)}")
+        conn.commit()
+
+def prepare_fdw(db_manager):
+    """Set up the foreign server; returns False (and logs why) when postgres_fdw is unavailable"""
+    try:
+        setup_foreign_server(db_manager)
+        return True
+    except Exception as e:
+        logger.warning(f"postgres_fdw is not available on Database B, using the Python pipeline: {e}")
+        return False
+
+def get_select_upsert_query(spec, source_query):
+    """Return INSERT ... SELECT ... ON CONFLICT loading the rows of source_query into a fact table.
+
+    Columns are cast like the Python transforms and DISTINCT ON keeps one row per key,
+    as the Python loader does.
+    """
+    columns = list(spec['column_types'])
+    keys = spec['keys']
+    select_list = ',\n        '.join(
+        f"src.{column}::{COLUMN_CASTS[spec['column_types'][column]]}" for column in columns
+    )
+    update_list = ',\n        '.join(
+        f"{column} = EXCLUDED.{column}" for column in columns + ['last_synced'] if column not in keys
+    )
+
+    return f"""
+    INSERT INTO {spec['table']} ({', '.join(columns)}, last_synced)
+    SELECT DISTINCT ON ({', '.join(f'src.{key}::text' for key in keys)})
+        {select_list},
+        CURRENT_TIMESTAMP
+    FROM ({source_query}) AS src
+    ON CONFLICT ({', '.join(keys)}) DO UPDATE SET
+        {update_list}
+    """
+
+def get_fdw_upsert_query(spec, date_from, date_to):
+    """Return the INSERT ... SELECT ... ON CONFLICT statement of one fact window"""
+    source_query = spec['build_query'](date_from=date_from, date_to=date_to, source_schema=FDW_SCHEMA)
+    return get_select_upsert_query(spec, source_query)
+
+def run_fdw_fact(db_manager, fact_name, date_from=None, date_to=None):
+    """Sync one fact table inside Database B window by window; returns rows upserted"""
+    from sqlalchemy import text
+    from fact_specs import FACT_SPECS
+
+    spec = FACT_SPECS[fact_name]
+    spec['create_table'](db_manager)
+    date_from, date_to = resolve_date_range(date_from, date_to)
+
+    engine = db_manager.get_db_b_engine()
+    total_rows = 0
+    window_start = date_from
+    while window_start <= date_to:
+        window_end = min(window_start + timedelta(days=FDW_WINDOW_DAYS - 1), date_to)
+        query = get_fdw_upsert_query(spec, window_start, window_end)
+        logger.debug(f"Generated FDW query: {query}")
+        try:
+            with db_manager.timed_stage('load'):
+                with engine.connect() as conn:
+                    result = conn.execute(text(query))
+                    conn.commit()
+        except Exception as e:
+            logger.error(f"Error running FDW sync of {fact_name} for {window_start} to {window_end}: {e}")
+            raise
+        logger.info(f"Upserted {result.rowcount} {fact_name} rows for {window_start} to {window_end} via postgres_fdw")
+        total_rows += result.rowcount
+        window_start = window_end + timedelta(days=1)
+
+    logger.info(f"{fact_name} FDW sync completed successfully! ({total_rows} rows)")
+    return total_rows
+
+def run_fdw_sync(db_manager, sync_type, date_from=None, date_to=None):
+    """Sync the facts of a --sync choice inside Database B; returns rows upserted"""
+    from fact_specs import get_fact_names
+
+    return sum(run_fdw_fact(db_manager, fact_name, date_from, date_to) for fact_name in get_fact_names(sync_type))
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Frame Compaction
+Dictionary-encodes low-cardinality string columns (status, driver names, codes,
+cities, ...) of extracted fact frames as pandas Categoricals. Every distinct value
+is stored once per run and each cell becomes a small integer code, instead of a
+separate Python string object per cell.
+
+Dictionaries are stable for a whole run: a value keeps its code across chunks and
+new values are appended, so chunks can be concatenated without re-encoding and
+loaders can encode each distinct value once (see CopyBinaryUpsertStrategy).
+"""
+
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+COMPACT_FRAMES = os.getenv('COMPACT_FRAMES', 'true').lower() == 'true'
+# Rows fetched per round trip when a query result is compacted while streaming
+FETCH_CHUNK_ROWS = int(os.getenv('FETCH_CHUNK_ROWS', 50000))
+
+class RunDictionaries:
+    """Per-run value -> code dictionaries for categorical columns.
+
+    Safe to share between extraction threads: appending to a dictionary is locked so
+    two chunks cannot assign the same code to different values.
+    """
+
+    def __init__(self):
+        self.categories = {}
+        self.lock = threading.Lock()
+
+    def encode(self, series, column):
+        """Return series as a Categorical whose categories are the run dictionary of column"""
+        with self.lock:
+            categories = self._extend(series, column)
+        codes = categories.get_indexer(series)
+        return pd.Categorical.from_codes(codes, categories=categories)
+
+    def _extend(self, series, column):
+        """Append the new values of series to the dictionary of column and return it"""
+        categories = self.categories.get(column)
+        values = series.dropna().unique()
+        if isinstance(series.dtype, pd.ArrowDtype):
+            # Only the distinct values become Python objects, not every cell
+            values = np.asarray(values, dtype=object)
+        if categories is None:
+            categories = pd.Index(values)
+        else:
+            new_values = values[~pd.Index(values).isin(categories)] if len(values) else values
+            if len(new_values):
+                categories = categories.append(pd.Index(new_values))
+        self.categories[column] = categories
+        return categories
+
+    def compact(self, df, columns):
+        """Encode the given columns of df in place and return it"""
+        for column in columns:
+            if column in df.columns:
+                df[column] = self.encode(df[column], column)
+        return df
+
+    def align(self, df, columns):
+        """Widen the categories of earlier chunks to the current run dictionaries"""
+        for column in columns:
+            if column in df.columns and column in self.categories:
+                if len(df[column].cat.categories) != len(self.categories[column]):
+                    # Dictionaries only grow by appending, so existing codes stay valid
+                    df[column] = pd.Categorical.from_codes(df[column].cat.codes, categories=self.categories[column])
+        return df
+
+def get_frame_memory_mb(df):
+    """Deep memory usage of a DataFrame in MB"""
+    return df.memory_usage(deep=True).sum() / (1024 * 1024)
+
+def read_sql_compacted(query, conn, columns, dictionaries=None, chunksize=FETCH_CHUNK_ROWS, params=None):
+    """Stream a query in chunks, dictionary-encoding columns before the next chunk is fetched"""
+    dictionaries = dictionaries or RunDictionaries()
+    chunks = [
+        dictionaries.compact(chunk, columns)
+        for chunk in pd.read_sql(query, conn, chunksize=chunksize, params=params)
+    ]
+    if not chunks:
+        return pd.read_sql(query, conn, params=params)
+    chunks = [dictionaries.align(chunk, columns) for chunk in chunks]
+    return pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Dashboard Load Test
+Runs concurrent clients against a running web dashboard and reports throughput and
+p50/p90/p99 latency. Every client keeps one HTTP/1.1 keep-alive connection and asks
+for gzip, like a browser polling /api/status.
+"""
+
+import sys
+import time
+import argparse
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def run_client(host, port, path, deadline, latencies, errors, lock):
+    """Send requests on one keep-alive connection until the deadline"""
+    conn = None
+    local_latencies = []
+    local_errors = 0
+    while time.monotonic() < deadline:
+        if conn is None:
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+        start = time.perf_counter()
+        try:
+            conn.request('GET', path, headers={'Accept-Encoding': 'gzip', 'Connection': 'keep-alive'})
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                local_errors += 1
+            else:
+                local_latencies.append(time.perf_counter() - start)
+            if response.getheader('Connection', '').lower() == 'close':
+                conn.close()
+                conn = None
+        except (OSError, http.client.HTTPException):
+            local_errors += 1
+            if conn is not None:
+                conn.close()
+            conn = None
+    if conn is not None:
+        conn.close()
+    with lock:
+        latencies.extend(local_latencies)
+        errors.append(local_errors)
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the TMS web dashboard')
+    parser.add_argument('--url', default='http://127.0.0.1:5000/api/status',
+                        help='URL to request (default: http://127.0.0.1:5000/api/status)')
+    parser.add_argument('--clients', type=int, default=50, help='Concurrent clients (default: 50)')
+    parser.add_argument('--seconds', type=float, default=30, help='Test duration (default: 30)')
+    args = parser.parse_args()
+
+    url = urlsplit(args.url)
+    path = url.path or '/'
+    if url.query:
+        path += f"?{url.query}"
+
+    latencies, errors = [], []
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.seconds
+    threads = [
+        threading.Thread(target=run_client, args=(url.hostname, url.port or 80, path, deadline,
+                                                  latencies, errors, lock))
+        for _ in range(args.clients)
+    ]
+    print(f"Load testing {args.url} with {args.clients} clients for {args.seconds:.0f}s...")
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    latencies.sort()
+    failed = sum(errors)
+    print(f"\n{'Requests':<12} {len(latencies)} ok, {failed} failed")
+    print(f"{'Throughput':<12} {len(latencies) / elapsed:.1f} req/s")
+    for label, fraction in (('p50', 0.50), ('p90', 0.90), ('p99', 0.99)):
+        print(f"{label:<12} {percentile(latencies, fraction) * 1000:.1f} ms")
+    if latencies:
+        print(f"{'max':<12} {latencies[-1] * 1000:.1f} ms")
+
+    sys.exit(1 if failed or not latencies else 0)
+
+if __name__ == '__main__':
+    main()
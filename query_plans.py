@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Query Plan Capture
+Records EXPLAIN (ANALYZE, BUFFERS, TIMING, FORMAT JSON) plans of the fact queries in
+tms_query_plans on Database B, keyed by fact, date window and run id (the
+tms_sync_log id of the sync). A plan is captured when a window's extraction takes
+longer than PLAN_CAPTURE_SECONDS, or for every window with `--explain`.
+
+Each captured plan is compared with the previous plan of the same fact; a lost index
+(a relation read by Seq Scan that used an index scan before) or a new Nested Loop
+join is logged as a warning. `--plan-diff <fact>` prints the same comparison for the
+last two runs, or for two given run ids.
+"""
+
+import os
+import json
+from database_utils import DatabaseManager, logger
+
+# Extraction time (seconds) above which a window's plan is captured; 0 disables
+PLAN_CAPTURE_SECONDS = float(os.getenv('PLAN_CAPTURE_SECONDS', 300))
+# EXPLAIN ANALYZE runs the query again; false captures estimated plans only
+PLAN_CAPTURE_ANALYZE = os.getenv('PLAN_CAPTURE_ANALYZE', 'true').lower() == 'true'
+
+INDEX_SCANS = ('Index Scan', 'Index Only Scan', 'Bitmap Heap Scan', 'Bitmap Index Scan')
+JOIN_NODES = ('Nested Loop', 'Hash Join', 'Merge Join')
+
+def create_query_plans_table(db_manager):
+    """Create tms_query_plans in Database B"""
+    create_table_query = """
+    CREATE TABLE IF NOT EXISTS tms_query_plans (
+        id SERIAL PRIMARY KEY,
+        run_id VARCHAR(50) NOT NULL,
+        fact_name VARCHAR(50) NOT NULL,
+        date_from DATE,
+        date_to DATE,
+        reason VARCHAR(20) NOT NULL,
+        extract_seconds NUMERIC(12,3),
+        planning_ms NUMERIC(12,3),
+        execution_ms NUMERIC(12,3),
+        total_cost NUMERIC(16,2),
+        shared_hit_blocks BIGINT,
+        shared_read_blocks BIGINT,
+        plan_signature TEXT,
+        plan JSONB NOT NULL,
+        query_text TEXT,
+        captured_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_tms_query_plans_fact ON tms_query_plans (fact_name, captured_at);
+    """
+    try:
+        engine = db_manager.get_db_b_engine()
+        with engine.connect() as conn:
+            from sqlalchemy import text
+            conn.execute(text(create_table_query))
+            conn.commit()
+    except Exception as e:
+        logger.error(f"Error creating query plans table: {e}")
+        raise
+
+def iter_plan_nodes(node, depth=0):
+    """Yield (depth, node) for a plan node and all its children"""
+    yield depth, node
+    for child in node.get('Plans', []):
+        yield from iter_plan_nodes(child, depth + 1)
+
+def describe_node(node):
+    description = node['Node Type']
+    if node.get('Relation Name'):
+        description += f" on {node['Relation Name']}"
+    if node.get('Index Name'):
+        description += f" using {node['Index Name']}"
+    return description
+
+def get_plan_signature(plan):
+    """Indented node outline of a plan, without costs or timings"""
+    return '\n'.join('  ' * depth + describe_node(node) for depth, node in iter_plan_nodes(plan['Plan']))
+
+def explain_query(db_manager, query, analyze=PLAN_CAPTURE_ANALYZE, connection=None, params=None):
+    """Return the JSON plan (the top-level object of EXPLAIN FORMAT JSON) of a query on Database A.
+
+    With a connection the query is explained there and its transaction is left alone,
+    e.g. an EXECUTE of a statement prepared on that connection (params fill its
+    pyformat placeholders).
+    """
+    options = 'ANALYZE, BUFFERS, TIMING, FORMAT JSON' if analyze else 'BUFFERS, FORMAT JSON'
+    if connection is not None:
+        result = connection.exec_driver_sql(f"EXPLAIN ({options}) {query}", params).scalar()
+    else:
+        with db_manager.get_db_a_read_engine().connect() as conn:
+            result = conn.exec_driver_sql(f"EXPLAIN ({options}) {query}", params).scalar()
+            conn.rollback()
+    if isinstance(result, str):
+        result = json.loads(result)
+    return result[0]
+
+def summarize_plan(plan):
+    """Scan types per relation and join node counts, used to compare plans"""
+    scans = {}
+    joins = {}
+    for _, node in iter_plan_nodes(plan['Plan']):
+        if node.get('Relation Name'):
+            scans.setdefault(node['Relation Name'], set()).add(node['Node Type'])
+        if node['Node Type'] in JOIN_NODES:
+            joins[node['Node Type']] = joins.get(node['Node Type'], 0) + 1
+    return scans, joins
+
+def diff_plans(old_plan, new_plan):
+    """Return a list of regressions of new_plan compared to old_plan"""
+    old_scans, old_joins = summarize_plan(old_plan)
+    new_scans, new_joins = summarize_plan(new_plan)
+    regressions = []
+
+    for relation, node_types in new_scans.items():
+        used_index = any(node_type in INDEX_SCANS for node_type in old_scans.get(relation, ()))
+        uses_index = any(node_type in INDEX_SCANS for node_type in node_types)
+        if used_index and not uses_index and 'Seq Scan' in node_types:
+            regressions.append(f"{relation}: index scan replaced by Seq Scan")
+
+    if new_joins.get('Nested Loop', 0) > old_joins.get('Nested Loop', 0):
+        regressions.append(
+            f"Nested Loop joins: {old_joins.get('Nested Loop', 0)} -> {new_joins['Nested Loop']} "
+            f"(Hash Join {old_joins.get('Hash Join', 0)} -> {new_joins.get('Hash Join', 0)}, "
+            f"Merge Join {old_joins.get('Merge Join', 0)} -> {new_joins.get('Merge Join', 0)})"
+        )
+
+    old_ms, new_ms = old_plan.get('Execution Time'), new_plan.get('Execution Time')
+    if old_ms and new_ms and new_ms > 2 * old_ms:
+        regressions.append(f"execution time {old_ms:.0f} ms -> {new_ms:.0f} ms")
+    return regressions
+
+def get_latest_plan(db_manager, fact_name, run_id=None, before_run_id=None):
+    """Return (run_id, plan) of the latest plan of a fact, optionally of or before a run"""
+    from sqlalchemy import text
+
+    conditions = ["fact_name = :fact_name"]
+    params = {'fact_name': fact_name}
+    if run_id is not None:
+        conditions.append("run_id = :run_id")
+        params['run_id'] = str(run_id)
+    if before_run_id is not None:
+        conditions.append("run_id <> :before_run_id")
+        conditions.append("captured_at < (SELECT MIN(captured_at) FROM tms_query_plans "
+                          "WHERE fact_name = :fact_name AND run_id = :before_run_id)")
+        params['before_run_id'] = str(before_run_id)
+
+    with db_manager.get_db_b_engine().connect() as conn:
+        row = conn.execute(text(f"""
+            SELECT run_id, plan FROM tms_query_plans
+            WHERE {' AND '.join(conditions)}
+            ORDER BY captured_at DESC
+            LIMIT 1
+        """), params).fetchone()
+    if row is None:
+        return None, None
+    plan = json.loads(row[1]) if isinstance(row[1], str) else row[1]
+    return row[0], plan
+
+class PlanCapture:
+    """Captures the plans of slow (or, with explain_all, all) fact windows of one run"""
+
+    def __init__(self, db_manager, run_id, explain_all=False, threshold_seconds=PLAN_CAPTURE_SECONDS):
+        self.db_manager = db_manager
+        self.run_id = str(run_id)
+        self.explain_all = explain_all
+        self.threshold_seconds = threshold_seconds
+        self.previous_plans = {}
+        create_query_plans_table(db_manager)
+
+    def should_capture(self, extract_seconds):
+        return self.explain_all or (self.threshold_seconds > 0 and extract_seconds > self.threshold_seconds)
+
+    def capture(self, fact_name, query, date_from, date_to, extract_seconds=None, connection=None, params=None):
+        """EXPLAIN the query, store the plan and warn about regressions; never raises.
+
+        connection and params as for explain_query.
+        """
+        from sqlalchemy import text
+
+        reason = 'explain' if self.explain_all else 'slow'
+        try:
+            plan = explain_query(self.db_manager, query, connection=connection, params=params)
+            root = plan['Plan']
+            with self.db_manager.get_db_b_engine().connect() as conn:
+                conn.execute(text("""
+                    INSERT INTO tms_query_plans
+                        (run_id, fact_name, date_from, date_to, reason, extract_seconds, planning_ms,
+                         execution_ms, total_cost, shared_hit_blocks, shared_read_blocks,
+                         plan_signature, plan, query_text)
+                    VALUES (:run_id, :fact_name, :date_from, :date_to, :reason, :extract_seconds, :planning_ms,
+                            :execution_ms, :total_cost, :shared_hit_blocks, :shared_read_blocks,
+                            :plan_signature, CAST(:plan AS JSONB), :query_text)
+                """), {
+                    'run_id': self.run_id,
+                    'fact_name': fact_name,
+                    'date_from': date_from,
+                    'date_to': date_to,
+                    'reason': reason,
+                    'extract_seconds': extract_seconds,
+                    'planning_ms': plan.get('Planning Time'),
+                    'execution_ms': plan.get('Execution Time'),
+                    'total_cost': root.get('Total Cost'),
+                    'shared_hit_blocks': root.get('Shared Hit Blocks'),
+                    'shared_read_blocks': root.get('Shared Read Blocks'),
+                    'plan_signature': get_plan_signature(plan),
+                    'plan': json.dumps(plan),
+                    'query_text': query,
+                })
+                conn.commit()
+            logger.info(f"Captured {reason} plan of {fact_name} for {date_from} to {date_to} "
+                        f"(run {self.run_id}, execution {plan.get('Execution Time', 0):.0f} ms)")
+        except Exception as e:
+            # Plan capture is diagnostics; it must not fail the sync
+            logger.warning(f"Could not capture the plan of {fact_name} for {date_from} to {date_to}: {e}")
+            return
+
+        if fact_name not in self.previous_plans:
+            try:
+                self.previous_plans[fact_name] = get_latest_plan(self.db_manager, fact_name,
+                                                                 before_run_id=self.run_id)[1]
+            except Exception as e:
+                logger.warning(f"Could not load the previous plan of {fact_name}: {e}")
+                self.previous_plans[fact_name] = None
+        previous = self.previous_plans[fact_name]
+        if previous is not None:
+            for regression in diff_plans(previous, plan):
+                logger.warning(f"Plan regression in {fact_name} ({date_from} to {date_to}): {regression}")
+
+def begin_capture(db_manager, run_id, explain_all=False):
+    """Return a PlanCapture for a run, or None when plan capture is disabled"""
+    if not explain_all and PLAN_CAPTURE_SECONDS <= 0:
+        return None
+    try:
+        return PlanCapture(db_manager, run_id, explain_all)
+    except Exception as e:
+        logger.warning(f"Query plan capture disabled: {e}")
+        return None
+
+def print_plan_diff(fact_name, old_run_id=None, new_run_id=None, db_manager=None):
+    """Print the plan outlines of two runs of a fact and the regressions between them"""
+    import difflib
+
+    db_manager = db_manager or DatabaseManager()
+    new_run_id, new_plan = get_latest_plan(db_manager, fact_name, run_id=new_run_id)
+    if new_plan is None:
+        print(f"No captured plans for {fact_name}")
+        return
+    if old_run_id is None:
+        old_run_id, old_plan = get_latest_plan(db_manager, fact_name, before_run_id=new_run_id)
+    else:
+        old_run_id, old_plan = get_latest_plan(db_manager, fact_name, run_id=old_run_id)
+    if old_plan is None:
+        print(f"Only one captured run ({new_run_id}) for {fact_name}")
+        return
+
+    print(f"\nPlan diff for {fact_name}: run {old_run_id} -> run {new_run_id}")
+    print("-" * 80)
+    for line in difflib.unified_diff(get_plan_signature(old_plan).splitlines(),
+                                     get_plan_signature(new_plan).splitlines(),
+                                     f"run {old_run_id}", f"run {new_run_id}", lineterm=''):
+        print(line)
+    regressions = diff_plans(old_plan, new_plan)
+    print("\nRegressions:" if regressions else "\nNo regressions detected")
+    for regression in regressions:
+        print(f"  - {regression}")
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Source vs Target Reconciliation
+Compares the fact queries on Database A with tms_fact_order / tms_fact_delivery on
+Database B using per-bucket row counts and order-independent checksums, drills down
+into mismatching buckets only, and can resync just the divergent orders.
+"""
+
+import pandas as pd
+from database_utils import DatabaseManager, logger, sql_literal_list
+from fact_pipeline import resolve_date_range
+from fact_specs import FACT_SPECS
+
+# Orders per resync query / delete statement
+RESYNC_BATCH_SIZE = 1000
+
+def get_row_hash_expression(columns, alias='f'):
+    """Return a SQL expression hashing the compared columns of one row to a 60-bit integer"""
+    parts = [f"COALESCE(CAST(CAST({alias}.{col} AS {pg_type}) AS text), '~')" for col, pg_type in columns]
+    return f"CAST(CAST('x' || substr(md5(concat_ws('|', {', '.join(parts)})), 1, 15) AS bit(60)) AS bigint)"
+
+def get_bucket_expression(bucket_mode, buckets, alias='f'):
+    """Return the SQL expression that assigns a row to a reconciliation bucket"""
+    if bucket_mode == 'day':
+        return f"CAST({alias}.faktur_date AS text)"
+    # Hash buckets on order_id so a bucket always maps to the same set of orders on both sides
+    return f"CAST(mod(abs(CAST(hashtext({alias}.order_id) AS bigint)), {int(buckets)}) AS text)"
+
+def wrap_bucket_summary(relation_sql, spec, bucket_mode, buckets):
+    """Aggregate a relation into (bucket, row_count, checksum) rows"""
+    return f"""
+    SELECT bucket, COUNT(*) AS row_count, CAST(SUM(row_hash) AS text) AS checksum
+    FROM (
+        SELECT {get_bucket_expression(bucket_mode, buckets)} AS bucket,
+               {get_row_hash_expression(spec['checksum_columns'])} AS row_hash
+        FROM ({relation_sql}) AS f
+    ) AS hashed
+    GROUP BY bucket
+    """
+
+def wrap_row_hashes(relation_sql, spec, bucket_mode, buckets, bucket_values):
+    """Return key columns and row hashes of a relation, limited to the given buckets"""
+    keys = ', '.join([f"f.{key}" for key in spec['keys']])
+    return f"""
+    SELECT {keys}, {get_row_hash_expression(spec['checksum_columns'])} AS row_hash
+    FROM ({relation_sql}) AS f
+    WHERE {get_bucket_expression(bucket_mode, buckets)} IN ({sql_literal_list(bucket_values)})
+    """
+
+def get_target_relation(db_manager, spec, date_from, date_to):
+    """Return the SQL selecting the target fact rows of a date range"""
+    schema = db_manager.db_b_config['schema']
+    return (f"SELECT * FROM {schema}.{spec['table']} "
+            f"WHERE faktur_date >= '{date_from}' AND faktur_date <= '{date_to}'")
+
+def compare_bucket_summaries(source_df, target_df):
+    """Return the buckets whose row count or checksum differ between source and target"""
+    merged = source_df.merge(target_df, on='bucket', how='outer', suffixes=('_source', '_target'))
+    merged[['row_count_source', 'row_count_target']] = merged[['row_count_source', 'row_count_target']].fillna(0)
+    mismatch = (
+        (merged['row_count_source'] != merged['row_count_target'])
+        | (merged['checksum_source'].astype(str) != merged['checksum_target'].astype(str))
+    )
+    return merged[mismatch].sort_values('bucket').reset_index(drop=True)
+
+def find_divergent_keys(db_manager, spec, bucket_mode, buckets, date_from, date_to, mismatched_buckets):
+    """Drill into mismatching buckets and classify divergent keys"""
+    if bucket_mode == 'day':
+        # Only re-run the source query for the mismatching days
+        source_frames = []
+        for day in mismatched_buckets:
+            query = wrap_row_hashes(spec['build_query'](date_from=day, date_to=day),
+                                    spec, bucket_mode, buckets, [day])
+            source_frames.append(db_manager.execute_query_to_dataframe(query, 'A'))
+        source_df = pd.concat(source_frames, ignore_index=True) if source_frames else pd.DataFrame()
+    else:
+        query = wrap_row_hashes(spec['build_query'](date_from=date_from, date_to=date_to),
+                                spec, bucket_mode, buckets, mismatched_buckets)
+        source_df = db_manager.execute_query_to_dataframe(query, 'A')
+
+    target_query = wrap_row_hashes(get_target_relation(db_manager, spec, date_from, date_to),
+                                   spec, bucket_mode, buckets, mismatched_buckets)
+    target_df = db_manager.execute_query_to_dataframe(target_query, 'B')
+
+    keys = spec['keys']
+    if source_df.empty:
+        source_df = pd.DataFrame(columns=keys + ['row_hash'])
+    if target_df.empty:
+        target_df = pd.DataFrame(columns=keys + ['row_hash'])
+
+    merged = source_df.merge(target_df, on=keys, how='outer', suffixes=('_source', '_target'), indicator=True)
+    missing = merged[merged['_merge'] == 'left_only']
+    extra = merged[merged['_merge'] == 'right_only']
+    both = merged[merged['_merge'] == 'both']
+    changed = both[both['row_hash_source'] != both['row_hash_target']]
+
+    return {
+        'missing_in_target': missing[keys].to_dict('records'),
+        'extra_in_target': extra[keys].to_dict('records'),
+        'changed': changed[keys].to_dict('records'),
+    }
+
+def resync_orders(db_manager, spec, order_ids, extra_keys, date_from, date_to):
+    """Re-extract the given orders from Database A, upsert them and delete target-only rows"""
+    schema = db_manager.db_b_config['schema']
+    engine = db_manager.get_db_b_engine()
+    from sqlalchemy import text
+
+    spec['create_table'](db_manager)
+    order_ids = sorted(order_ids)
+    upserted = 0
+    for start in range(0, len(order_ids), RESYNC_BATCH_SIZE):
+        batch_ids = order_ids[start:start + RESYNC_BATCH_SIZE]
+        query = spec['build_query'](date_from=date_from, date_to=date_to, order_ids=batch_ids)
+        df = spec['transform'](db_manager.execute_query_to_dataframe(query, 'A'))
+        if not df.empty:
+            upserted += db_manager.upsert_dataframe_to_db(df, spec['table'], spec['keys'], 'B')
+
+    deleted = 0
+    keys = spec['keys']
+    for start in range(0, len(extra_keys), RESYNC_BATCH_SIZE):
+        batch = extra_keys[start:start + RESYNC_BATCH_SIZE]
+        condition = ' OR '.join([
+            '(' + ' AND '.join([f"{key} = {sql_literal_list([row[key]])}" for key in keys]) + ')'
+            for row in batch
+        ])
+        with engine.connect() as conn:
+            result = conn.execute(text(f"DELETE FROM {schema}.{spec['table']} WHERE {condition}"))
+            deleted += result.rowcount
+            conn.commit()
+
+    logger.info(f"Resynced {spec['table']}: {upserted} rows upserted, {deleted} target-only rows deleted")
+    return upserted, deleted
+
+def reconcile_fact(fact_name, date_from=None, date_to=None, bucket_mode='day', buckets=64,
+                   resync=False, db_manager=None):
+    """Reconcile one fact table for a date range and optionally resync divergent orders.
+
+    Returns a report dict with mismatching buckets and divergent keys.
+    """
+    spec = FACT_SPECS[fact_name]
+    db_manager = db_manager or DatabaseManager()
+    date_from, date_to = resolve_date_range(date_from, date_to)
+    logger.info(f"Reconciling {fact_name} from {date_from} to {date_to} ({bucket_mode} buckets)...")
+
+    source_summary = db_manager.execute_query_to_dataframe(
+        wrap_bucket_summary(spec['build_query'](date_from=date_from, date_to=date_to), spec, bucket_mode, buckets), 'A')
+    target_summary = db_manager.execute_query_to_dataframe(
+        wrap_bucket_summary(get_target_relation(db_manager, spec, date_from, date_to), spec, bucket_mode, buckets), 'B')
+
+    mismatched = compare_bucket_summaries(source_summary, target_summary)
+    report = {
+        'fact': fact_name,
+        'date_from': str(date_from),
+        'date_to': str(date_to),
+        'buckets_checked': int(len(set(source_summary['bucket']) | set(target_summary['bucket']))),
+        'source_rows': int(source_summary['row_count'].sum()) if not source_summary.empty else 0,
+        'target_rows': int(target_summary['row_count'].sum()) if not target_summary.empty else 0,
+        'mismatched_buckets': mismatched[['bucket', 'row_count_source', 'row_count_target']].to_dict('records'),
+        'missing_in_target': [],
+        'extra_in_target': [],
+        'changed': [],
+        'resynced_rows': 0,
+        'deleted_rows': 0,
+    }
+
+    if mismatched.empty:
+        logger.info(f"✓ {fact_name} matches Database A in all {report['buckets_checked']} buckets")
+        return report
+
+    logger.warning(f"✗ {fact_name}: {len(mismatched)} of {report['buckets_checked']} buckets differ, drilling down...")
+    report.update(find_divergent_keys(db_manager, spec, bucket_mode, buckets, date_from, date_to,
+                                      mismatched['bucket'].tolist()))
+
+    if resync:
+        # A changed or missing row means its whole order has to be recomputed
+        order_ids = {row['order_id'] for row in report['missing_in_target'] + report['changed']}
+        # Target-only rows are no longer produced by the source query and are deleted
+        report['resynced_rows'], report['deleted_rows'] = resync_orders(
+            db_manager, spec, order_ids, report['extra_in_target'], date_from, date_to)
+
+    return report
+
+def print_reconcile_report(report, limit=20):
+    """Print a reconciliation report for the command line"""
+    print(f"\n{report['fact']} {report['date_from']} to {report['date_to']}: "
+          f"source {report['source_rows']} rows, target {report['target_rows']} rows, "
+          f"{len(report['mismatched_buckets'])}/{report['buckets_checked']} buckets differ")
+    if not report['mismatched_buckets']:
+        return
+
+    print(f"\n{'Bucket':<15} {'Source':<10} {'Target':<10}")
+    print("-" * 35)
+    for bucket in report['mismatched_buckets'][:limit]:
+        print(f"{bucket['bucket']:<15} {int(bucket['row_count_source']):<10} {int(bucket['row_count_target']):<10}")
+
+    for label in ('missing_in_target', 'extra_in_target', 'changed'):
+        rows = report[label]
+        if rows:
+            shown = ', '.join(['/'.join(str(value) for value in row.values()) for row in rows[:limit]])
+            more = f" ... (+{len(rows) - limit})" if len(rows) > limit else ""
+            print(f"\n{label} ({len(rows)}): {shown}{more}")
+
+    if report['resynced_rows'] or report['deleted_rows']:
+        print(f"\nResynced {report['resynced_rows']} rows, deleted {report['deleted_rows']} rows")
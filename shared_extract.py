@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Shared Extraction
+Single-pass alternative to running the fact_order and fact_delivery queries one after
+the other. Each source entity (order, order_detail, route_detail + route, driver_tasks,
+customer location) is extracted once per faktur_date window and both fact tables are
+derived from those frames in memory, so Database A scans and joins every table once.
+
+The derivation reproduces the join fan-out of the original queries: their SUMs over
+order_detail are multiplied by the number of joined route/driver task rows that fall
+into the same GROUP BY group, so the shared mode loads the same totals.
+"""
+
+import os
+import time
+import pandas as pd
+from datetime import timedelta
+from database_utils import get_process_rss_mb, logger
+from chunk_controller import get_extraction_controller
+from fact_pipeline import resolve_date_range
+from fact_specs import FACT_SPECS
+from fact_order import FACT_ORDER_COLUMNS
+from fact_delivery import FACT_DELIVERY_COLUMNS
+
+SHARED_EXTRACTION = os.getenv('SHARED_EXTRACTION', 'false').lower() == 'true'
+
+def get_window_condition(date_from, date_to, alias='a'):
+    return f"{alias}.faktur_date >= '{date_from}' AND {alias}.faktur_date <= '{date_to}'"
+
+def get_shared_extract_queries(date_from, date_to, narrow=False):
+    """Return {entity: SQL} for the per-entity extracts of one faktur_date window.
+
+    Keys are cast to text on Database A so frames join cleanly in pandas and load
+    into the VARCHAR key columns of Database B unchanged. With narrow=True the
+    driver/vehicle/kenek/location dimensions are left out, to be added from the
+    tms_dim_* mirror (dimension_mirror.enrich_with_dimensions).
+    """
+    window = get_window_condition(date_from, date_to)
+    if narrow:
+        route_dimension_columns = route_dimension_joins = ""
+    else:
+        route_dimension_columns = """,
+              d.driver_name,
+              e.code AS vehicle_code,
+              e.plate_number,
+              h.kenek_name"""
+        route_dimension_joins = """
+            LEFT JOIN "public"."dma_driver" AS d ON d.driver_id = c.driver_id
+            LEFT JOIN "public"."mst_vehicle" AS e ON e.mst_vehicle_id = c.vehicle_id
+            LEFT JOIN "public"."dma_kenek" AS h ON h.kenek_id = c.kenek_id"""
+
+    queries = {
+        'orders': f"""
+            SELECT
+              CAST(a.order_id AS text) AS order_id,
+              a.status,
+              a.faktur_date,
+              a.created_date AS tms_created,
+              CASE
+                WHEN a.delivery_date IS NOT NULL
+                AND a.delivery_date >= '1900-01-01'::date
+                AND a.delivery_date <= '2100-12-31'::date
+                THEN a.delivery_date
+                ELSE NULL
+              END AS delivery_date,
+              a.updated_date AS tms_complete,
+              a.do_number,
+              CAST(a.client_id AS text) AS client_id,
+              CAST(a.warehouse_id AS text) AS warehouse_id,
+              a.origin_name,
+              a.origin_city,
+              CAST(a.customer_id AS text) AS customer_id
+            FROM "public"."order" AS a
+            WHERE {window}
+        """,
+        'details': f"""
+            SELECT
+              CAST(od.order_id AS text) AS order_id,
+              SUM(od.quantity_faktur) AS sum_quantity_faktur,
+              SUM(od.quantity_delivery) AS sum_quantity_delivery,
+              SUM(od.quantity_unloading) AS sum_quantity_unloading,
+              SUM(od.net_price) AS sum_net_price
+            FROM "public"."order_detail" AS od
+            JOIN "public"."order" AS a ON a.order_id = od.order_id
+            WHERE {window}
+            GROUP BY od.order_id
+        """,
+        'routes': f"""
+            SELECT
+              CAST(b.order_id AS text) AS order_id,
+              CAST(b.route_detail_id AS text) AS route_detail_id,
+              CAST(c.route_id AS text) AS route_id,
+              c.manifest_reference,
+              c.manifest_integration_id,
+              c.external_expedition_type,
+              c.created_date AS route_created_ts,
+              CASE
+                WHEN c.created_date IS NOT NULL
+                THEN c.created_date::DATE
+                ELSE NULL
+              END AS route_created,
+              DATE(c.created_date) AS created_date_only,
+              c.created_date::TIMESTAMP::TIME AS waktu,
+              c.status AS route_status,
+              CAST(c.vehicle_id AS text) AS vehicle_id,
+              CAST(c.driver_id AS text) AS driver_id,
+              CAST(c.kenek_id AS text) AS kenek_id,
+              c.driver_status{route_dimension_columns}
+            FROM "public"."route_detail" AS b
+            JOIN "public"."order" AS a ON a.order_id = b.order_id
+            LEFT JOIN "public"."route" AS c ON c.route_id = b.route_id{route_dimension_joins}
+            WHERE {window}
+        """,
+        'tasks': f"""
+            SELECT
+              CAST(f.order_id AS text) AS order_id,
+              CAST(f.driver_task_id AS text) AS driver_task_id,
+              f.complete_time,
+              g.location_confirmation_timestamp AS location_confirmation_ts,
+              CASE
+                WHEN g.location_confirmation_timestamp IS NOT NULL
+                AND g.location_confirmation_timestamp >= '1900-01-01'::timestamp
+                AND g.location_confirmation_timestamp <= '2100-12-31'::timestamp
+                THEN g.location_confirmation_timestamp::DATE
+                ELSE NULL
+              END AS location_confirmation
+            FROM "public"."driver_tasks" AS f
+            JOIN "public"."order" AS a ON a.order_id = f.order_id
+            LEFT JOIN "public"."driver_task_confirmations" AS g ON g.driver_task_id = f.driver_task_id
+            WHERE {window}
+        """,
+        'customers': f"""
+            SELECT
+              CAST(d.mst_location_child_id AS text) AS customer_id,
+              d.address,
+              d.address_text,
+              e.code AS location_code,
+              e."name" AS location_name
+            FROM "public"."mst_location_child" AS d
+            LEFT JOIN "public"."mst_location_parent" AS e ON e.mst_location_parent_id = d.mst_location_parent_id
+            WHERE d.mst_location_child_id IN (
+              SELECT a.customer_id FROM "public"."order" AS a WHERE {window}
+            )
+        """,
+    }
+    if narrow:
+        del queries['customers']
+    return queries
+
+def extract_shared_window(db_manager, date_from, date_to, dimensions=None):
+    """Run the per-entity extracts of one window on Database A.
+
+    When a DimensionCache is given, only narrow rows are read from Database A
+    and the dimension columns are looked up in memory. With EXTRACT_WORKERS > 1 the
+    entity queries run in parallel inside one exported snapshot.
+    """
+    from snapshot_extract import EXTRACT_WORKERS, extract_queries_in_snapshot
+
+    queries = get_shared_extract_queries(date_from, date_to, narrow=dimensions is not None)
+    if EXTRACT_WORKERS > 1:
+        # Entities read in parallel must see the same state of Database A to join up
+        frames = extract_queries_in_snapshot(db_manager, queries)
+    else:
+        frames = {entity: db_manager.execute_query_to_dataframe(query, 'A', read_replica=True)
+                  for entity, query in queries.items()}
+    if dimensions is not None:
+        from dimension_mirror import enrich_with_dimensions
+        frames = enrich_with_dimensions(frames, dimensions)
+    return frames
+
+def scale_sum(values, multiplicity):
+    """Multiply a per-order SUM by the join multiplicity and round like NUMERIC(15,2)"""
+    return (pd.to_numeric(values, errors='coerce') * multiplicity).round(2)
+
+def derive_fact_order(frames):
+    """Build the fact_order rows of a window from the shared extracts"""
+    orders = frames['orders']
+    if orders.empty:
+        return pd.DataFrame(columns=FACT_ORDER_COLUMNS)
+
+    route_columns = ['order_id', 'route_id', 'manifest_reference', 'manifest_integration_id',
+                     'external_expedition_type', 'driver_name', 'vehicle_code', 'route_created_ts', 'route_created']
+    task_columns = ['order_id', 'location_confirmation_ts', 'location_confirmation']
+
+    # Same fan-out as order LEFT JOIN route_detail/route ... LEFT JOIN driver_tasks/confirmations
+    combos = (orders[['order_id']]
+              .merge(frames['routes'][route_columns], on='order_id', how='left')
+              .merge(frames['tasks'][task_columns], on='order_id', how='left'))
+    group_keys = route_columns + task_columns[1:]
+    groups = combos.groupby(group_keys, dropna=False, sort=True).size().reset_index(name='multiplicity')
+
+    # DISTINCT ON (order_id): keep one group per order
+    groups = groups.drop_duplicates('order_id', keep='first')
+
+    df = (groups
+          .merge(orders, on='order_id', how='left')
+          .merge(frames['details'], on='order_id', how='left'))
+    multiplicity = df['multiplicity']
+    df['faktur_total_quantity'] = scale_sum(df['sum_quantity_faktur'], multiplicity)
+    df['tms_total_quantity'] = scale_sum(df['sum_quantity_delivery'], multiplicity)
+    df['total_return'] = ((pd.to_numeric(df['sum_quantity_delivery'], errors='coerce')
+                           - pd.to_numeric(df['sum_quantity_unloading'], errors='coerce')) * multiplicity).round(2)
+    df['total_net_value'] = scale_sum(df['sum_net_price'], multiplicity)
+    df = df.rename(columns={'vehicle_code': 'code'})
+    return df[FACT_ORDER_COLUMNS].reset_index(drop=True)
+
+def derive_fact_delivery(frames):
+    """Build the fact_delivery rows of a window from the shared extracts"""
+    routes = frames['routes']
+    routes = routes[routes['route_id'].notna()]
+    if routes.empty or frames['orders'].empty:
+        return pd.DataFrame(columns=FACT_DELIVERY_COLUMNS)
+
+    df = (routes
+          .merge(frames['orders'].drop(columns=['status']), on='order_id', how='inner')
+          .merge(frames['customers'], on='customer_id', how='left'))
+
+    # fact_delivery joins driver_tasks without confirmations: one row per driver task,
+    # grouped by complete_time; orders without tasks keep a single NULL group
+    tasks = frames['tasks'].drop_duplicates('driver_task_id')
+    task_groups = (tasks.groupby(['order_id', 'complete_time'], dropna=False)
+                   .size().reset_index(name='multiplicity'))
+    df = df.merge(task_groups, on='order_id', how='left')
+    multiplicity = df['multiplicity'].fillna(1)
+
+    df = df.merge(frames['details'], on='order_id', how='left')
+    df['net_price'] = scale_sum(df['sum_net_price'], multiplicity)
+    df['quantity_delivery'] = scale_sum(df['sum_quantity_delivery'], multiplicity)
+    df['quantity_faktur'] = scale_sum(df['sum_quantity_faktur'], multiplicity)
+    df = df.rename(columns={'route_status': 'status', 'location_code': 'code', 'location_name': 'name'})
+    return df[FACT_DELIVERY_COLUMNS].reset_index(drop=True)
+
+DERIVERS = {
+    'fact_order': derive_fact_order,
+    'fact_delivery': derive_fact_delivery,
+}
+
+def run_shared_pipeline(db_manager, date_from=None, date_to=None, chunk_cache=None, plan_capture=None):
+    """Extract each window once and upsert both fact tables from it.
+
+    With DIMENSION_MIRROR=true narrow extracts are enriched from the DimensionCache;
+    with a ChunkCache every derived frame is spilled before it is loaded. With a
+    PlanCapture the entity queries of slow (or, with explain, all) windows are captured
+    as shared_<entity>. Returns {fact_name: rows upserted}.
+    """
+    from dimension_mirror import DIMENSION_MIRROR, get_dimension_cache
+
+    date_from, date_to = resolve_date_range(date_from, date_to)
+    for fact_name in DERIVERS:
+        FACT_SPECS[fact_name]['create_table'](db_manager)
+
+    dimensions = None
+    if DIMENSION_MIRROR:
+        with db_manager.timed_stage('dimensions'):
+            dimensions = get_dimension_cache(db_manager)
+
+    controller = get_extraction_controller("shared extract")
+    totals = {fact_name: 0 for fact_name in DERIVERS}
+    window_start = date_from
+
+    while window_start <= date_to:
+        window_end = min(window_start + timedelta(days=controller.size - 1), date_to)
+        chunk_start = time.perf_counter()
+
+        with db_manager.timed_stage('extract'):
+            frames = extract_shared_window(db_manager, window_start, window_end, dimensions)
+        extract_seconds = time.perf_counter() - chunk_start
+        if plan_capture is not None and plan_capture.should_capture(extract_seconds):
+            queries = get_shared_extract_queries(window_start, window_end, narrow=dimensions is not None)
+            for entity, query in queries.items():
+                plan_capture.capture(f"shared_{entity}", query, window_start, window_end, extract_seconds)
+        peak_rss_mb = get_process_rss_mb()
+        logger.info(
+            f"Shared extract {window_start} to {window_end}: "
+            + ', '.join(f"{entity} {len(frame)}" for entity, frame in frames.items())
+        )
+
+        rows = 0
+        for fact_name, derive in DERIVERS.items():
+            spec = FACT_SPECS[fact_name]
+            with db_manager.timed_stage('transform'):
+                df = spec['transform'](derive(frames))
+            if df.empty:
+                logger.info(f"No {fact_name} rows for {window_start} to {window_end}")
+                continue
+            chunk_id = None
+            if chunk_cache is not None:
+                with db_manager.timed_stage('spill'):
+                    chunk_id = chunk_cache.spill(fact_name, spec['table'], spec['keys'], window_start, window_end, df)
+            with db_manager.timed_stage('load'):
+                totals[fact_name] += db_manager.upsert_dataframe_to_db(df, spec['table'], spec['keys'], 'B')
+            if chunk_cache is not None:
+                chunk_cache.mark_loaded(fact_name, chunk_id)
+            rows += len(df)
+            peak_rss_mb = max(peak_rss_mb, get_process_rss_mb())
+
+        del frames
+        controller.record((window_end - window_start).days + 1, rows,
+                          time.perf_counter() - chunk_start, peak_rss_mb)
+        window_start = window_end + timedelta(days=1)
+
+    logger.info("Shared extraction completed: " + ', '.join(f"{k} {v} rows" for k, v in totals.items()))
+    return totals
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Snapshot Extract
+Parallel reads of Database A that all see the same point in time. A coordinator
+connection opens a REPEATABLE READ, READ ONLY transaction and exports its snapshot
+with pg_export_snapshot(); every worker connection starts its own REPEATABLE READ
+transaction and imports it with SET TRANSACTION SNAPSHOT before running a query.
+An order moved between routes while the extraction runs is therefore seen in the
+same place by every worker, and no slice reads it twice or misses it.
+
+Used with EXTRACT_WORKERS > 1 by the fact pipeline (date windows extracted ahead in
+parallel) and by the shared extraction (the entity queries of a window in parallel).
+The snapshot is held for the whole run, which also holds back vacuum on Database A
+for that long; keep it for syncs, not multi-hour backfills.
+"""
+
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from database_utils import logger
+
+# Parallel connections reading Database A inside one exported snapshot (1 = sequential)
+EXTRACT_WORKERS = int(os.getenv('EXTRACT_WORKERS', 1))
+
+class SnapshotCoordinator:
+    """Holds the transaction whose snapshot the worker connections import"""
+
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        # Snapshots can only be imported on the server that exported them
+        self.engine = db_manager.get_db_a_read_engine()
+        self.conn = None
+        self.snapshot_id = None
+
+    def __enter__(self):
+        from sqlalchemy import text
+
+        self.conn = self.engine.connect()
+        try:
+            self.conn.execute(text("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY"))
+            self.snapshot_id = self.conn.execute(text("SELECT pg_export_snapshot()")).scalar()
+        except Exception as e:
+            logger.error(f"Error exporting snapshot on Database A: {e}")
+            self.conn.close()
+            raise
+        logger.info(f"Exported Database A snapshot {self.snapshot_id} for parallel extraction")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # The snapshot is only importable while this transaction is open
+        self.conn.rollback()
+        self.conn.close()
+
+    @contextmanager
+    def connection(self):
+        """Yield a Database A connection whose transaction uses the exported snapshot"""
+        from sqlalchemy import text
+
+        conn = self.engine.connect()
+        try:
+            conn.execute(text("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY"))
+            conn.execute(text(f"SET TRANSACTION SNAPSHOT '{self.snapshot_id}'"))
+            yield conn
+        finally:
+            conn.rollback()
+            conn.close()
+
+def extract_queries_in_snapshot(db_manager, queries, workers=EXTRACT_WORKERS):
+    """Run {name: query} on Database A in parallel inside one snapshot; returns {name: DataFrame}"""
+    with SnapshotCoordinator(db_manager) as coordinator:
+        def extract(query):
+            with coordinator.connection() as conn:
+                return db_manager.execute_query_to_dataframe(query, 'A', connection=conn, read_replica=True)
+
+        workers = db_manager.source_router.allowed_workers(workers, coordinator.engine)
+        with ThreadPoolExecutor(max_workers=min(workers, len(queries))) as executor:
+            futures = {name: executor.submit(extract, query) for name, query in queries.items()}
+            return {name: future.result() for name, future in futures.items()}
+
+def extract_windows_in_snapshot(db_manager, date_from, date_to, controller, extract, workers=EXTRACT_WORKERS):
+    """Yield (window_start, window_end, df, extract_seconds) in window order.
+
+    Up to `workers` windows are extracted ahead by worker threads sharing one exported
+    snapshot; extract(window_start, window_end, connection) returns the window frame.
+    Windows are sized by the controller when they are scheduled, so its feedback
+    applies with a lag of `workers` windows. Fewer windows run ahead while the source
+    is under pressure (see source_routing.py).
+    """
+    with SnapshotCoordinator(db_manager) as coordinator:
+        def run(window_start, window_end):
+            start = time.perf_counter()
+            with coordinator.connection() as conn:
+                df = extract(window_start, window_end, conn)
+            return df, time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            next_start = date_from
+            while pending or next_start <= date_to:
+                allowed = db_manager.source_router.allowed_workers(workers, coordinator.engine)
+                while next_start <= date_to and len(pending) < allowed:
+                    window_end = min(next_start + timedelta(days=controller.size - 1), date_to)
+                    pending.append((next_start, window_end, executor.submit(run, next_start, window_end)))
+                    next_start = window_end + timedelta(days=1)
+                window_start, window_end, future = pending.popleft()
+                df, seconds = future.result()
+                yield window_start, window_end, df, seconds
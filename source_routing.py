@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Source Routing
+Keeps the warehouse extraction off the OLTP primary of Database A where possible.
+
+- Replicas: DB_A_REPLICA_HOSTS lists read replicas (host:port, same database and
+  credentials as DB_A_*). Extraction reads go to the first replica whose replication
+  lag is within DB_A_REPLICA_MAX_LAG_SECONDS and fall back to the primary (DB_A_HOST)
+  when every replica lags or is unreachable. Lag is re-checked every
+  DB_A_REPLICA_CHECK_SECONDS. Only reads that opt in with read_replica=True (fact
+  windows, backfill, shared extraction, dimension mirror) are routed; CDC refreshes
+  and reconcile/resync always read the primary, since they must not write back
+  state the replica has not replayed yet.
+- Load shedding: the number of active client queries in pg_stat_activity of the
+  server being read is sampled every SOURCE_LOAD_CHECK_SECONDS. Above
+  SOURCE_MAX_ACTIVE_QUERIES parallel extraction drops to one worker and new windows
+  wait (up to SOURCE_SHED_MAX_WAIT_SECONDS) for the pressure to ease; above half of
+  it the worker count is halved.
+"""
+
+import os
+import time
+import threading
+from database_utils import logger
+
+DB_A_REPLICA_HOSTS = os.getenv('DB_A_REPLICA_HOSTS', '')
+DB_A_REPLICA_MAX_LAG_SECONDS = float(os.getenv('DB_A_REPLICA_MAX_LAG_SECONDS', 300))
+DB_A_REPLICA_CHECK_SECONDS = float(os.getenv('DB_A_REPLICA_CHECK_SECONDS', 60))
+# Active client queries on the source above which extraction is shed; 0 disables
+SOURCE_MAX_ACTIVE_QUERIES = int(os.getenv('SOURCE_MAX_ACTIVE_QUERIES', 0))
+SOURCE_LOAD_CHECK_SECONDS = float(os.getenv('SOURCE_LOAD_CHECK_SECONDS', 10))
+SOURCE_SHED_MAX_WAIT_SECONDS = float(os.getenv('SOURCE_SHED_MAX_WAIT_SECONDS', 300))
+
+def get_source_endpoints(db_a_config, replica_hosts=DB_A_REPLICA_HOSTS):
+    """Return [(role, name, config)] for the primary and every configured replica"""
+    endpoints = [('primary', 'A', db_a_config)]
+    for entry in filter(None, (host.strip() for host in replica_hosts.split(','))):
+        host, _, port = entry.partition(':')
+        config = dict(db_a_config, host=host, port=port or db_a_config['port'])
+        endpoints.append(('replica', f"A:{host}:{config['port']}", config))
+    return endpoints
+
+def get_replica_lag_seconds(engine):
+    """Replication lag of a server in seconds (0 for a primary or a fully replayed standby)"""
+    from sqlalchemy import text
+    with engine.connect() as conn:
+        lag = conn.execute(text("""
+            SELECT CASE
+                WHEN NOT pg_is_in_recovery() THEN 0
+                WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+            END
+        """)).scalar()
+    return float(lag or 0)
+
+def get_active_queries(engine):
+    """Number of other client backends currently running a query"""
+    from sqlalchemy import text
+    with engine.connect() as conn:
+        return conn.execute(text("""
+            SELECT count(*) FROM pg_stat_activity
+            WHERE backend_type = 'client backend' AND state = 'active' AND pid <> pg_backend_pid()
+        """)).scalar()
+
+class SourceRouter:
+    """Chooses the Database A endpoint for extraction reads and watches its load"""
+
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self.endpoints = get_source_endpoints(db_manager.db_a_config)
+        self.lock = threading.Lock()
+        self.current = 'A'
+        self.checked_at = 0.0
+        self.load_checked_at = {}
+        self.active_queries = {}
+
+    def _engine(self, name, config):
+        return self.db_manager.get_db_a_engine() if name == 'A' else self.db_manager.get_endpoint_engine(name, config)
+
+    def _choose(self):
+        for role, name, config in self.endpoints:
+            if role != 'replica':
+                continue
+            try:
+                lag = get_replica_lag_seconds(self._engine(name, config))
+            except Exception as e:
+                logger.warning(f"Replica {name} is unreachable: {e}")
+                continue
+            if lag <= DB_A_REPLICA_MAX_LAG_SECONDS:
+                return name
+            logger.warning(f"Replica {name} lags {lag:.0f}s (limit {DB_A_REPLICA_MAX_LAG_SECONDS:.0f}s)")
+        return 'A'
+
+    def read_engine(self):
+        """Engine for extraction reads: a replica within the lag bound, else the primary"""
+        with self.lock:
+            if len(self.endpoints) > 1 and time.monotonic() - self.checked_at >= DB_A_REPLICA_CHECK_SECONDS:
+                chosen = self._choose()
+                if chosen != self.current:
+                    target = 'primary' if chosen == 'A' else f"replica {chosen}"
+                    logger.info(f"Routing Database A extraction reads to the {target}")
+                self.current = chosen
+                self.checked_at = time.monotonic()
+            name = self.current
+        config = next(config for _, endpoint, config in self.endpoints if endpoint == name)
+        return self._engine(name, config)
+
+    def get_active_queries(self, engine):
+        """Sampled active query count of an endpoint (None if it cannot be read)"""
+        key = str(engine.url)
+        with self.lock:
+            if time.monotonic() - self.load_checked_at.get(key, 0.0) < SOURCE_LOAD_CHECK_SECONDS:
+                return self.active_queries.get(key)
+            self.load_checked_at[key] = time.monotonic()
+        try:
+            active = get_active_queries(engine)
+        except Exception as e:
+            logger.warning(f"Could not read pg_stat_activity of Database A: {e}")
+            active = None
+        with self.lock:
+            self.active_queries[key] = active
+        return active
+
+    def allowed_workers(self, workers, engine=None):
+        """Shed parallel extraction workers when the source is under pressure"""
+        if SOURCE_MAX_ACTIVE_QUERIES <= 0 or workers <= 1:
+            return workers
+        active = self.get_active_queries(engine or self.read_engine())
+        if active is None:
+            return workers
+        if active >= SOURCE_MAX_ACTIVE_QUERIES:
+            allowed = 1
+        elif active >= SOURCE_MAX_ACTIVE_QUERIES / 2:
+            allowed = max(1, workers // 2)
+        else:
+            return workers
+        logger.info(f"Database A has {active} active queries; extracting with {allowed} of {workers} workers")
+        return allowed
+
+    def wait_for_capacity(self, engine=None):
+        """Delay the next extraction while the source is over SOURCE_MAX_ACTIVE_QUERIES"""
+        if SOURCE_MAX_ACTIVE_QUERIES <= 0:
+            return
+        engine = engine or self.read_engine()
+        deadline = time.monotonic() + SOURCE_SHED_MAX_WAIT_SECONDS
+        while time.monotonic() < deadline:
+            active = self.get_active_queries(engine)
+            if active is None or active < SOURCE_MAX_ACTIVE_QUERIES:
+                return
+            logger.info(f"Database A has {active} active queries (limit {SOURCE_MAX_ACTIVE_QUERIES}); "
+                        f"delaying extraction")
+            time.sleep(SOURCE_LOAD_CHECK_SECONDS)
+        logger.warning(f"Database A still under pressure after {SOURCE_SHED_MAX_WAIT_SECONDS:.0f}s; extracting anyway")
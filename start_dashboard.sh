@@ -26,6 +26,11 @@ if [ $? -ne 0 ]; then
     echo "Installing Flask..."
     pip3 install flask==3.0.0
 fi
+python3 -c "import gunicorn" 2>/dev/null
+if [ $? -ne 0 ]; then
+    echo "Installing gunicorn..."
+    pip3 install gunicorn==21.2.0
+fi
 
 # Set default web configuration
 export WEB_HOST=${WEB_HOST:-"0.0.0.0"}
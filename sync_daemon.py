@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Sync Daemon
+Long-lived scheduler behind `sync_manager.py --daemon`. It keeps one DatabaseManager
+(and its connection pools) warm, runs incremental micro-syncs of the last few days
+on a short cadence and a month-to-date reconcile with resync (followed by the
+tms_sync_log compaction) on a longer one.
+SIGTERM/SIGINT drain the running job before exiting, and liveness is reported to
+systemd (sd_notify READY/WATCHDOG) and through a heartbeat file.
+"""
+
+import os
+import time
+import socket
+import signal
+import threading
+from datetime import date, timedelta
+from database_utils import DatabaseManager, logger
+
+DAEMON_INTERVAL_MINUTES = float(os.getenv('DAEMON_INTERVAL_MINUTES', 15))
+DAEMON_LOOKBACK_DAYS = int(os.getenv('DAEMON_LOOKBACK_DAYS', 1))
+DAEMON_RECONCILE_HOURS = float(os.getenv('DAEMON_RECONCILE_HOURS', 24))
+DAEMON_JOB_TIMEOUT_MINUTES = float(os.getenv('DAEMON_JOB_TIMEOUT_MINUTES', 120))
+DAEMON_HEARTBEAT_FILE = os.getenv('DAEMON_HEARTBEAT_FILE', '/tmp/tms_sync_daemon.heartbeat')
+
+def sd_notify(state):
+    """Send a state string to systemd's notify socket; no-op outside systemd"""
+    address = os.getenv('NOTIFY_SOCKET')
+    if not address:
+        return False
+    if address.startswith('@'):
+        address = '\0' + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall(state.encode())
+        return True
+    except OSError as e:
+        logger.warning(f"sd_notify failed: {e}")
+        return False
+
+def write_heartbeat(path=DAEMON_HEARTBEAT_FILE, state='idle'):
+    """Record the current time and state for external health checks"""
+    try:
+        with open(path, 'w') as f:
+            f.write(f"{time.time():.0f} {state}\n")
+    except OSError as e:
+        logger.warning(f"Could not write heartbeat file {path}: {e}")
+
+def check_daemon_health(path=DAEMON_HEARTBEAT_FILE, max_age_seconds=None):
+    """Return True if the daemon heartbeat is younger than max_age_seconds"""
+    if max_age_seconds is None:
+        max_age_seconds = float(os.getenv('DAEMON_HEARTBEAT_MAX_AGE_SECONDS', 300))
+    try:
+        with open(path) as f:
+            timestamp, _, state = f.read().strip().partition(' ')
+        age = time.time() - float(timestamp)
+    except (OSError, ValueError):
+        print(f"UNHEALTHY: no heartbeat at {path}")
+        return False
+
+    if age > max_age_seconds:
+        print(f"UNHEALTHY: last heartbeat {age:.0f}s ago ({state})")
+        return False
+    print(f"OK: last heartbeat {age:.0f}s ago ({state})")
+    return True
+
+class SyncDaemon:
+    """Run micro-syncs and reconciles on a schedule until SIGTERM/SIGINT"""
+
+    def __init__(self, sync_type='both', interval_minutes=DAEMON_INTERVAL_MINUTES,
+                 lookback_days=DAEMON_LOOKBACK_DAYS, reconcile_hours=DAEMON_RECONCILE_HOURS):
+        self.sync_type = sync_type
+        self.interval_seconds = interval_minutes * 60
+        self.lookback_days = lookback_days
+        self.reconcile_seconds = reconcile_hours * 3600
+        self.db_manager = DatabaseManager()
+        self.stop_event = threading.Event()
+        self.job_started = None
+        self.state = 'starting'
+
+    def request_stop(self, signum, frame):
+        logger.info(f"Received signal {signum}, draining current job before exit...")
+        sd_notify('STOPPING=1')
+        self.stop_event.set()
+
+    def _liveness_loop(self):
+        """Ping the systemd watchdog and heartbeat file while the daemon is healthy.
+
+        A job running longer than DAEMON_JOB_TIMEOUT_MINUTES stops the pings, so a
+        hung sync gets restarted by systemd instead of silently blocking the schedule.
+        """
+        watchdog_usec = int(os.getenv('WATCHDOG_USEC', 0))
+        interval = watchdog_usec / 2e6 if watchdog_usec else 30
+        while not self.stop_event.wait(interval):
+            if self.job_started and time.monotonic() - self.job_started > DAEMON_JOB_TIMEOUT_MINUTES * 60:
+                logger.error(f"Job '{self.state}' exceeded {DAEMON_JOB_TIMEOUT_MINUTES} minutes; withholding watchdog ping")
+                continue
+            sd_notify('WATCHDOG=1')
+            write_heartbeat(state=self.state)
+
+    def _run_job(self, name, job):
+        """Run one job; failures are logged and retried on the next tick"""
+        self.state = name
+        self.job_started = time.monotonic()
+        write_heartbeat(state=name)
+        start = time.perf_counter()
+        try:
+            job()
+            logger.info(f"Daemon job '{name}' finished in {time.perf_counter() - start:.1f}s")
+        except (Exception, SystemExit) as e:
+            # process_fact_* exit on failure; the daemon must survive that
+            logger.error(f"Daemon job '{name}' failed: {e}")
+        finally:
+            self.job_started = None
+            self.state = 'idle'
+            write_heartbeat(state='idle')
+
+    def micro_sync(self):
+        """Sync the last DAEMON_LOOKBACK_DAYS days"""
+        from sync_manager import run_sync
+        date_to = date.today()
+        date_from = date_to - timedelta(days=self.lookback_days)
+        run_sync(self.sync_type, date_from=date_from, date_to=date_to, db_manager=self.db_manager)
+
+    def reconcile_month(self):
+        """Reconcile month-to-date and resync divergent orders"""
+        from sync_manager import run_reconcile
+        today = date.today()
+        run_reconcile(self.sync_type, date_from=today.replace(day=1), date_to=today,
+                      resync=True, db_manager=self.db_manager)
+
+    def compact_sync_log(self):
+        """Roll up and delete tms_sync_log rows past SYNC_LOG_RETENTION_DAYS"""
+        from sync_log_retention import compact_sync_log
+        compact_sync_log(self.db_manager)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+
+        logger.info(
+            f"Sync daemon started for {self.sync_type}: micro-sync every {self.interval_seconds / 60:.0f} min "
+            f"(last {self.lookback_days} days), reconcile every {self.reconcile_seconds / 3600:.0f} h"
+        )
+        liveness = threading.Thread(target=self._liveness_loop, daemon=True)
+        liveness.start()
+        self.state = 'idle'
+        write_heartbeat(state='idle')
+        sd_notify('READY=1')
+
+        next_sync = time.monotonic()
+        next_reconcile = time.monotonic() + self.reconcile_seconds
+        try:
+            while not self.stop_event.is_set():
+                now = time.monotonic()
+                if now >= next_reconcile:
+                    self._run_job('reconcile', self.reconcile_month)
+                    self._run_job('compact_sync_log', self.compact_sync_log)
+                    next_reconcile = time.monotonic() + self.reconcile_seconds
+                elif now >= next_sync:
+                    self._run_job('micro_sync', self.micro_sync)
+                    next_sync = time.monotonic() + self.interval_seconds
+                else:
+                    self.stop_event.wait(min(next_sync, next_reconcile) - now)
+        finally:
+            self.stop_event.set()
+            self.db_manager.dispose_engines()
+            logger.info("Sync daemon stopped")
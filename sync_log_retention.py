@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Sync Log Retention
+Keeps tms_sync_log bounded. Raw rows are kept for SYNC_LOG_RETENTION_DAYS days; older
+rows are rolled up into tms_sync_log_daily (one row per day and sync_type with run
+counts, durations and records processed) and deleted, SYNC_LOG_COMPACT_BATCH rows per
+transaction. Each batch deletes its rows and adds them to the rollup in one statement,
+so an interrupted compaction never counts a run twice or loses it.
+
+History over long ranges (get_sync_history, the dashboard's /api/history) reads the
+rollups for compacted days, so only the raw rows of the retention window are aggregated.
+Runs with `sync_manager.py --compact-log` and once per reconcile cycle in the daemon.
+"""
+
+import os
+from datetime import date, timedelta
+from database_utils import logger
+
+SYNC_LOG_RETENTION_DAYS = int(os.getenv('SYNC_LOG_RETENTION_DAYS', 90))
+SYNC_LOG_COMPACT_BATCH = int(os.getenv('SYNC_LOG_COMPACT_BATCH', 5000))
+
+def create_sync_log_daily_table(db_manager):
+    """Create tms_sync_log_daily in Database B"""
+    create_table_query = """
+    CREATE TABLE IF NOT EXISTS tms_sync_log_daily (
+        log_date DATE NOT NULL,
+        sync_type VARCHAR(50) NOT NULL,
+        total_runs INTEGER NOT NULL DEFAULT 0,
+        successful_runs INTEGER NOT NULL DEFAULT 0,
+        failed_runs INTEGER NOT NULL DEFAULT 0,
+        total_seconds NUMERIC(14,1) NOT NULL DEFAULT 0,
+        max_seconds NUMERIC(12,1),
+        records_processed BIGINT NOT NULL DEFAULT 0,
+        first_start TIMESTAMP WITH TIME ZONE,
+        last_end TIMESTAMP WITH TIME ZONE,
+        PRIMARY KEY (log_date, sync_type)
+    );
+    """
+    try:
+        engine = db_manager.get_db_b_engine()
+        with engine.connect() as conn:
+            from sqlalchemy import text
+            conn.execute(text(create_table_query))
+            conn.commit()
+    except Exception as e:
+        logger.error(f"Error creating sync log rollup table: {e}")
+        raise
+
+def compact_sync_log(db_manager, retention_days=SYNC_LOG_RETENTION_DAYS, batch_size=SYNC_LOG_COMPACT_BATCH):
+    """Roll up and delete tms_sync_log rows older than retention_days; returns rows compacted"""
+    from sqlalchemy import text
+
+    create_sync_log_daily_table(db_manager)
+    cutoff = date.today() - timedelta(days=retention_days)
+    # RUNNING rows past the cutoff belong to crashed runs; they count as runs only
+    compact_query = text("""
+        WITH expired AS (
+            DELETE FROM tms_sync_log
+            WHERE id IN (
+                SELECT id FROM tms_sync_log
+                WHERE start_time < :cutoff
+                ORDER BY start_time
+                LIMIT :batch_size
+            )
+            RETURNING sync_type, start_time, end_time, status, records_processed
+        ), daily AS (
+            SELECT start_time::date AS log_date,
+                   sync_type,
+                   COUNT(*) AS total_runs,
+                   COUNT(*) FILTER (WHERE status = 'SUCCESS') AS successful_runs,
+                   COUNT(*) FILTER (WHERE status = 'FAILED') AS failed_runs,
+                   COALESCE(SUM(EXTRACT(EPOCH FROM end_time - start_time)), 0) AS total_seconds,
+                   MAX(EXTRACT(EPOCH FROM end_time - start_time)) AS max_seconds,
+                   COALESCE(SUM(records_processed), 0) AS records_processed,
+                   MIN(start_time) AS first_start,
+                   MAX(end_time) AS last_end
+            FROM expired
+            GROUP BY 1, 2
+        ), merged AS (
+            INSERT INTO tms_sync_log_daily AS d
+            SELECT * FROM daily
+            ON CONFLICT (log_date, sync_type) DO UPDATE SET
+                total_runs = d.total_runs + EXCLUDED.total_runs,
+                successful_runs = d.successful_runs + EXCLUDED.successful_runs,
+                failed_runs = d.failed_runs + EXCLUDED.failed_runs,
+                total_seconds = d.total_seconds + EXCLUDED.total_seconds,
+                max_seconds = GREATEST(d.max_seconds, EXCLUDED.max_seconds),
+                records_processed = d.records_processed + EXCLUDED.records_processed,
+                first_start = LEAST(d.first_start, EXCLUDED.first_start),
+                last_end = GREATEST(d.last_end, EXCLUDED.last_end)
+        )
+        SELECT COUNT(*) FROM expired
+    """)
+
+    compacted = 0
+    try:
+        engine = db_manager.get_db_b_engine()
+        while True:
+            with engine.connect() as conn:
+                rows = conn.execute(compact_query, {'cutoff': cutoff, 'batch_size': batch_size}).scalar()
+                conn.commit()
+            compacted += rows
+            if rows < batch_size:
+                break
+    except Exception as e:
+        logger.error(f"Error compacting tms_sync_log: {e}")
+        raise
+    logger.info(f"Compacted {compacted} tms_sync_log rows older than {cutoff} into tms_sync_log_daily")
+    return compacted
+
+def get_sync_history(db_manager, days=30, sync_type=None):
+    """Daily sync summaries of the last days days, newest first.
+
+    Returns rows (log_date, sync_type, total_runs, successful_runs, failed_runs,
+    total_seconds, max_seconds, records_processed). Compacted runs come from the
+    rollups and the rest from tms_sync_log; compaction moves a row from one to the
+    other atomically, so adding both counts every run once.
+    """
+    from sqlalchemy import text
+
+    date_from = date.today() - timedelta(days=days - 1)
+    type_filter = "AND sync_type = :sync_type" if sync_type else ""
+    query = f"""
+    SELECT log_date, sync_type, SUM(total_runs), SUM(successful_runs), SUM(failed_runs),
+           SUM(total_seconds), MAX(max_seconds), SUM(records_processed)
+    FROM (
+        SELECT log_date, sync_type, total_runs, successful_runs, failed_runs,
+               total_seconds, max_seconds, records_processed
+        FROM tms_sync_log_daily
+        WHERE log_date >= :date_from {type_filter}
+        UNION ALL
+        SELECT start_time::date, sync_type, COUNT(*),
+               COUNT(*) FILTER (WHERE status = 'SUCCESS'),
+               COUNT(*) FILTER (WHERE status = 'FAILED'),
+               COALESCE(SUM(EXTRACT(EPOCH FROM end_time - start_time)), 0),
+               MAX(EXTRACT(EPOCH FROM end_time - start_time)),
+               COALESCE(SUM(records_processed), 0)
+        FROM tms_sync_log
+        WHERE start_time >= :date_from {type_filter}
+        GROUP BY 1, 2
+    ) history
+    GROUP BY log_date, sync_type
+    ORDER BY log_date DESC, sync_type
+    """
+    params = {'date_from': date_from, 'sync_type': sync_type}
+
+    try:
+        with db_manager.get_db_b_engine().connect() as conn:
+            return conn.execute(text(query), params).fetchall()
+    except Exception as e:
+        logger.error(f"Error getting sync history: {e}")
+        return []
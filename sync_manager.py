@@ -9,8 +9,9 @@ import logging
 import argparse
 from datetime import datetime
 from database_utils import DatabaseManager, logger
-from fact_order import process_fact_order
-from fact_delivery import process_fact_delivery
+
+# Fact pipelines (and pandas with them) are imported by the commands that run them, so
+# --status, --health and the web dashboard start without loading them
 
 def create_sync_log_table(db_manager):
     """Create sync_log table in Database B to track synchronization history"""
@@ -25,6 +26,8 @@ def create_sync_log_table(db_manager):
         error_message TEXT,
         created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
     );
+    CREATE INDEX IF NOT EXISTS idx_tms_sync_log_start_time ON tms_sync_log (start_time);
+    CREATE INDEX IF NOT EXISTS idx_tms_sync_log_type_start_time ON tms_sync_log (sync_type, start_time);
     """
     
     try:
@@ -33,6 +36,9 @@ def create_sync_log_table(db_manager):
             from sqlalchemy import text
             conn.execute(text(create_table_query))
             conn.commit()
+        # Daily rollups of compacted log rows (see sync_log_retention.py)
+        from sync_log_retention import create_sync_log_daily_table
+        create_sync_log_daily_table(db_manager)
         logger.info("tms_sync_log table created/verified in Database B")
     except Exception as e:
         logger.error(f"Error creating sync_log table: {e}")
@@ -120,9 +126,29 @@ def get_sync_status(db_manager, sync_type=None, limit=10):
         logger.error(f"Error getting sync status: {e}")
         return []
 
-def run_sync(sync_type, date_from=None, date_to=None):
-    """Run synchronization for specified type with optional date filtering"""
-    db_manager = DatabaseManager()
+def run_sync(sync_type, date_from=None, date_to=None, db_manager=None, shared=None, engine=None,
+             explain=False):
+    """Run synchronization for specified type with optional date filtering.
+    
+    With shared=True (default: SHARED_EXTRACTION), 'both' extracts each source table
+    once and derives both fact tables from it. engine='fdw' (default: SYNC_ENGINE) runs
+    the sync inside Database B through postgres_fdw and engine='async' on asyncpg
+    pools, both falling back to the Python pipeline when unavailable. explain=True
+    captures the plan of every fact window in tms_query_plans (otherwise only slow
+    ones); the fdw and async engines capture no plans. With FACT_MARTS=true the
+    daily marts of the synced facts are refreshed for the days the sync touched (see
+    fact_marts.py). Returns the number of rows upserted.
+    """
+    if db_manager is None:
+        db_manager = DatabaseManager()
+    if shared is None:
+        from shared_extract import SHARED_EXTRACTION
+        shared = SHARED_EXTRACTION
+    if engine is None:
+        from fdw_sync import SYNC_ENGINE
+        engine = SYNC_ENGINE
+    from fact_order import process_fact_order
+    from fact_delivery import process_fact_delivery
     
     # Create sync_log table if not exists
     create_sync_log_table(db_manager)
@@ -130,34 +156,184 @@ def run_sync(sync_type, date_from=None, date_to=None):
     # Log sync start
     sync_id = log_sync_start(db_manager, sync_type)
     
+    # Extracted chunks are spilled to disk when CHUNK_CACHE=true (see --replay)
+    from chunk_cache import begin_run
+    chunk_cache = begin_run()
+    
+    # Plans of slow (or with explain, all) fact windows are keyed by this sync's id
+    from query_plans import begin_capture
+    plan_capture = begin_capture(db_manager, sync_id, explain_all=explain)
+    
     try:
-        if sync_type == 'fact_order':
-            process_fact_order(date_from=date_from, date_to=date_to)
-            log_sync_complete(db_manager, sync_id, 'SUCCESS')
+        if engine == 'fdw' and sync_type in ('fact_order', 'fact_delivery', 'both'):
+            from fdw_sync import prepare_fdw
+            if not prepare_fdw(db_manager):
+                engine = 'python'
+        elif engine == 'async' and sync_type in ('fact_order', 'fact_delivery', 'both'):
+            from async_pipeline import async_available
+            if not async_available():
+                engine = 'python'
+        if explain and engine in ('fdw', 'async') and sync_type in ('fact_order', 'fact_delivery', 'both'):
+            # These engines extract without per-window queries on Database A to EXPLAIN
+            logger.warning(f"--explain is not supported by the {engine} engine; no plans will be captured "
+                           f"(use --engine python)")
+        
+        if engine == 'async':
+            from async_pipeline import run_async_sync
+            logger.info(f"Starting {sync_type} sync on the asyncio engine...")
+            records = run_async_sync(sync_type, date_from=date_from, date_to=date_to, db_manager=db_manager)
+        elif engine == 'fdw':
+            from fdw_sync import run_fdw_sync
+            logger.info(f"Starting {sync_type} sync inside Database B via postgres_fdw...")
+            records = run_fdw_sync(db_manager, sync_type, date_from=date_from, date_to=date_to)
+        elif sync_type == 'fact_order':
+            records = process_fact_order(date_from=date_from, date_to=date_to, db_manager=db_manager,
+                                         chunk_cache=chunk_cache, plan_capture=plan_capture)
         elif sync_type == 'fact_delivery':
-            process_fact_delivery(date_from=date_from, date_to=date_to)
-            log_sync_complete(db_manager, sync_id, 'SUCCESS')
+            records = process_fact_delivery(date_from=date_from, date_to=date_to, db_manager=db_manager,
+                                            chunk_cache=chunk_cache, plan_capture=plan_capture)
+        elif sync_type == 'both' and shared:
+            from shared_extract import run_shared_pipeline
+            logger.info("Starting shared fact_order + fact_delivery sync...")
+            records = sum(run_shared_pipeline(db_manager, date_from=date_from, date_to=date_to,
+                                              chunk_cache=chunk_cache, plan_capture=plan_capture).values())
         elif sync_type == 'both':
             # Run both synchronizations
             logger.info("Starting fact_order sync...")
-            process_fact_order(date_from=date_from, date_to=date_to)
+            records = process_fact_order(date_from=date_from, date_to=date_to, db_manager=db_manager,
+                                         chunk_cache=chunk_cache, plan_capture=plan_capture)
             logger.info("Starting fact_delivery sync...")
-            process_fact_delivery(date_from=date_from, date_to=date_to)
-            log_sync_complete(db_manager, sync_id, 'SUCCESS')
+            records += process_fact_delivery(date_from=date_from, date_to=date_to, db_manager=db_manager,
+                                             chunk_cache=chunk_cache, plan_capture=plan_capture)
         else:
             raise ValueError(f"Invalid sync_type: {sync_type}")
+        
+        # Re-aggregate the mart days this sync touched; the facts are loaded either way
+        from fact_marts import FACT_MARTS, refresh_marts
+        if FACT_MARTS:
+            from fact_specs import get_fact_names
+            try:
+                refresh_marts(db_manager, get_fact_names(sync_type))
+            except Exception as e:
+                logger.warning(f"Mart refresh failed, retry with --refresh-marts: {e}")
+        
+        log_sync_complete(db_manager, sync_id, 'SUCCESS', records_processed=records)
+        return records
             
-    except Exception as e:
-        error_msg = str(e)
+    except (Exception, SystemExit) as e:
+        # process_fact_* exit the process on failure; record that as a failed sync too
+        error_msg = str(e) if isinstance(e, Exception) else f"Sync exited with code {e.code}"
+        if chunk_cache is not None and chunk_cache.manifest['facts']:
+            error_msg += f" (extracted chunks cached; retry with --replay {chunk_cache.run_id})"
         logger.error(f"Sync failed: {error_msg}")
         log_sync_complete(db_manager, sync_id, 'FAILED', error_message=error_msg)
         raise
 
+def run_reconcile(sync_type, date_from=None, date_to=None, bucket_mode='day', buckets=64, resync=False,
+                  db_manager=None):
+    """Reconcile fact tables against Database A and log the outcome in tms_sync_log"""
+    from reconcile import reconcile_fact, print_reconcile_report
+    from fact_specs import get_fact_names
+
+    if db_manager is None:
+        db_manager = DatabaseManager()
+    create_sync_log_table(db_manager)
+    
+    for fact_name in get_fact_names(sync_type):
+        sync_id = log_sync_start(db_manager, f'reconcile_{fact_name}')
+        try:
+            report = reconcile_fact(fact_name, date_from=date_from, date_to=date_to,
+                                    bucket_mode=bucket_mode, buckets=buckets,
+                                    resync=resync, db_manager=db_manager)
+            print_reconcile_report(report)
+            
+            divergent = len(report['missing_in_target']) + len(report['extra_in_target']) + len(report['changed'])
+            if divergent and not resync:
+                log_sync_complete(db_manager, sync_id, 'MISMATCH', records_processed=divergent,
+                                  error_message=f"{divergent} divergent rows in {len(report['mismatched_buckets'])} buckets")
+            else:
+                log_sync_complete(db_manager, sync_id, 'SUCCESS',
+                                  records_processed=report['resynced_rows'] + report['deleted_rows'])
+        except Exception as e:
+            logger.error(f"Reconcile failed: {e}")
+            log_sync_complete(db_manager, sync_id, 'FAILED', error_message=str(e))
+            raise
+
+def run_backfill_command(sync_type, date_from, date_to, args):
+    """Run a throttled backfill and log it in tms_sync_log as backfill_<sync_type>"""
+    import backfill
+    
+    db_manager = DatabaseManager()
+    create_sync_log_table(db_manager)
+    sync_id = log_sync_start(db_manager, f'backfill_{sync_type}')
+    try:
+        rows, failed = backfill.run_backfill(
+            sync_type, date_from=date_from, date_to=date_to,
+            unit_days=args.unit_days or backfill.BACKFILL_UNIT_DAYS,
+            max_concurrency=args.workers or backfill.BACKFILL_MAX_CONCURRENCY,
+            max_rows_per_second=(args.max_rows_per_second if args.max_rows_per_second is not None
+                                 else backfill.BACKFILL_MAX_ROWS_PER_SECOND),
+            newest_first=args.newest_first, restart=args.restart)
+    except Exception as e:
+        logger.error(f"Backfill failed: {e}")
+        log_sync_complete(db_manager, sync_id, 'FAILED', error_message=str(e))
+        raise
+    
+    if failed:
+        log_sync_complete(db_manager, sync_id, 'FAILED', records_processed=rows,
+                          error_message=f"{failed} units failed; rerun to retry them")
+        sys.exit(1)
+    log_sync_complete(db_manager, sync_id, 'SUCCESS', records_processed=rows)
+
+def parse_date_args(args):
+    """Parse --date-from/--date-to into date objects; returns None on invalid input"""
+    date_from = None
+    date_to = None
+    
+    if args.date_from:
+        try:
+            date_from = datetime.strptime(args.date_from, '%Y-%m-%d').date()
+            logger.info(f"Filtering from date: {date_from}")
+        except ValueError:
+            logger.error("Invalid date format for --date-from. Use YYYY-MM-DD format.")
+            return None
+    
+    if args.date_to:
+        try:
+            date_to = datetime.strptime(args.date_to, '%Y-%m-%d').date()
+            logger.info(f"Filtering to date: {date_to}")
+        except ValueError:
+            logger.error("Invalid date format for --date-to. Use YYYY-MM-DD format.")
+            return None
+    
+    return date_from, date_to
+
 def main():
     parser = argparse.ArgumentParser(description='Data Synchronization Manager')
+    parser.add_argument('command',
+                       nargs='?',
+                       choices=['backfill'],
+                       help='backfill: load a historical range in throttled work units (use --sync to pick facts)')
     parser.add_argument('--sync', 
                        choices=['fact_order', 'fact_delivery', 'both'],
                        help='Type of synchronization to run')
+    parser.add_argument('--engine',
+                       choices=['python', 'fdw', 'async'],
+                       help='Sync engine: python pipeline, INSERT ... SELECT on Database B via postgres_fdw, '
+                            'or concurrent partitions on asyncpg (default: SYNC_ENGINE)')
+    parser.add_argument('--explain',
+                       action='store_true',
+                       help='With --sync: capture EXPLAIN (ANALYZE, BUFFERS) plans of every fact window in tms_query_plans')
+    parser.add_argument('--plan-diff',
+                       choices=['fact_order', 'fact_delivery'],
+                       help='Compare the captured query plans of the last two runs of a fact')
+    parser.add_argument('--plan-runs',
+                       nargs=2,
+                       metavar=('OLD_RUN', 'NEW_RUN'),
+                       help='With --plan-diff: compare these two run ids (tms_sync_log ids) instead')
+    parser.add_argument('--shared-extract',
+                       action='store_true',
+                       help='With --sync both: extract source tables once and derive both facts from it')
     parser.add_argument('--status', 
                        action='store_true',
                        help='Show recent sync status')
@@ -168,12 +344,77 @@ def main():
                        type=int,
                        default=10,
                        help='Number of status records to show (default: 10)')
+    parser.add_argument('--history',
+                       type=int,
+                       metavar='DAYS',
+                       help='Show daily sync summaries of the last DAYS days (use --status-type to filter)')
+    parser.add_argument('--compact-log',
+                       action='store_true',
+                       help='Roll up tms_sync_log rows older than SYNC_LOG_RETENTION_DAYS into '
+                            'tms_sync_log_daily and delete them')
     parser.add_argument('--date-from',
                        type=str,
                        help='Start date for filtering (YYYY-MM-DD format, e.g., 2025-07-01)')
     parser.add_argument('--date-to',
                        type=str,
                        help='End date for filtering (YYYY-MM-DD format, e.g., 2025-07-07)')
+    parser.add_argument('--reconcile',
+                       choices=['fact_order', 'fact_delivery', 'both'],
+                       help='Compare Database B with Database A using per-bucket checksums')
+    parser.add_argument('--bucket',
+                       choices=['day', 'hash'],
+                       default='day',
+                       help='Reconcile bucket: per faktur_date or per order_id hash (default: day)')
+    parser.add_argument('--buckets',
+                       type=int,
+                       default=64,
+                       help='Number of hash buckets for --bucket hash (default: 64)')
+    parser.add_argument('--resync',
+                       action='store_true',
+                       help='With --reconcile: resync only the divergent orders')
+    parser.add_argument('--cdc',
+                       choices=['fact_order', 'fact_delivery', 'both'],
+                       help='Stream changes from the Database A replication slot and keep facts fresh')
+    parser.add_argument('--daemon',
+                       choices=['fact_order', 'fact_delivery', 'both'],
+                       help='Run as a long-lived scheduler with periodic micro-syncs and reconciles')
+    parser.add_argument('--health',
+                       action='store_true',
+                       help='Exit 0 if the daemon heartbeat is fresh, 1 otherwise')
+    parser.add_argument('--unit-days',
+                       type=int,
+                       help='Backfill: days per work unit (default: BACKFILL_UNIT_DAYS)')
+    parser.add_argument('--workers',
+                       type=int,
+                       help='Backfill: max concurrent units / source queries (default: BACKFILL_MAX_CONCURRENCY)')
+    parser.add_argument('--max-rows-per-second',
+                       type=float,
+                       help='Backfill: source rows/s limit, 0 for none (default: BACKFILL_MAX_ROWS_PER_SECOND)')
+    parser.add_argument('--newest-first',
+                       action='store_true',
+                       help='Backfill: run the most recent units first')
+    parser.add_argument('--restart',
+                       action='store_true',
+                       help='Backfill/replay: redo units or cached chunks already recorded as loaded')
+    parser.add_argument('--refresh-dimensions',
+                       action='store_true',
+                       help='Refresh the tms_dim_* mirror of the source dimension tables in Database B')
+    parser.add_argument('--full-refresh',
+                       action='store_true',
+                       help='With --refresh-dimensions: reload every row and drop rows deleted on Database A; '
+                            'with --refresh-marts: rebuild every day')
+    parser.add_argument('--refresh-marts',
+                       choices=['fact_order', 'fact_delivery', 'both'],
+                       help='Refresh the daily tms_mart_* aggregates for the fact days synced since the last refresh')
+    parser.add_argument('--replay',
+                       metavar='RUN_ID',
+                       help='Load the cached chunks of a run into Database B without querying Database A')
+    parser.add_argument('--list-cache',
+                       action='store_true',
+                       help='List runs in the chunk cache (CHUNK_CACHE_DIR)')
+    parser.add_argument('--cdc-drop-slot',
+                       action='store_true',
+                       help='Drop the CDC replication slot on Database A and exit')
     
     args = parser.parse_args()
     
@@ -197,34 +438,88 @@ def main():
             error_str = error[:30] + '...' if error and len(error) > 30 else error or ''
             
             print(f"{sync_type:<15} {start_str:<20} {end_str:<20} {status:<10} {records or 0:<8} {error_str}")
+    elif args.history:
+        from sync_log_retention import get_sync_history
+        history_rows = get_sync_history(db_manager, args.history, args.status_type)
+        
+        if not history_rows:
+            print("No sync history found.")
+            return
+        
+        print(f"\n{'Date':<12} {'Sync Type':<15} {'Runs':>6} {'OK':>6} {'Failed':>6} {'Avg (s)':>9} {'Max (s)':>9} {'Records':>12}")
+        print("-" * 82)
+        
+        for log_date, sync_type, runs, successful, failed, seconds, max_seconds, records in history_rows:
+            average = float(seconds or 0) / runs if runs else 0
+            print(f"{log_date!s:<12} {sync_type:<15} {runs:>6} {successful:>6} {failed:>6} "
+                  f"{average:>9.1f} {float(max_seconds or 0):>9.1f} {records or 0:>12}")
+    elif args.compact_log:
+        from sync_log_retention import compact_sync_log
+        create_sync_log_table(db_manager)
+        compact_sync_log(db_manager)
+    elif args.command == 'backfill':
+        dates = parse_date_args(args)
+        if dates is None:
+            return
+        run_backfill_command(args.sync or 'both', dates[0], dates[1], args)
+    elif args.plan_diff:
+        from query_plans import print_plan_diff
+        old_run, new_run = args.plan_runs or (None, None)
+        print_plan_diff(args.plan_diff, old_run, new_run, db_manager=db_manager)
+    elif args.list_cache:
+        from chunk_cache import list_runs
+        list_runs()
+    elif args.replay:
+        from chunk_cache import replay_run
+        create_sync_log_table(db_manager)
+        sync_id = log_sync_start(db_manager, f'replay_{args.replay}'[:50])
+        try:
+            rows = replay_run(args.replay, include_loaded=args.restart, db_manager=db_manager)
+        except Exception as e:
+            logger.error(f"Replay failed: {e}")
+            log_sync_complete(db_manager, sync_id, 'FAILED', error_message=str(e))
+            raise
+        log_sync_complete(db_manager, sync_id, 'SUCCESS', records_processed=rows)
+    elif args.refresh_dimensions:
+        from dimension_mirror import refresh_dimensions, print_dimension_status
+        refresh_dimensions(db_manager, full=args.full_refresh)
+        print_dimension_status(db_manager)
+    elif args.refresh_marts:
+        from fact_marts import refresh_marts, print_mart_status
+        fact_names = ['fact_order', 'fact_delivery'] if args.refresh_marts == 'both' else [args.refresh_marts]
+        refresh_marts(db_manager, fact_names, full=args.full_refresh)
+        print_mart_status(db_manager, fact_names)
+    elif args.health:
+        from sync_daemon import check_daemon_health
+        sys.exit(0 if check_daemon_health() else 1)
+    elif args.daemon:
+        from sync_daemon import SyncDaemon
+        SyncDaemon(args.daemon).run()
+    elif args.cdc_drop_slot:
+        from cdc_ingest import drop_replication_slot
+        drop_replication_slot()
+    elif args.cdc:
+        from cdc_ingest import run_cdc
+        run_cdc(args.cdc)
+    elif args.reconcile:
+        dates = parse_date_args(args)
+        if dates is None:
+            return
+        run_reconcile(args.reconcile, date_from=dates[0], date_to=dates[1],
+                      bucket_mode=args.bucket, buckets=args.buckets, resync=args.resync)
     elif args.sync:
         # Validate date format if provided
-        date_from = None
-        date_to = None
-        
-        if args.date_from:
-            try:
-                from datetime import datetime
-                date_from = datetime.strptime(args.date_from, '%Y-%m-%d').date()
-                logger.info(f"Filtering from date: {date_from}")
-            except ValueError:
-                logger.error("Invalid date format for --date-from. Use YYYY-MM-DD format.")
-                return
-        
-        if args.date_to:
-            try:
-                from datetime import datetime
-                date_to = datetime.strptime(args.date_to, '%Y-%m-%d').date()
-                logger.info(f"Filtering to date: {date_to}")
-            except ValueError:
-                logger.error("Invalid date format for --date-to. Use YYYY-MM-DD format.")
-                return
+        dates = parse_date_args(args)
+        if dates is None:
+            return
+        date_from, date_to = dates
         
         # Run synchronization
         logger.info(f"Starting {args.sync} synchronization...")
         if date_from or date_to:
             logger.info(f"Date filter: {date_from} to {date_to}")
-        run_sync(args.sync, date_from=date_from, date_to=date_to)
+        run_sync(args.sync, date_from=date_from, date_to=date_to, shared=args.shared_extract or None,
+                 engine=args.engine, explain=args.explain)
         logger.info("Synchronization completed successfully!")
     else:
         parser.print_help()
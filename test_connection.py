@@ -115,6 +115,33 @@ def test_table_creation():
         logger.error(f"✗ Table creation test failed: {e}")
         return False
 
+def test_dimension_mirror():
+    """Test one dimension mirror refresh from Database A into its tms_dim_* table"""
+    try:
+        logger.info("Testing dimension mirror refresh...")
+        from dimension_mirror import create_dimension_tables, refresh_dimension, get_mirror_table
+        from sqlalchemy import text
+        
+        db_manager = DatabaseManager()
+        create_dimension_tables(db_manager)
+        
+        # A small mirror; a full refresh writes every column the upsert stages
+        table = 'dma_kenek'
+        rows = refresh_dimension(db_manager, table, full=True)
+        
+        with db_manager.get_db_b_engine().connect() as conn:
+            count = conn.execute(text(f"SELECT COUNT(*) FROM {get_mirror_table(table)}")).scalar()
+        if count != rows:
+            logger.error(f"✗ Dimension mirror test failed: copied {rows} rows but {get_mirror_table(table)} has {count}")
+            return False
+        
+        logger.info(f"✓ Dimension mirror test successful. Mirrored {rows} row(s) of {table}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"✗ Dimension mirror test failed: {e}")
+        return False
+
 def main():
     """Main function"""
     logger.info("Starting database connection tests...")
@@ -129,6 +156,12 @@ def main():
         logger.error("Table creation test failed!")
         sys.exit(1)
     
+    # Test the dimension mirror when it feeds the syncs
+    from dimension_mirror import DIMENSION_MIRROR
+    if DIMENSION_MIRROR and not test_dimension_mirror():
+        logger.error("Dimension mirror test failed!")
+        sys.exit(1)
+    
     logger.info("All tests passed! Your database configuration is working correctly.")
     logger.info("You can now run the synchronization programs.")
 
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Upsert Strategies
+Pluggable implementations of the DataFrame -> Database B merge used by
+DatabaseManager.upsert_dataframe_to_db. Every strategy works on an open
+SQLAlchemy connection and leaves committing to the caller.
+"""
+
+import io
+import os
+import struct
+from datetime import datetime, date, time as dt_time
+from decimal import Decimal
+import pandas as pd
+from database_utils import logger
+
+DEFAULT_UPSERT_STRATEGY = 'to_sql'
+
+PG_EPOCH_DATE = date(2000, 1, 1)
+PG_EPOCH_TIMESTAMP = datetime(2000, 1, 1)
+PGCOPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+PGCOPY_TRAILER = struct.pack('!h', -1)
+
+def dataframe_to_records(df):
+    """Convert a DataFrame to a list of tuples with NaN/NaT replaced by None"""
+    return list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+
+def get_column_types(conn, relation):
+    """Return {column: formatted PostgreSQL type} for a table or temp table"""
+    from sqlalchemy import text
+    rows = conn.execute(text("""
+        SELECT attname, format_type(atttypid, atttypmod)
+        FROM pg_attribute
+        WHERE attrelid = CAST(:relation AS regclass) AND attnum > 0 AND NOT attisdropped
+    """), {"relation": relation}).fetchall()
+    return {row[0]: row[1] for row in rows}
+
+def build_on_conflict_clause(columns, unique_columns):
+    """Return the ON CONFLICT ... DO UPDATE clause shared by the INSERT based strategies"""
+    conflict_columns = ', '.join(unique_columns)
+    update_columns = ', '.join([f'{col} = EXCLUDED.{col}' for col in columns if col not in unique_columns])
+    if not update_columns:
+        return f"ON CONFLICT ({conflict_columns}) DO NOTHING"
+    return f"ON CONFLICT ({conflict_columns}) DO UPDATE SET {update_columns}"
+
+class UpsertStrategy:
+    """Base class: merge a DataFrame into schema.table_name keyed on unique_columns"""
+
+    name = None
+
+    def upsert(self, conn, df, schema, table_name, unique_columns):
+        """Merge df into the target table and return the number of rows sent"""
+        raise NotImplementedError
+
+    @staticmethod
+    def raw_cursor(conn):
+        """Return a psycopg2 cursor that shares the SQLAlchemy connection's transaction"""
+        return conn.connection.dbapi_connection.cursor()
+
+class StagedUpsertStrategy(UpsertStrategy):
+    """Load rows into a transaction-scoped temp table, then merge with one statement"""
+
+    merge_method = 'on_conflict'
+
+    def create_stage(self, conn, schema, table_name, columns):
+        """Create an ON COMMIT DROP temp table shaped like the target table"""
+        from sqlalchemy import text
+        stage_table = f"stage_{table_name}_{os.getpid()}"
+        conn.execute(text(f"DROP TABLE IF EXISTS {stage_table}"))
+        conn.execute(text(
+            f"CREATE TEMP TABLE {stage_table} (LIKE {schema}.{table_name} INCLUDING DEFAULTS) ON COMMIT DROP"
+        ))
+        return stage_table
+
+    def load_stage(self, conn, df, stage_table, columns):
+        """Copy df into the staging table"""
+        raise NotImplementedError
+
+    def upsert(self, conn, df, schema, table_name, unique_columns):
+        columns = df.columns.tolist()
+        stage_table = self.create_stage(conn, schema, table_name, columns)
+        self.load_stage(conn, df, stage_table, columns)
+        merge_staged_rows(conn, self.merge_method, stage_table, schema, table_name, columns, unique_columns)
+        return len(df)
+
+def merge_staged_rows(conn, method, stage_table, schema, table_name, columns, unique_columns):
+    """Merge a staging table into the target with ON CONFLICT, MERGE or UPDATE-then-INSERT"""
+    from sqlalchemy import text
+    columns_str = ', '.join(columns)
+    target = f"{schema}.{table_name}"
+    join_condition = ' AND '.join([f't.{col} = s.{col}' for col in unique_columns])
+    set_clause = ', '.join([f'{col} = s.{col}' for col in columns if col not in unique_columns])
+
+    if method == 'on_conflict':
+        conn.execute(text(f"""
+            INSERT INTO {target} ({columns_str})
+            SELECT {columns_str} FROM {stage_table}
+            {build_on_conflict_clause(columns, unique_columns)}
+        """))
+    elif method == 'merge':
+        # MERGE requires PostgreSQL 15 or newer
+        source_columns = ', '.join([f's.{col}' for col in columns])
+        matched = f"WHEN MATCHED THEN UPDATE SET {set_clause}" if set_clause else ""
+        conn.execute(text(f"""
+            MERGE INTO {target} AS t
+            USING {stage_table} AS s
+            ON {join_condition}
+            {matched}
+            WHEN NOT MATCHED THEN INSERT ({columns_str}) VALUES ({source_columns})
+        """))
+    elif method == 'update_insert':
+        if set_clause:
+            conn.execute(text(f"""
+                UPDATE {target} AS t SET {set_clause}
+                FROM {stage_table} AS s
+                WHERE {join_condition}
+            """))
+        conn.execute(text(f"""
+            INSERT INTO {target} ({columns_str})
+            SELECT {columns_str} FROM {stage_table} AS s
+            WHERE NOT EXISTS (SELECT 1 FROM {target} AS t WHERE {join_condition})
+        """))
+    else:
+        raise ValueError(f"Invalid merge method: {method}")
+
+class ToSqlUpsertStrategy(UpsertStrategy):
+    """pandas to_sql into a regular temp_<table> table plus INSERT ... ON CONFLICT"""
+
+    name = 'to_sql'
+
+    def upsert(self, conn, df, schema, table_name, unique_columns):
+        from sqlalchemy import text
+        temp_table_name = f"temp_{table_name}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+        if not conn.in_transaction():
+            # Otherwise to_sql begins and commits its own transaction, and a failed merge
+            # leaves temp_<table> behind; the caller commits staging and merge together
+            conn.begin()
+        df.to_sql(temp_table_name, conn, schema=schema, if_exists='replace', index=False)
+
+        columns = df.columns.tolist()
+        columns_str = ', '.join(columns)
+        conn.execute(text(f"""
+            INSERT INTO {schema}.{table_name} ({columns_str})
+            SELECT {columns_str} FROM {schema}.{temp_table_name}
+            {build_on_conflict_clause(columns, unique_columns)}
+        """))
+        conn.execute(text(f"DROP TABLE IF EXISTS {schema}.{temp_table_name}"))
+        return len(df)
+
+class ExecuteManyUpsertStrategy(UpsertStrategy):
+    """cursor.executemany of a single-row INSERT ... ON CONFLICT"""
+
+    name = 'executemany'
+
+    def upsert(self, conn, df, schema, table_name, unique_columns):
+        columns = df.columns.tolist()
+        placeholders = ', '.join(['%s' for _ in columns])
+        query = f"""
+            INSERT INTO {schema}.{table_name} ({', '.join(columns)})
+            VALUES ({placeholders})
+            {build_on_conflict_clause(columns, unique_columns)}
+        """
+        with self.raw_cursor(conn) as cursor:
+            cursor.executemany(query, dataframe_to_records(df))
+        return len(df)
+
+class ExecuteValuesUpsertStrategy(UpsertStrategy):
+    """psycopg2.extras.execute_values multi-row INSERT ... ON CONFLICT"""
+
+    name = 'execute_values'
+    page_size = 1000
+
+    def upsert(self, conn, df, schema, table_name, unique_columns):
+        from psycopg2.extras import execute_values
+        columns = df.columns.tolist()
+        query = f"""
+            INSERT INTO {schema}.{table_name} ({', '.join(columns)})
+            VALUES %s
+            {build_on_conflict_clause(columns, unique_columns)}
+        """
+        with self.raw_cursor(conn) as cursor:
+            execute_values(cursor, query, dataframe_to_records(df), page_size=self.page_size)
+        return len(df)
+
+class CopyTextUpsertStrategy(StagedUpsertStrategy):
+    """COPY ... FROM STDIN (CSV) into a temp table plus INSERT ... ON CONFLICT"""
+
+    name = 'copy_text'
+
+    def load_stage(self, conn, df, stage_table, columns):
+        buffer = io.StringIO()
+        df.to_csv(buffer, index=False, header=False, na_rep='\\N')
+        buffer.seek(0)
+        with self.raw_cursor(conn) as cursor:
+            cursor.copy_expert(
+                f"COPY {stage_table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+                buffer
+            )
+
+class CopyBinaryUpsertStrategy(StagedUpsertStrategy):
+    """COPY ... FROM STDIN (BINARY) into a temp table plus INSERT ... ON CONFLICT"""
+
+    name = 'copy_binary'
+
+    def load_stage(self, conn, df, stage_table, columns):
+        column_types = get_column_types(conn, stage_table)
+        null_field = struct.pack('!i', -1)
+
+        def encode_field(encode, value):
+            data = encode(value)
+            return struct.pack('!i', len(data)) + data
+
+        # Encode column by column; categorical columns encode each distinct value
+        # once and the rows just pick the field bytes by code
+        fields = []
+        for col in columns:
+            encode = get_binary_encoder(column_types[col])
+            series = df[col]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                encoded = [encode_field(encode, value) for value in series.cat.categories]
+                fields.append([encoded[code] if code >= 0 else null_field for code in series.cat.codes])
+            else:
+                values = series.astype(object).where(series.notna(), None)
+                fields.append([null_field if value is None else encode_field(encode, value) for value in values])
+
+        buffer = io.BytesIO()
+        buffer.write(PGCOPY_HEADER)
+        field_count = struct.pack('!h', len(columns))
+        for row in zip(*fields):
+            buffer.write(field_count)
+            buffer.write(b''.join(row))
+        buffer.write(PGCOPY_TRAILER)
+        buffer.seek(0)
+
+        with self.raw_cursor(conn) as cursor:
+            cursor.copy_expert(f"COPY {stage_table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT binary)", buffer)
+
+class MergeUpsertStrategy(CopyTextUpsertStrategy):
+    """COPY into a temp table plus a MERGE statement (PostgreSQL 15+)"""
+
+    name = 'merge'
+    merge_method = 'merge'
+
+class UpdateInsertUpsertStrategy(CopyTextUpsertStrategy):
+    """COPY into a temp table, UPDATE matching rows, then INSERT the rest"""
+
+    name = 'update_insert'
+    merge_method = 'update_insert'
+
+UPSERT_STRATEGIES = {
+    strategy.name: strategy for strategy in (
+        ToSqlUpsertStrategy,
+        ExecuteManyUpsertStrategy,
+        ExecuteValuesUpsertStrategy,
+        CopyTextUpsertStrategy,
+        CopyBinaryUpsertStrategy,
+        MergeUpsertStrategy,
+        UpdateInsertUpsertStrategy,
+    )
+}
+
+def get_upsert_strategy(name):
+    """Return a strategy instance by name"""
+    try:
+        return UPSERT_STRATEGIES[name]()
+    except KeyError:
+        raise ValueError(f"Invalid upsert strategy: {name}. Choose from {', '.join(UPSERT_STRATEGIES)}")
+
+def get_configured_upsert_strategy(table_name):
+    """Resolve the strategy name for a table from config.env.
+
+    UPSERT_STRATEGY_<TABLE_NAME> wins over UPSERT_STRATEGY, which defaults to to_sql.
+    """
+    return (os.getenv(f'UPSERT_STRATEGY_{table_name.upper()}')
+            or os.getenv('UPSERT_STRATEGY')
+            or DEFAULT_UPSERT_STRATEGY)
+
+# --- Binary COPY encoders -------------------------------------------------
+
+def _encode_text(value):
+    return str(value).encode('utf-8')
+
+def _encode_date(value):
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    elif isinstance(value, datetime):
+        value = value.date()
+    return struct.pack('!i', (value - PG_EPOCH_DATE).days)
+
+def _encode_timestamp(value):
+    value = pd.Timestamp(value)
+    if value.tzinfo is not None:
+        value = value.tz_convert('UTC').tz_localize(None)
+    delta = value.to_pydatetime() - PG_EPOCH_TIMESTAMP
+    return struct.pack('!q', (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+
+def _encode_time(value):
+    if isinstance(value, str):
+        value = dt_time.fromisoformat(value)
+    elif isinstance(value, (datetime, pd.Timestamp)):
+        value = value.time()
+    micros = ((value.hour * 60 + value.minute) * 60 + value.second) * 1000000 + value.microsecond
+    return struct.pack('!q', micros)
+
+def _encode_numeric(value):
+    """Encode a number in PostgreSQL's base-10000 NUMERIC wire format"""
+    value = value if isinstance(value, Decimal) else Decimal(str(value))
+    if value.is_nan():
+        return struct.pack('!hhHh', 0, 0, 0xC000, 0)
+
+    sign, digits, exponent = value.as_tuple()
+    dscale = max(-exponent, 0)
+    digit_str = ''.join(map(str, digits))
+    if exponent > 0:
+        digit_str += '0' * exponent
+        exponent = 0
+
+    point = len(digit_str) + exponent
+    if point < 0:
+        digit_str = '0' * -point + digit_str
+        point = 0
+    int_part, frac_part = digit_str[:point], digit_str[point:]
+
+    int_part = int_part.zfill((len(int_part) + 3) // 4 * 4)
+    frac_part = frac_part.ljust((len(frac_part) + 3) // 4 * 4, '0')
+    groups = [int(int_part[i:i + 4]) for i in range(0, len(int_part), 4)]
+    weight = len(groups) - 1
+    groups += [int(frac_part[i:i + 4]) for i in range(0, len(frac_part), 4)]
+
+    while groups and groups[0] == 0:
+        groups.pop(0)
+        weight -= 1
+    while groups and groups[-1] == 0:
+        groups.pop()
+    if not groups:
+        weight = 0
+
+    header = struct.pack('!hhHh', len(groups), weight, 0x4000 if sign else 0x0000, dscale)
+    return header + struct.pack(f'!{len(groups)}H', *groups)
+
+def get_binary_encoder(pg_type):
+    """Return the binary COPY encoder for a formatted PostgreSQL type"""
+    pg_type = pg_type.lower()
+    if pg_type.startswith(('character', 'text', 'varchar')):
+        return _encode_text
+    if pg_type == 'date':
+        return _encode_date
+    if pg_type.startswith('timestamp'):
+        return _encode_timestamp
+    if pg_type.startswith('time'):
+        return _encode_time
+    if pg_type.startswith('numeric'):
+        return _encode_numeric
+    if pg_type == 'integer':
+        return lambda value: struct.pack('!i', int(value))
+    if pg_type == 'bigint':
+        return lambda value: struct.pack('!q', int(value))
+    if pg_type == 'double precision':
+        return lambda value: struct.pack('!d', float(value))
+    if pg_type == 'boolean':
+        return lambda value: struct.pack('!?', bool(value))
+    logger.warning(f"No binary encoder for type {pg_type}, sending as text")
+    return _encode_text
@@ -6,24 +6,61 @@ This application provides a web interface to monitor sync status
 
 from flask import Flask, render_template_string, jsonify, request
 import logging
+import gzip
+import threading
 from datetime import datetime
+# database_utils loads config.env and configures logging; it imports no pandas/SQLAlchemy
 from database_utils import DatabaseManager
 from sync_manager import get_sync_status
 import os
-from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv('config.env')
-
-# Configure logging
-logging.basicConfig(
-    level=getattr(logging, os.getenv('LOG_LEVEL', 'INFO')),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
+# Production serving (gunicorn, gthread workers): processes x threads per process
+WEB_SERVER = os.getenv('WEB_SERVER', 'gunicorn').lower()
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', 2))
+WEB_THREADS = int(os.getenv('WEB_THREADS', 8))
+WEB_KEEPALIVE_SECONDS = int(os.getenv('WEB_KEEPALIVE_SECONDS', 5))
+WEB_TIMEOUT_SECONDS = int(os.getenv('WEB_TIMEOUT_SECONDS', 30))
+# JSON responses at least this large are gzip-compressed for clients that accept it
+WEB_GZIP_MIN_BYTES = int(os.getenv('WEB_GZIP_MIN_BYTES', 500))
+
 app = Flask(__name__)
 
+_db_manager = None
+_db_manager_lock = threading.Lock()
+
+def get_db_manager():
+    """DatabaseManager shared by all request threads of this worker process.
+    
+    Created on first use, i.e. after the worker has forked, so every worker has its
+    own Database B pool, sized to at least one connection per request thread.
+    """
+    global _db_manager
+    with _db_manager_lock:
+        if _db_manager is None:
+            db_manager = DatabaseManager()
+            db_manager.pool_size = max(db_manager.pool_size, WEB_THREADS)
+            db_manager.get_db_b_engine()
+            _db_manager = db_manager
+        return _db_manager
+
+@app.after_request
+def gzip_response(response):
+    """Compress JSON responses for clients sending Accept-Encoding: gzip"""
+    if (response.mimetype != 'application/json' or response.direct_passthrough
+            or response.status_code < 200 or response.status_code >= 300
+            or 'Content-Encoding' in response.headers
+            or 'gzip' not in request.headers.get('Accept-Encoding', '').lower()):
+        return response
+    data = response.get_data()
+    if len(data) < WEB_GZIP_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=5))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
 # HTML Template for the dashboard
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -293,8 +330,7 @@ def dashboard():
 def api_status():
     """API endpoint to get sync status"""
     try:
-        db_manager = DatabaseManager()
-        sync_history = get_sync_status(db_manager, limit=20)
+        sync_history = get_sync_status(get_db_manager(), limit=20)
         
         # Calculate statistics
         total_syncs = len(sync_history)
@@ -334,6 +370,30 @@ def api_status():
         logger.error(f"Error getting sync status: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/history')
+def api_history():
+    """API endpoint with daily sync summaries; ?days=N (max 3650) and ?sync_type="""
+    from sync_log_retention import get_sync_history
+    try:
+        days = min(max(request.args.get('days', 30, type=int), 1), 3650)
+        history = get_sync_history(get_db_manager(), days, request.args.get('sync_type'))
+        return jsonify({
+            'days': days,
+            'history': [{
+                'date': log_date.isoformat(),
+                'sync_type': sync_type,
+                'total_runs': runs,
+                'successful_runs': successful,
+                'failed_runs': failed,
+                'avg_seconds': round(float(seconds or 0) / runs, 1) if runs else None,
+                'max_seconds': float(max_seconds) if max_seconds is not None else None,
+                'records_processed': int(records or 0)
+            } for log_date, sync_type, runs, successful, failed, seconds, max_seconds, records in history]
+        })
+    except Exception as e:
+        logger.error(f"Error getting sync history: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/sync/<sync_type>')
 def run_sync(sync_type):
     """Sync endpoint disabled - use command line instead"""
@@ -349,6 +409,32 @@ def status_type_page(sync_type):
     """Status page for specific sync type"""
     return render_template_string(HTML_TEMPLATE)
 
+def serve_gunicorn(host, port):
+    """Serve the app with gunicorn gthread workers; returns False if gunicorn is not installed"""
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        logger.warning("gunicorn is not installed, falling back to the Flask server")
+        return False
+
+    class DashboardApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f"{host}:{port}")
+            self.cfg.set('workers', WEB_WORKERS)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('threads', WEB_THREADS)
+            self.cfg.set('keepalive', WEB_KEEPALIVE_SECONDS)
+            self.cfg.set('timeout', WEB_TIMEOUT_SECONDS)
+            self.cfg.set('accesslog', None)
+
+        def load(self):
+            return app
+
+    logger.info(f"Serving with gunicorn: {WEB_WORKERS} workers x {WEB_THREADS} threads, "
+                f"keep-alive {WEB_KEEPALIVE_SECONDS}s")
+    DashboardApplication().run()
+    return True
+
 if __name__ == '__main__':
     # Get port from environment or use default
     port = int(os.getenv('WEB_PORT', 5000))
@@ -359,4 +445,6 @@ if __name__ == '__main__':
     print(f"🔄 Auto-refresh every 30 seconds")
     print(f"⏹️  Press Ctrl+C to stop")
     
-    app.run(host=host, port=port, debug=False) 
\ No newline at end of file
+    # WEB_SERVER=flask keeps the development server (threaded) for local use
+    if WEB_SERVER != 'gunicorn' or not serve_gunicorn(host, port):
+        app.run(host=host, port=port, debug=False, threaded=True)